@@ -0,0 +1,145 @@
+"""
+Compares writing rows one INSERT ... ON CONFLICT at a time against the
+batched multi-row upsert of DatabaseService, for growing row counts. The rows
+have the shape of dataset_transformations and go to a scratch table that is
+dropped afterwards.
+
+Needs the Postgres of the postgres section of service_config.yml.
+
+Usage (from the command-service directory):
+    python benchmarks/db_batch_benchmark.py --sizes 10 100 1000 --page-size 100
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime as dt
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+os.chdir(SRC_DIR)
+
+from service.db_service import DatabaseService  # noqa: E402
+
+TABLE = "db_batch_benchmark"
+
+CREATE_TABLE = f"""
+    DROP TABLE IF EXISTS {TABLE};
+    CREATE TABLE {TABLE} (
+        id TEXT PRIMARY KEY,
+        dataset_id TEXT,
+        field_key TEXT,
+        transformation_function JSONB,
+        status TEXT,
+        mode TEXT,
+        created_by TEXT,
+        updated_by TEXT,
+        created_date TIMESTAMP,
+        updated_date TIMESTAMP,
+        published_date TIMESTAMP
+    )
+"""
+
+COLUMNS = """
+    id, dataset_id, field_key, transformation_function, status, mode, created_by, updated_by,
+    created_date, updated_date, published_date
+"""
+
+UPDATE = """
+    ON CONFLICT (id) DO UPDATE
+    SET transformation_function = EXCLUDED.transformation_function,
+    status = EXCLUDED.status,
+    mode = EXCLUDED.mode,
+    updated_by = EXCLUDED.updated_by,
+    updated_date = EXCLUDED.updated_date,
+    published_date = EXCLUDED.published_date
+"""
+
+ROW_QUERY = f"INSERT INTO {TABLE} ({COLUMNS}) VALUES ({', '.join(['%s'] * 11)}) {UPDATE}"
+BATCH_QUERY = f"INSERT INTO {TABLE} ({COLUMNS}) VALUES %s {UPDATE}"
+
+
+def build_rows(size):
+    now = dt.now()
+    return [
+        (
+            f"benchmark_field_{i}",
+            "benchmark",
+            f"field_{i}",
+            json.dumps({"type": "mask", "expr": f"$.field_{i}", "condition": None}),
+            "Live",
+            "Strict",
+            "benchmark",
+            "benchmark",
+            now,
+            now,
+            now,
+        )
+        for i in range(size)
+    ]
+
+
+def per_row(db_service, rows, page_size):
+    # one statement, and one commit, per row
+    for row in rows:
+        db_service.execute_upsert(ROW_QUERY, row)
+    return len(rows)
+
+
+def per_row_in_transaction(db_service, rows, page_size):
+    # one statement per row, committed together
+    with db_service.unit_of_work() as uow:
+        for row in rows:
+            uow.execute_upsert(ROW_QUERY, row)
+    return len(rows)
+
+
+def batched(db_service, rows, page_size):
+    # one statement per page of rows, committed together
+    db_service.execute_batch_upsert(BATCH_QUERY, rows, page_size=page_size)
+    return (len(rows) + page_size - 1) // page_size
+
+
+def measure(label, write, db_service, rows, page_size, rounds):
+    # Every round inserts the rows and then updates them through the
+    # conflict clause, the best round is reported
+    best = float("inf")
+    for _ in range(rounds):
+        db_service.execute_delete(f"DELETE FROM {TABLE}", None)
+        start = time.perf_counter()
+        statements = write(db_service, rows, page_size)
+        statements += write(db_service, rows, page_size)
+        best = min(best, time.perf_counter() - start)
+    count = db_service.execute_select_one(f"SELECT COUNT(*) FROM {TABLE}", None)[0]
+    print(f"  {label:<16} {2 * len(rows) / best:>10,.0f} rows/sec ({best:.3f}s, {statements} statements)")
+    if count != len(rows):
+        print(f"ERROR: {label} left {count} rows instead of {len(rows)}")
+        sys.exit(1)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=3)
+    args = parser.parse_args()
+
+    db_service = DatabaseService()
+    db_service.execute_upsert(CREATE_TABLE, None)
+    try:
+        for size in args.sizes:
+            rows = build_rows(size)
+            print(f"{size} rows, inserted then updated, page size {args.page_size}")
+            row_time = measure("per row", per_row, db_service, rows, args.page_size, args.rounds)
+            measure("per row, 1 tx", per_row_in_transaction, db_service, rows, args.page_size, args.rounds)
+            batch_time = measure("batched", batched, db_service, rows, args.page_size, args.rounds)
+            print(f"  speedup          {row_time / batch_time:.2f}x over per row")
+    finally:
+        db_service.execute_upsert(f"DROP TABLE IF EXISTS {TABLE}", None)
+        db_service.close()
+
+
+if __name__ == "__main__":
+    main()
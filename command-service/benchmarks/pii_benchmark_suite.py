@@ -0,0 +1,214 @@
+"""
+Benchmarks DetectPIIService.detect_pii_fields over a synthetic event corpus and
+reports throughput, time spent per rule and memory allocations. Results can be
+saved as JSON and compared against an earlier run.
+
+Usage (from the command-service directory):
+    python benchmarks/pii_benchmark_suite.py --events 2000 --fields 50 --depth 3 \\
+        --value-length 32 --pii-density 0.2 --locales India USA --output baseline.json
+    python benchmarks/pii_benchmark_suite.py ... --baseline baseline.json
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+import tracemalloc
+
+import pii_ruleset_benchmark  # noqa: F401, sets up the src path
+from pii_corpus import CorpusBuilder
+
+from service.detect_pii_service import DetectPIIService
+from service.re_pii_model import rule_locales
+
+
+class TimedPattern:
+    # Stands in for a compiled pattern and adds up the time of every scan
+    def __init__(self, pattern, timings: dict, name: str):
+        self._pattern = pattern
+        self._timings = timings
+        self._name = name
+        timings.setdefault(name, {"calls": 0, "seconds": 0.0})
+
+    def __getattr__(self, attr):
+        return getattr(self._pattern, attr)
+
+    def _timed(self, method, *args):
+        start = time.perf_counter()
+        result = method(*args)
+        timing = self._timings[self._name]
+        timing["seconds"] += time.perf_counter() - start
+        timing["calls"] += 1
+        return result
+
+    def search(self, value):
+        return self._timed(self._pattern.search, value)
+
+    def findall(self, value):
+        return self._timed(self._pattern.findall, value)
+
+    def finditer(self, value):
+        return self._timed(lambda v: list(self._pattern.finditer(v)), value)
+
+
+def new_service() -> DetectPIIService:
+    # A fresh service per pass, so no pass profits from the caches of another
+    return DetectPIIService(enable_process_pool=False)
+
+
+def run(service: DetectPIIService, events: list, locales: list | None):
+    for event in events:
+        service.detect_pii_fields(event, locales=locales)
+
+
+def measure_throughput(events: list, fields: int, rounds: int, locales: list | None) -> dict:
+    best = float("inf")
+    for _ in range(rounds):
+        service = new_service()
+        service.model_for(locales)
+        start = time.perf_counter()
+        run(service, events, locales)
+        best = min(best, time.perf_counter() - start)
+    return {
+        "seconds": best,
+        "events_per_sec": len(events) / best,
+        "fields_per_sec": len(events) * fields / best,
+    }
+
+
+def measure_rules(events: list, locales: list | None) -> dict:
+    service = new_service()
+    ruleset = service.model_for(locales).ruleset
+    timings = {}
+    for entity, entity_rules in ruleset.values.items():
+        for rule in entity_rules.rules:
+            rule.pattern = TimedPattern(rule.pattern, timings, f"{entity}.{rule.name}")
+        if entity_rules.gate is not None:
+            entity_rules.gate = TimedPattern(entity_rules.gate, timings, f"{entity}.gate")
+    run(service, events, locales)
+    return {
+        name: {
+            "calls": timing["calls"],
+            "total_ms": timing["seconds"] * 1000,
+            "us_per_call": timing["seconds"] * 1e6 / timing["calls"] if timing["calls"] else 0.0,
+        }
+        for name, timing in sorted(timings.items())
+    }
+
+
+def measure_allocations(events: list, top: int, locales: list | None) -> dict:
+    service = new_service()
+    service.model_for(locales)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    run(service, events, locales)
+    after = tracemalloc.take_snapshot()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats = after.compare_to(before, "lineno")
+    allocated = sum(stat.size_diff for stat in stats if stat.size_diff > 0)
+    return {
+        "peak_bytes": peak,
+        "retained_bytes": sum(stat.size_diff for stat in stats),
+        "allocated_bytes_per_event": allocated / len(events),
+        "top": [
+            {"site": str(stat.traceback), "size_diff": stat.size_diff, "count_diff": stat.count_diff}
+            for stat in stats[:top]
+        ],
+    }
+
+
+def compare(results: dict, baseline: dict, max_regression: float) -> bool:
+    if baseline["config"] != results["config"]:
+        print("WARNING: baseline was recorded with a different corpus config")
+    ok = True
+    old = baseline["throughput"]["events_per_sec"]
+    new = results["throughput"]["events_per_sec"]
+    change = new / old - 1
+    print(f"events/sec     {old:>12,.0f} -> {new:>12,.0f} ({change:+.1%})")
+    if change < -max_regression:
+        print(f"ERROR: throughput regressed by more than {max_regression:.0%}")
+        ok = False
+    old_peak = baseline["allocations"]["peak_bytes"]
+    new_peak = results["allocations"]["peak_bytes"]
+    print(f"peak bytes     {old_peak:>12,} -> {new_peak:>12,} ({new_peak / max(old_peak, 1) - 1:+.1%})")
+    for name, timing in results["rules"].items():
+        old_rule = baseline["rules"].get(name)
+        if old_rule is None or old_rule["total_ms"] == 0:
+            continue
+        print(f"  {name:<24} {old_rule['total_ms']:>9.1f}ms -> {timing['total_ms']:>9.1f}ms")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=2000)
+    parser.add_argument("--fields", type=int, default=50)
+    parser.add_argument("--depth", type=int, default=1)
+    parser.add_argument("--value-length", type=int, default=16)
+    parser.add_argument("--pii-density", type=float, default=0.2)
+    parser.add_argument("--locales", nargs="+", default=None, help="defaults to every locale of pii_rules.yml")
+    parser.add_argument("--scoped", action="store_true", help="only evaluate the rules of --locales")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--top", type=int, default=10, help="number of allocation sites reported")
+    parser.add_argument("--output", help="writes the results to this JSON file")
+    parser.add_argument("--baseline", help="compares the results against this JSON file")
+    parser.add_argument("--max-regression", type=float, default=0.1)
+    args = parser.parse_args()
+
+    pii_rules = new_service().model.pii_rules
+    config = {
+        "events": args.events,
+        "fields": args.fields,
+        "depth": args.depth,
+        "value_length": args.value_length,
+        "pii_density": args.pii_density,
+        "locales": args.locales or rule_locales(pii_rules),
+        "scoped": args.scoped,
+        "seed": args.seed,
+    }
+    corpus = CorpusBuilder(
+        pii_rules,
+        fields=args.fields,
+        depth=args.depth,
+        value_length=args.value_length,
+        pii_density=args.pii_density,
+        locales=config["locales"],
+        seed=args.seed,
+    )
+    events = corpus.events(args.events)
+    locales = config["locales"] if args.scoped else None
+    print(f"{args.events} events with {args.fields} fields, depth {args.depth}, locales {config['locales']}")
+
+    results = {
+        "config": config,
+        "python": platform.python_version(),
+        "ts": int(time.time() * 1000),
+        "throughput": measure_throughput(events, args.fields, args.rounds, locales),
+        "rules": measure_rules(events, locales),
+        "allocations": measure_allocations(events, args.top, locales),
+    }
+    throughput = results["throughput"]
+    print(f"events/sec     {throughput['events_per_sec']:>12,.0f}")
+    print(f"fields/sec     {throughput['fields_per_sec']:>12,.0f}")
+    print("time per rule")
+    for name, timing in sorted(results["rules"].items(), key=lambda item: -item[1]["total_ms"]):
+        print(f"  {name:<24} {timing['calls']:>9} calls {timing['total_ms']:>9.1f}ms {timing['us_per_call']:>7.2f}us/call")
+    allocations = results["allocations"]
+    print(f"peak bytes     {allocations['peak_bytes']:>12,}")
+    print(f"bytes/event    {allocations['allocated_bytes_per_event']:>12,.0f}")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"results written to {args.output}")
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if not compare(results, baseline, args.max_regression):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Compares batch PII profiling in row mode (every field of every event scanned
+separately) against columnar mode (each field column joined and scanned once
+per entity) for growing sample sizes.
+
+Usage (from the command-service directory):
+    python benchmarks/pii_columnar_benchmark.py --sizes 1000 10000 100000 --fields 20
+"""
+import argparse
+import random
+import sys
+import time
+
+import pii_ruleset_benchmark  # noqa: F401, sets up the src path
+
+from service.detect_pii_service import DetectPIIService
+
+
+# Each field keeps one kind of value across the sample, like a real dataset
+# where only a few columns carry PII.
+COLUMN_KINDS = [
+    lambda rnd: rnd.choice(["completed", "pending", "failed", "in_progress"]),
+    lambda rnd: f"2024-03-{rnd.randint(10, 28)}T10:{rnd.randint(10, 59)}:31Z",
+    lambda rnd: f"{rnd.random() * 1000:.3f}",
+    lambda rnd: rnd.choice(["the quick brown fox", "lorem ipsum dolor sit amet", "hello world"]),
+    lambda rnd: f"do_{rnd.randint(1000, 9999)}_{rnd.randint(100000, 999999)}",
+    lambda rnd: rnd.choice(["true", "false"]),
+    lambda rnd: f"{rnd.randint(6, 9)}{rnd.randint(100000000, 999999999)}",
+    lambda rnd: f"user{rnd.randint(1, 99999)}@example.com",
+]
+
+
+def build_events(size, num_fields, seed):
+    rnd = random.Random(seed)
+    return [
+        {f"field_{i}": COLUMN_KINDS[i % len(COLUMN_KINDS)](rnd) for i in range(num_fields)}
+        for _ in range(size)
+    ]
+
+
+def measure(label, service, events, threshold):
+    service.columnar_threshold = threshold
+    start = time.perf_counter()
+    result = service.profile_events(events).results()
+    elapsed = time.perf_counter() - start
+    print(f"  {label:<9} {len(events) / elapsed:>12,.0f} events/sec ({elapsed:.3f}s)")
+    return result, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--fields", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    service = DetectPIIService()
+    for size in args.sizes:
+        events = build_events(size, args.fields, args.seed)
+        print(f"{size} events with {args.fields} fields")
+        rows, row_time = measure("rows", service, events, threshold=float("inf"))
+        columns, column_time = measure("columnar", service, events, threshold=0)
+        if rows != columns:
+            print("ERROR: columnar profile differs from the row profile")
+            sys.exit(1)
+        print(f"  speedup   {row_time / column_time:.2f}x, identical output")
+
+
+if __name__ == "__main__":
+    main()
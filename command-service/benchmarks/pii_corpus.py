@@ -0,0 +1,125 @@
+"""
+Synthetic event corpus for the PII benchmarks. Events are nested dicts with a
+configurable number of leaf fields, nesting depth, value length and share of
+fields carrying PII. PII values are drawn from the value rules of pii_rules.yml
+whose locale is selected, rules without a locale are always used.
+"""
+import random
+import string
+
+# Sample generators keyed by "<entity>.<rule>" of pii_rules.yml
+PII_GENERATORS = {
+    "address.india": lambda rnd: f"{rnd.randint(1, 99)}, MG Road, Bengaluru {rnd.choice(['KA', 'TN', 'MH', 'DL'])}",
+    "address.us": lambda rnd: f"{rnd.randint(1, 9999)} {rnd.choice(['Baker', 'Main', 'Oak'])} {rnd.choice(['street', 'avenue', 'road'])}",
+    "financial.credit_card": lambda rnd: " ".join(f"{rnd.randint(1000, 9999)}" for _ in range(4)),
+    "financial.iban_number": lambda rnd: f"{rnd.choice(['GB', 'DE', 'FR'])}{rnd.randint(10, 99)}WEST{rnd.randint(10**13, 10**14 - 1)}",
+    "id.aadhaar": lambda rnd: " ".join(f"{rnd.randint(1000, 9999)}" for _ in range(3)),
+    "id.pan": lambda rnd: "".join(rnd.choices(string.ascii_uppercase, k=5)) + f"{rnd.randint(1000, 9999)}" + rnd.choice(string.ascii_uppercase),
+    "id.ssn": lambda rnd: f"{rnd.randint(100, 999)}-{rnd.randint(10, 99)}-{rnd.randint(1000, 9999)}",
+    "internet.email": lambda rnd: f"{rnd.choice(['john', 'asha', 'marie'])}.{rnd.randint(1, 9999)}@example.com",
+    "internet.ipv4": lambda rnd: ".".join(str(rnd.randint(0, 255)) for _ in range(4)),
+    "internet.ipv6": lambda rnd: "fe80::" + ":".join(f"{rnd.randint(0, 65535):x}" for _ in range(4)),
+    "internet.ip_pattern": lambda rnd: ".".join(str(rnd.randint(0, 255)) for _ in range(4)),
+    "phone.india": lambda rnd: f"+91{rnd.randint(6, 9)}{rnd.randint(10**8, 10**9 - 1)}",
+    "phone.france": lambda rnd: f"33{rnd.randint(10**8, 10**9 - 1)}",
+    "phone.germany": lambda rnd: f"T{rnd.randint(10, 99)}{rnd.randint(100000, 999999)}{rnd.randint(0, 9)}L",
+    "phone.uk": lambda rnd: f"44{rnd.randint(10**9, 10**10 - 1)}",
+    "phone.us": lambda rnd: f"+1 {rnd.randint(200, 999)}-{rnd.randint(200, 999)}-{rnd.randint(1000, 9999)}",
+}
+
+FIELD_NAMES = ["status", "desc", "amount", "ts", "txn", "device", "count", "comment"]
+PII_FIELD_NAMES = {
+    "address": ["address", "city"],
+    "financial": ["card", "iban"],
+    "id": ["pan", "ssn", "aadhaar"],
+    "internet": ["email", "ip"],
+    "phone": ["mobile", "phone"],
+}
+WORDS = ["the", "quick", "brown", "fox", "jumps", "over", "lazy", "dog", "lorem", "ipsum"]
+
+
+def pii_generators(pii_rules: dict, locales: list | None = None) -> list:
+    """
+    Returns (entity, generator) pairs for the value rules of the given locales.
+    Rules without a generator are skipped.
+    """
+    generators = []
+    for entity, rules in pii_rules["values"].items():
+        for name, rule in rules.items():
+            if locales is not None and rule["locale"] != "" and rule["locale"] not in locales:
+                continue
+            generator = PII_GENERATORS.get(f"{entity}.{name}")
+            if generator is not None:
+                generators.append((entity, generator))
+    return generators
+
+
+def filler(rnd: random.Random, length: int) -> str:
+    words = []
+    size = -1
+    while size < length:
+        word = rnd.choice(WORDS)
+        words.append(word)
+        size += len(word) + 1
+    return " ".join(words)[:length]
+
+
+class CorpusBuilder:
+    def __init__(
+        self,
+        pii_rules: dict,
+        fields: int = 50,
+        depth: int = 1,
+        value_length: int = 16,
+        pii_density: float = 0.2,
+        locales: list | None = None,
+        seed: int = 42,
+    ):
+        self.fields = fields
+        self.depth = depth
+        self.value_length = value_length
+        self.pii_density = pii_density
+        self.rnd = random.Random(seed)
+        self.generators = pii_generators(pii_rules, locales)
+        if len(self.generators) == 0:
+            raise ValueError(f"no PII generators for locales {locales}")
+        # Every event has the same shape, like the events of one dataset. Each
+        # field either always carries one kind of PII or never does, the PII
+        # fields take turns over the generators so every rule is exercised.
+        self.layout = []
+        pii_fields = 0
+        for index in range(fields):
+            if self.rnd.random() < pii_density:
+                entity, generator = self.generators[pii_fields % len(self.generators)]
+                pii_fields += 1
+                name = self.rnd.choice(PII_FIELD_NAMES.get(entity, FIELD_NAMES))
+            else:
+                generator = None
+                name = self.rnd.choice(FIELD_NAMES)
+            self.layout.append((self._path(index, name), generator))
+
+    def _path(self, index: int, name: str) -> list:
+        # Spreads the leaves over nested objects with up to four keys per level
+        groups = [f"obj_{(index >> (2 * level)) % 4}" for level in range(self.depth - 1)]
+        return groups + [f"{name}_{index}"]
+
+    def _value(self, generator) -> str:
+        if generator is None:
+            return filler(self.rnd, self.value_length)
+        value = generator(self.rnd)
+        if len(value) + 1 < self.value_length:
+            # embeds the PII in free text of the configured length
+            value = f"{filler(self.rnd, self.value_length - len(value) - 1).rstrip()} {value}"
+        return value
+
+    def event(self) -> dict:
+        event = {}
+        for path, generator in self.layout:
+            parent = event
+            for key in path[:-1]:
+                parent = parent.setdefault(key, {})
+            parent[path[-1]] = self._value(generator)
+        return event
+
+    def events(self, count: int) -> list:
+        return [self.event() for _ in range(count)]
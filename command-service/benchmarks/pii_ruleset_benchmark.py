@@ -0,0 +1,139 @@
+"""
+Compares PII field detection throughput of the raw pattern strings in
+pii_rules.yml (re.findall per rule, entity and field) against the compiled
+ruleset used by DetectPIIService.
+
+Usage (from the command-service directory):
+    python benchmarks/pii_ruleset_benchmark.py --fields 500 --rounds 5
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import time
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+sys.path.insert(0, SRC_DIR)
+os.chdir(SRC_DIR)
+
+from service.detect_pii_service import DetectPIIService  # noqa: E402
+
+SAMPLE_VALUES = [
+    "9876543210",
+    "user.name@example.com",
+    "192.168.10.24",
+    "4321 8765 1234",
+    "ABCDE1234F",
+    "123-45-6789",
+    "221 Baker street",
+    "KA",
+    "GB82WEST12345698765432",
+    "completed",
+    "The quick brown fox jumps over the lazy dog",
+    "2024-03-14T10:22:31Z",
+    "3.14159",
+    "true",
+]
+
+SAMPLE_FIELDS = ["mobile", "email", "ip", "id", "address", "txn", "status", "desc"]
+
+
+def build_event(num_fields, seed):
+    rnd = random.Random(seed)
+    return {
+        f"{rnd.choice(SAMPLE_FIELDS)}_{i}": rnd.choice(SAMPLE_VALUES)
+        for i in range(num_fields)
+    }
+
+
+def legacy_detect_pii_fields(pii_rules, event_data):
+    # Detection as implemented before the compiled ruleset.
+    def detect_entity(entity, value):
+        matches = []
+        for rule in list(pii_rules["values"][entity].keys()):
+            rule_matches = list(re.findall(pii_rules["values"][entity][rule]["rule"], value))
+            if len(rule_matches) != 0:
+                matches.append({
+                    "code": pii_rules["values"][entity][rule]["code"],
+                    "resourceKey": pii_rules["values"][entity][rule]["resourceKey"],
+                    "region": pii_rules["values"][entity][rule]["locale"],
+                    "score": 1 / len(rule_matches),
+                })
+        return matches
+
+    def detect_entity_in_fieldname(entity, value):
+        # field-name rules were \b alternations of the keywords
+        rule = "|".join(rf"\b{re.escape(keyword)}\b" for keyword in pii_rules["keys"][entity]["keywords"])
+        rule_matches = list(re.findall(rule, value))
+        if len(rule_matches) == 0:
+            return []
+        return [{
+            "code": pii_rules["keys"][entity]["code"],
+            "resourceKey": pii_rules["keys"][entity]["resourceKey"],
+            "region": pii_rules["keys"][entity]["locale"],
+            "score": 1 / len(rule_matches),
+        }]
+
+    results = []
+    for field in list(event_data.keys()):
+        for entity in ["address", "financial", "id", "internet", "phone"]:
+            reasons = detect_entity(entity, str(event_data[field]))
+            reasons += detect_entity_in_fieldname(entity, field)
+            if len(reasons) != 0:
+                results.append({
+                    "field": field,
+                    "type": entity,
+                    "score": 1 / len(reasons),
+                    "reason": reasons,
+                })
+    return results
+
+
+def value_reasons(pii_rules, results):
+    # Field names are tokenized since the keyword index, only value detections
+    # are expected to be identical
+    key_resources = {rule["resourceKey"] for rule in pii_rules["keys"].values()}
+    detections = []
+    for result in results:
+        reasons = [reason for reason in result["reason"] if reason["resourceKey"] not in key_resources]
+        if len(reasons) != 0:
+            detections.append((result["field"], result["type"], reasons))
+    return detections
+
+
+def measure(label, func, event, rounds):
+    start = time.perf_counter()
+    for _ in range(rounds):
+        result = func(event)
+    elapsed = time.perf_counter() - start
+    fields_per_sec = len(event) * rounds / elapsed
+    print(f"{label:<10} {fields_per_sec:>12,.0f} fields/sec ({elapsed:.3f}s)")
+    return result, fields_per_sec
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fields", type=int, default=500)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    service = DetectPIIService()
+    event = build_event(args.fields, args.seed)
+    print(f"Event with {len(event)} fields, {args.rounds} rounds")
+
+    before, before_rate = measure(
+        "before", lambda e: legacy_detect_pii_fields(service.model.pii_rules, e), event, args.rounds
+    )
+    after, after_rate = measure("after", service.detect_pii_fields, event, args.rounds)
+
+    pii_rules = service.model.pii_rules
+    if value_reasons(pii_rules, before) != value_reasons(pii_rules, after):
+        print("ERROR: compiled ruleset output differs from the raw rules")
+        sys.exit(1)
+    print(f"speedup    {after_rate / before_rate:.2f}x, identical value detections")
+
+
+if __name__ == "__main__":
+    main()
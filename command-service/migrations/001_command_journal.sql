@@ -0,0 +1,27 @@
+-- Command journal of the command service: every command run and the status,
+-- timings and response of each of its steps. updated_at is refreshed by the
+-- heartbeat of the process that owns a queued or running command.
+CREATE TABLE IF NOT EXISTS command_journal (
+    command_id TEXT PRIMARY KEY,
+    dataset_id TEXT NOT NULL,
+    command TEXT NOT NULL,
+    status TEXT NOT NULL,
+    submitted_at BIGINT NOT NULL,
+    started_at BIGINT,
+    finished_at BIGINT,
+    error_message TEXT,
+    owner TEXT,
+    updated_at BIGINT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS command_journal_status_idx ON command_journal (status);
+
+CREATE TABLE IF NOT EXISTS command_journal_steps (
+    command_id TEXT NOT NULL REFERENCES command_journal (command_id) ON DELETE CASCADE,
+    action TEXT NOT NULL,
+    status TEXT NOT NULL,
+    started_at BIGINT,
+    finished_at BIGINT,
+    error_message TEXT,
+    result JSONB,
+    PRIMARY KEY (command_id, action)
+);
@@ -0,0 +1,123 @@
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+from command.command_executor import CommandExecutor, StepOutcome
+from command.command_jobs import CommandJobQueue, flight_key
+from command.single_flight import Flight
+from model.data_models import ActionResponse, Command, CommandJob, CommandPayload, CommandStatus
+
+# response of a command or the exception it raised
+Outcome = Tuple[ActionResponse | None, BaseException | None]
+
+
+class BulkCommandRunner:
+    """
+    Runs one command for many datasets, up to max_concurrency datasets at a
+    time. Steps listed in shared_steps do not depend on the dataset, such as the
+    Flink pipeline restart. They run once for the whole batch.
+
+    Each dataset first runs the steps that do not depend on a shared step. The
+    shared steps then run once for the datasets that got that far. Their outcome
+    is recorded on each of those datasets, which go on with their remaining
+    steps. Helm releases are listed once per namespace for the whole batch.
+
+    Like single commands, a dataset whose command is already in flight is not
+    run again, it gets the command in flight.
+    """
+
+    def __init__(
+        self,
+        command_executor: CommandExecutor,
+        command_jobs: CommandJobQueue,
+        max_concurrency: int = 4,
+        shared_steps: List[str] | None = None,
+    ):
+        self.command_executor = command_executor
+        self.command_jobs = command_jobs
+        self.max_concurrency = max_concurrency
+        self.shared_steps = shared_steps or []
+
+    def run(self, command: Command, dataset_ids: List[str], ts: int) -> List[CommandJob]:
+        # Datasets whose command is already in flight get that command, those
+        # whose command runs on another replica wait for it after the batch
+        workflow = self.command_executor.get_command_workflow(command.name)
+        payloads = [CommandPayload(dataset_id=dataset_id, command=command) for dataset_id in dataset_ids]
+        flights = [self.command_jobs.join(payload, ts) for payload in payloads]
+        replica_lock = self.command_jobs.new_replica_lock()
+        batch: List[Tuple[CommandPayload, Flight]] = []
+        elsewhere: List[Tuple[CommandPayload, Flight]] = []
+        for payload, (flight, leader) in zip(payloads, flights):
+            if leader:
+                self.command_jobs.track(flight.job)
+                if replica_lock.try_acquire(flight_key(payload)):
+                    batch.append((payload, flight))
+                else:
+                    elsewhere.append((payload, flight))
+        shared_steps: Dict[str, StepOutcome | None] = {
+            step: None for step in workflow if step in self.shared_steps
+        }
+        outcomes: Dict[str, Outcome] = {}
+        try:
+            with self.command_executor.connector_command.shared_release_listing(), ThreadPoolExecutor(
+                max_workers=self.max_concurrency, thread_name_prefix="bulk"
+            ) as pool:
+                list(pool.map(lambda item: self._execute(item[0], ts, item[1].job, shared_steps, outcomes), batch))
+                waiting = [
+                    (payload, flight)
+                    for payload, flight in batch
+                    if flight.job.status == CommandStatus.Running.name
+                ]
+                if len(shared_steps) != 0 and len(waiting) != 0:
+                    for step in shared_steps:
+                        shared_steps[step] = self._run_shared_step(step, [payload for payload, _ in waiting], ts)
+                    list(pool.map(
+                        lambda item: self._execute(item[0], ts, item[1].job, shared_steps, outcomes), waiting
+                    ))
+                replica_lock.release()
+                list(pool.map(lambda item: self._execute_exclusive(item[0], ts, item[1].job, outcomes), elsewhere))
+        finally:
+            replica_lock.release()
+            for _, flight in batch + elsewhere:
+                self.command_jobs.release(flight.job)
+                result, error = outcomes.get(flight.job.command_id, (None, None))
+                self.command_jobs.flights.land(flight, result=result, error=error)
+        for flight, leader in flights:
+            if not leader:
+                flight.done.wait(self.command_jobs.flight_wait_seconds)
+        return [flight.job for flight, _ in flights]
+
+    def _execute(
+        self,
+        payload: CommandPayload,
+        ts: int,
+        job: CommandJob,
+        shared_steps: Dict[str, StepOutcome | None],
+        outcomes: Dict[str, Outcome],
+    ):
+        try:
+            result = self.command_executor.execute_command(payload=payload, ts=ts, job=job, shared_steps=shared_steps)
+            outcomes[job.command_id] = result, None
+        except BaseException as e:
+            outcomes[job.command_id] = None, e
+            print(f"Command {job.command_id} {job.command} for dataset {job.dataset_id} failed - ", e)
+
+    def _execute_exclusive(self, payload: CommandPayload, ts: int, job: CommandJob, outcomes: Dict[str, Outcome]):
+        try:
+            result = self.command_jobs.run_exclusive(payload, ts, job, self.command_jobs.new_replica_lock())
+            outcomes[job.command_id] = result, None
+        except BaseException as e:
+            outcomes[job.command_id] = None, e
+            print(f"Command {job.command_id} {job.command} for dataset {job.dataset_id} failed - ", e)
+
+    def _run_shared_step(self, step: str, payloads: List[CommandPayload], ts: int) -> StepOutcome:
+        # A shared step acts the same for every dataset, it runs with the payload of the first one
+        print(f"Executing shared command {step} for datasets {[payload.dataset_id for payload in payloads]}")
+        try:
+            return self.command_executor.run_step(payloads[0], step, ts)
+        except BaseException as e:
+            # like a step that raises, it stops the workflow of every dataset
+            print(f"Shared command {step} failed - ", e)
+            error = ActionResponse(
+                status="ERROR", status_code=500, error_message=getattr(e, "message", None) or str(e)
+            )
+            return error, True
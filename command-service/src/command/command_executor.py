@@ -1,9 +1,16 @@
 import logging
+import os
+import socket
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, List, Set, Tuple
 
 import psycopg2
 from urllib3.exceptions import MaxRetryError, NewConnectionError
 
 from command.alert_manager_command import AlertManagerService
+from command.command_jobs import finish_job, finish_step, now_millis, start_step
+from command.command_journal import CommandJournal
 from command.connector_command import ConnectorCommand
 from command.dataset_command import DatasetCommand
 from command.db_command import DBCommand
@@ -12,11 +19,22 @@ from command.flink_command import FlinkCommand
 from command.telemetry_command import TelemetryCommand
 from command.kafka_command import KafkaCommand
 from config import Config
-from model.data_models import Action, ActionResponse, CommandPayload
+from model.data_models import (
+    Action,
+    ActionResponse,
+    CommandJob,
+    CommandPayload,
+    CommandStatus,
+    StepProgress,
+    StepStatus,
+)
 from service.db_service import DatabaseService
 from service.http_service import HttpService
 from service.telemetry_service import TelemetryService
 
+# response of a step and whether it stops the workflow
+StepOutcome = Tuple[ActionResponse | None, bool]
+
 
 class CommandExecutor:
 
@@ -67,47 +85,241 @@ class CommandExecutor:
             self.alert_manager_command
         )
         self.action_commands[Action.CREATE_AUDIT_EVENT.name] = self.audit_event_command
+        self.max_parallel_steps = self.config_obj.find("workflow.max_parallel_steps")
+        self.journal = CommandJournal(
+            self.db_service,
+            # a restarted container of the same pod takes its commands over at once
+            owner=f"{socket.gethostname()}:{os.getpid()}",
+            heartbeat_seconds=self.config_obj.find("command_journal.heartbeat_seconds"),
+            stale_after_seconds=self.config_obj.find("command_journal.stale_after_seconds"),
+        )
         self.logger = logging.getLogger()
 
-    def execute_command(self, payload: CommandPayload, ts: int):
+    def new_job(self, payload: CommandPayload, ts: int) -> CommandJob:
+        command = payload.command.name
+        return CommandJob(
+            command_id=str(uuid.uuid4()),
+            dataset_id=payload.dataset_id,
+            command=command,
+            steps=[StepProgress(action=action) for action in self.get_command_workflow(command)],
+            submitted_at=ts,
+        )
+
+    def load_job(self, command_id: str) -> CommandJob | None:
+        # Steps of the journal are put in the order of the current workflow
+        job = self.journal.load(command_id)
+        if job is None:
+            return None
+        steps = {step.action: step for step in job.steps}
+        job.steps = [
+            steps.get(action) or StepProgress(action=action)
+            for action in self.get_command_workflow(job.command)
+        ]
+        return job
+
+    def adopt_job(self, job: CommandJob, finished: CommandJob) -> ActionResponse | None:
+        # job takes the outcome of the same command that finished on another
+        # replica, instead of running it again
+        print(f"Command {job.command_id} takes the outcome of command {finished.command_id}")
+        job.steps = finished.steps
+        job.status = finished.status
+        job.started_at = finished.started_at
+        job.finished_at = finished.finished_at
+        job.error_message = finished.error_message
+        self.journal.save_command(job)
+        for step in job.steps:
+            if step.status != StepStatus.Pending.name:
+                self.journal.save_step(job, step)
+        return self.job_result(job)
+
+    def job_result(self, job: CommandJob) -> ActionResponse | None:
+        # The response of a finished command, that of its last step other than
+        # the audit event, or its error when that step did not fail
+        result = None
+        for step in job.steps:
+            if step.action != Action.CREATE_AUDIT_EVENT.name and step.status != StepStatus.Pending.name:
+                result = ActionResponse(**step.result) if step.result is not None else None
+        if job.status == CommandStatus.Failed.name and (result is None or result.status_code == 200):
+            result = ActionResponse(status="ERROR", status_code=500, error_message=job.error_message)
+        return result
+
+    def execute_command(
+        self,
+        payload: CommandPayload,
+        ts: int,
+        job: CommandJob = None,
+        shared_steps: Dict[str, StepOutcome | None] | None = None,
+    ):
+        # The command and every step are recorded in the command journal. Steps
+        # of job that already completed are not run again. Steps in shared_steps
+        # are not run either: they take the given outcome of a run shared with
+        # other commands, or are deferred with their dependents when it is None.
+        # A command with deferred steps stays Running and returns None.
+        job = job if job is not None else self.new_job(payload, ts)
+        # a Running job goes on after its deferred steps, failed steps only run
+        # again when a command is resumed
+        resumed = job.started_at is not None and job.status != CommandStatus.Running.name
+        done = {StepStatus.Completed.name} if resumed else {StepStatus.Completed.name, StepStatus.Failed.name}
+        if job.status != CommandStatus.Running.name:
+            job.status = CommandStatus.Running.name
+            job.started_at = now_millis()
+            job.finished_at = None
+            job.error_message = None
+            self.journal.save_command(job)
+        try:
+            result, complete = self._execute_workflow(payload, ts, job, shared_steps or {}, done)
+        except BaseException as e:
+            error = ActionResponse(
+                status="ERROR", status_code=500, error_message=getattr(e, "message", None) or str(e)
+            )
+            for step in job.steps:
+                if step.status == StepStatus.Running.name:
+                    self.journal.save_step(job, finish_step(job, step.action, error))
+            finish_job(job, error)
+            self.journal.save_command(job)
+            raise
+        if not complete:
+            return None
+        finish_job(job, result)
+        self.journal.save_command(job)
+        return result
+
+    def _execute_workflow(
+        self,
+        payload: CommandPayload,
+        ts: int,
+        job: CommandJob,
+        shared_steps: Dict[str, StepOutcome | None],
+        done: Set[str],
+    ) -> Tuple[ActionResponse | None, bool]:
+        # Steps run as soon as the steps they depend on are done, up to
+        # workflow.max_parallel_steps at a time. A connection error stops any
+        # further step from starting, the result is that of the last step of
+        # the workflow other than the audit event.
         command = payload.command.name
         workflow_commands = self.get_command_workflow(command)
+        dependencies = self.get_command_dependencies(command)
         print(workflow_commands)
+        results = {
+            step.action: ActionResponse(**step.result) if step.result is not None else None
+            for step in job.steps
+            if step.status in done
+        }
+        if len(results) != 0:
+            print(f"Continuing command {job.command_id}, done steps {list(results)}")
+        running = {}
+        aborted = None
+        raised = None
+        deferred = {step for step, outcome in shared_steps.items() if outcome is None}
+        for sub_command, outcome in shared_steps.items():
+            if outcome is not None and sub_command not in results:
+                result, connection_error = outcome
+                start_step(job, sub_command)
+                self.journal.save_step(job, finish_step(job, sub_command, result))
+                results[sub_command] = result
+                if connection_error and aborted is None:
+                    aborted = result
+        with ThreadPoolExecutor(
+            max_workers=self.max_parallel_steps, thread_name_prefix="step"
+        ) as pool:
+            while True:
+                if aborted is None and raised is None:
+                    for sub_command in workflow_commands:
+                        if (
+                            sub_command not in results
+                            and sub_command not in deferred
+                            and sub_command not in running.values()
+                            and all(step in results for step in dependencies[sub_command])
+                        ):
+                            future = pool.submit(self._execute_step, payload, sub_command, ts, job)
+                            running[future] = sub_command
+                if len(running) == 0:
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    sub_command = running.pop(future)
+                    try:
+                        result, connection_error = future.result()
+                    except BaseException as e:
+                        raised = raised or e
+                        results[sub_command] = None
+                        continue
+                    results[sub_command] = result
+                    if connection_error and aborted is None:
+                        aborted = result
+        if raised is not None:
+            raise raised
+        if aborted is not None:
+            return aborted, True
+        result = None
         for sub_command in workflow_commands:
-            command = self.action_commands[sub_command]
-            print(f"Executing command {sub_command}")
-            try:
-                if sub_command == Action.CREATE_AUDIT_EVENT.name:
-                    command.execute(command_payload=payload, action=sub_command, ts=ts)
-                else:
-                    result = command.execute(
-                        command_payload=payload, action=sub_command
-                    )
-            except (
-                ConnectionRefusedError,
-                MaxRetryError,
-                NewConnectionError,
-            ) as conn_error:
-                self.logger.exception(
-                    "Error when trying to connect to http endpoint...", conn_error
-                )
-                result = ActionResponse(
-                    status="ERROR",
-                    status_code=500,
-                    error_message="HTTP_CONNECTION_ERROR",
-                )
-                return result
-            except psycopg2.OperationalError as db_conn_error:
-                self.logger.exception(
-                    "Error when trying to connect to database...", db_conn_error
-                )
-                result = ActionResponse(
-                    status="ERROR",
-                    status_code=500,
-                    error_message="DATABASE_CONNECTION_ERROR",
+            if sub_command != Action.CREATE_AUDIT_EVENT.name:
+                result = results.get(sub_command, result)
+        return result, len(results) == len(workflow_commands)
+
+    def _execute_step(self, payload: CommandPayload, sub_command: str, ts: int, job: CommandJob):
+        print(f"Executing command {sub_command}")
+        self.journal.save_step(job, start_step(job, sub_command))
+        result, connection_error = self.run_step(payload, sub_command, ts)
+        self.journal.save_step(job, finish_step(job, sub_command, result))
+        return result, connection_error
+
+    def run_step(self, payload: CommandPayload, sub_command: str, ts: int) -> StepOutcome:
+        # Connection errors are returned as an error response flagged to stop
+        # the workflow, other exceptions are raised
+        command = self.action_commands[sub_command]
+        try:
+            if sub_command == Action.CREATE_AUDIT_EVENT.name:
+                result = command.execute(command_payload=payload, action=sub_command, ts=ts)
+            else:
+                result = command.execute(
+                    command_payload=payload, action=sub_command
                 )
-                return result
-        return result
+        except (
+            ConnectionRefusedError,
+            MaxRetryError,
+            NewConnectionError,
+        ) as conn_error:
+            self.logger.exception(
+                "Error when trying to connect to http endpoint...", conn_error
+            )
+            result = ActionResponse(
+                status="ERROR",
+                status_code=500,
+                error_message="HTTP_CONNECTION_ERROR",
+            )
+            return result, True
+        except psycopg2.OperationalError as db_conn_error:
+            self.logger.exception(
+                "Error when trying to connect to database...", db_conn_error
+            )
+            result = ActionResponse(
+                status="ERROR",
+                status_code=500,
+                error_message="DATABASE_CONNECTION_ERROR",
+            )
+            return result, True
+        return result, False
 
     def get_command_workflow(self, action: Action):
         return self.config_obj.find("commands.{0}.workflow".format(action))
+
+    def get_command_dependencies(self, action: Action) -> Dict[str, List[str]]:
+        # Without depends_on the steps of a workflow run one after the other
+        workflow_commands = self.get_command_workflow(action)
+        depends_on = self.config_obj.find("commands.{0}".format(action)).get("depends_on")
+        if depends_on is None:
+            return {
+                sub_command: workflow_commands[:index][-1:]
+                for index, sub_command in enumerate(workflow_commands)
+            }
+        dependencies = {sub_command: depends_on.get(sub_command) or [] for sub_command in workflow_commands}
+        visited = set()
+        for sub_command in workflow_commands:
+            for step in dependencies[sub_command]:
+                if step not in visited:
+                    raise ValueError(
+                        f"Step {sub_command} of {action} depends on {step}, which is not an earlier step of the workflow"
+                    )
+            visited.add(sub_command)
+        return dependencies
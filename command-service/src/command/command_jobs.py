@@ -0,0 +1,258 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+from typing import Dict, Tuple
+
+from model.data_models import (
+    ActionResponse,
+    Command,
+    CommandJob,
+    CommandPayload,
+    CommandStatus,
+    StepProgress,
+    StepStatus,
+)
+from command.single_flight import Flight, FlightKey, ReplicaLock, SingleFlight
+from exception.exception import CommandInProgressException, CommandQueueFullException
+
+
+def flight_key(payload: CommandPayload) -> FlightKey:
+    return payload.dataset_id, payload.command.name
+
+
+def now_millis() -> int:
+    return int(time.time() * 1000)
+
+
+def start_step(job: CommandJob, action: str) -> StepProgress:
+    step = _step(job, action)
+    step.status = StepStatus.Running.name
+    step.started_at = now_millis()
+    step.finished_at = None
+    step.error_message = None
+    step.result = None
+    return step
+
+
+def finish_step(job: CommandJob, action: str, result: ActionResponse | None) -> StepProgress:
+    # Steps that return no response are taken as completed
+    step = _step(job, action)
+    step.finished_at = now_millis()
+    step.result = asdict(result) if result is not None else None
+    if result is not None and result.status_code != 200:
+        step.status = StepStatus.Failed.name
+        step.error_message = result.error_message
+    else:
+        step.status = StepStatus.Completed.name
+    return step
+
+
+def finish_job(job: CommandJob, result: ActionResponse | None):
+    job.finished_at = now_millis()
+    if result is not None and result.status_code != 200:
+        job.status = CommandStatus.Failed.name
+        job.error_message = result.error_message
+    else:
+        job.status = CommandStatus.Completed.name
+
+
+def _step(job: CommandJob, action: str) -> StepProgress:
+    for step in job.steps:
+        if step.action == action:
+            return step
+    step = StepProgress(action=action)
+    job.steps.append(step)
+    return step
+
+
+class CommandJobQueue:
+    """
+    Runs commands on a bounded pool of worker threads and keeps their progress
+    for the status endpoint. At most max_pending commands are queued or running
+    at a time, further submissions are refused. The progress of the last
+    max_finished finished commands is kept in memory, older ones are read back
+    from the command journal.
+
+    A command runs once at a time for a dataset: requests for a command that
+    is already queued or running for the dataset get that command. With
+    replica_lock, the same holds across replicas through Postgres advisory
+    locks. A command that runs on another replica is waited for, for up to
+    replica_wait_seconds, and its outcome is taken from the command journal.
+    Requests attached to a command in flight wait for up to
+    flight_wait_seconds for its outcome.
+    """
+
+    def __init__(
+        self,
+        command_executor,
+        workers: int = 4,
+        max_pending: int = 100,
+        max_finished: int = 1000,
+        replica_lock: bool = False,
+        replica_wait_seconds: float = 900,
+        replica_poll_seconds: float = 2,
+        flight_wait_seconds: float = 1800,
+    ):
+        self.command_executor = command_executor
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="command")
+        self.max_pending = max_pending
+        self.max_finished = max_finished
+        self.jobs: Dict[str, CommandJob] = {}
+        self.finished: OrderedDict = OrderedDict()
+        self.pending = 0
+        self.lock = threading.Lock()
+        self.flights = SingleFlight()
+        self.replica_lock = replica_lock
+        self.replica_wait_seconds = replica_wait_seconds
+        self.replica_poll_seconds = replica_poll_seconds
+        self.flight_wait_seconds = flight_wait_seconds
+
+    def join(self, payload: CommandPayload, ts: int) -> Tuple[Flight, bool]:
+        # The flight of the command for the dataset, a new one led by the
+        # caller when none is in flight
+        flight, leader = self.flights.join(
+            flight_key(payload), lambda: self.command_executor.new_job(payload, ts)
+        )
+        if not leader:
+            print(
+                f"Command {payload.command.name} for dataset {payload.dataset_id} is in flight, "
+                f"attaching to command {flight.job.command_id}"
+            )
+        return flight, leader
+
+    def submit(self, payload: CommandPayload, ts: int) -> CommandJob:
+        flight, leader = self.join(payload, ts)
+        if leader:
+            self._enqueue(flight)
+        return flight.job
+
+    def execute(self, payload: CommandPayload, ts: int) -> Tuple[CommandJob, ActionResponse]:
+        # Runs a command on the calling thread, it is tracked like a queued one
+        flight, leader = self.join(payload, ts)
+        if not leader:
+            try:
+                return flight.job, flight.wait(self.flight_wait_seconds)
+            except CommandInProgressException as e:
+                print(e.message)
+                return flight.job, ActionResponse(
+                    status="ERROR", status_code=500, error_message="COMMAND_IN_PROGRESS"
+                )
+        job = flight.job
+        self.track(job)
+        try:
+            result = self.run_exclusive(payload, ts, job, self.new_replica_lock())
+        except BaseException as e:
+            self.release(job)
+            self.flights.land(flight, error=e)
+            raise
+        self.release(job)
+        self.flights.land(flight, result=result)
+        return job, result
+
+    def new_replica_lock(self) -> ReplicaLock:
+        return ReplicaLock(self.command_executor.db_service, enabled=self.replica_lock)
+
+    def run_exclusive(
+        self, payload: CommandPayload, ts: int, job: CommandJob, replica_lock: ReplicaLock
+    ) -> ActionResponse | None:
+        # Runs job once the command is not running for the dataset on another
+        # replica, or takes the outcome of that run. replica_lock is released.
+        key = flight_key(payload)
+        try:
+            if not replica_lock.try_acquire(key):
+                waiting_since = now_millis()
+                print(
+                    f"Command {job.command} for dataset {job.dataset_id} is running on another replica, "
+                    f"waiting for it"
+                )
+                if not replica_lock.wait(key, self.replica_wait_seconds, self.replica_poll_seconds):
+                    error = ActionResponse(
+                        status="ERROR", status_code=500, error_message="COMMAND_IN_PROGRESS_ON_ANOTHER_REPLICA"
+                    )
+                    finish_job(job, error)
+                    self.command_executor.journal.save_command(job)
+                    return error
+                command_id = self.command_executor.journal.latest_finished(
+                    job.dataset_id, job.command, since=waiting_since
+                )
+                finished = self.command_executor.load_job(command_id) if command_id is not None else None
+                if finished is not None:
+                    return self.command_executor.adopt_job(job, finished)
+            return self.command_executor.execute_command(payload=payload, ts=ts, job=job)
+        finally:
+            replica_lock.release()
+
+    def track(self, job: CommandJob):
+        # Makes a command run outside of the queue visible to the status endpoint
+        with self.lock:
+            self.finished.pop(job.command_id, None)
+            self.jobs[job.command_id] = job
+
+    def resume(self, job: CommandJob) -> CommandJob:
+        # Runs the steps of job that did not complete, the completed ones keep
+        # their recorded response
+        flight, leader = self.flights.join((job.dataset_id, job.command), lambda: job)
+        if not leader:
+            raise CommandInProgressException(
+                f"Command {flight.job.command_id} {job.command} for dataset {job.dataset_id} is {flight.job.status}"
+            )
+        job.status = CommandStatus.Queued.name
+        self._enqueue(flight)
+        return job
+
+    def _enqueue(self, flight: Flight):
+        job = flight.job
+        with self.lock:
+            pending = self.pending
+            if pending < self.max_pending:
+                self.pending += 1
+                self.finished.pop(job.command_id, None)
+                self.jobs[job.command_id] = job
+        if pending >= self.max_pending:
+            error = CommandQueueFullException(f"{pending} commands are already queued or running")
+            self.flights.land(flight, error=error)
+            raise error
+        # a flight that does not make it to the pool is landed, so that later
+        # requests for the command do not attach to it
+        try:
+            self.command_executor.journal.save_command(job)
+            payload = CommandPayload(dataset_id=job.dataset_id, command=Command[job.command])
+            self.pool.submit(self._run, flight, payload)
+        except BaseException as e:
+            with self.lock:
+                self.pending -= 1
+                self.jobs.pop(job.command_id, None)
+            self.flights.land(flight, error=e)
+            raise
+
+    def get(self, command_id: str) -> CommandJob | None:
+        with self.lock:
+            job = self.jobs.get(command_id)
+        if job is None:
+            job = self.command_executor.load_job(command_id)
+        return job
+
+    def _run(self, flight: Flight, payload: CommandPayload):
+        job = flight.job
+        result = error = None
+        try:
+            result = self.run_exclusive(payload, job.submitted_at, job, self.new_replica_lock())
+        except BaseException as e:
+            error = e
+            print(f"Command {job.command_id} {job.command} for dataset {job.dataset_id} failed - ", e)
+        with self.lock:
+            self.pending -= 1
+        self.release(job)
+        self.flights.land(flight, result=result, error=error)
+
+    def release(self, job: CommandJob):
+        with self.lock:
+            self.finished[job.command_id] = job
+            while len(self.finished) > self.max_finished:
+                command_id, _ = self.finished.popitem(last=False)
+                del self.jobs[command_id]
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
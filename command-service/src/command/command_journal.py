@@ -0,0 +1,246 @@
+import threading
+import time
+from typing import List
+
+from model.data_models import CommandJob, CommandStatus, StepProgress
+from service.db_service import DatabaseService, jsonb
+
+class CommandJournal:
+    """
+    Keeps every command run and the status, timings and response of each of
+    its steps in Postgres, so a failed or interrupted command can be resumed
+    from the steps that did not complete, also by another process.
+
+    Commands that are queued or running belong to the process that runs them
+    (owner). While the process is up, a heartbeat refreshes their updated_at
+    every heartbeat_seconds, also during a long step. Such commands are taken
+    over when they belong to this owner, or when their heartbeat stopped for
+    stale_after_seconds because their owner went away. Journal writes never
+    fail a command, they are logged and skipped while the database cannot be
+    reached.
+
+    The tables are created by migrations/001_command_journal.sql, the journal
+    is skipped until they exist.
+    """
+
+    def __init__(
+        self,
+        db_service: DatabaseService,
+        owner: str,
+        heartbeat_seconds: float = 30,
+        stale_after_seconds: int = 120,
+    ):
+        self.db_service = db_service
+        self.owner = owner
+        self.heartbeat_seconds = heartbeat_seconds
+        self.stale_after_seconds = stale_after_seconds
+        self.available = False
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def ensure_tables(self) -> bool:
+        if not self.available:
+            try:
+                record = self.db_service.execute_select_one(
+                    sql="SELECT to_regclass('command_journal_steps') IS NOT NULL AS present", params=None
+                )
+                self.available = bool(record["present"])
+                if not self.available:
+                    print("Command journal | The journal tables are missing, apply migrations/001_command_journal.sql")
+            except Exception as e:
+                print("Command journal | Unable to check the journal tables - ", e)
+        return self.available
+
+    def start_heartbeat(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run_heartbeat, name="command-journal-heartbeat", daemon=True)
+        self.thread.start()
+
+    def stop_heartbeat(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    def heartbeat(self) -> int:
+        # Marks the queued and running commands of this owner as alive
+        if not self.available:
+            return 0
+        query = """
+            UPDATE command_journal SET updated_at = %s
+            WHERE owner = %s AND status IN (%s, %s)
+        """
+        params = (
+            int(time.time() * 1000),
+            self.owner,
+            CommandStatus.Queued.name,
+            CommandStatus.Running.name,
+        )
+        return self.db_service.execute_upsert(sql=query, params=params)
+
+    def _run_heartbeat(self):
+        while not self.stop_event.wait(self.heartbeat_seconds):
+            try:
+                self.heartbeat()
+            except Exception as e:
+                print("Command journal | Unable to record the heartbeat - ", e)
+
+    def save_command(self, job: CommandJob):
+        if not self.ensure_tables():
+            return
+        query = """
+            INSERT INTO command_journal (command_id, dataset_id, command, status, submitted_at,
+            started_at, finished_at, error_message, owner, updated_at)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (command_id) DO UPDATE
+            SET status = EXCLUDED.status,
+            started_at = EXCLUDED.started_at,
+            finished_at = EXCLUDED.finished_at,
+            error_message = EXCLUDED.error_message,
+            owner = EXCLUDED.owner,
+            updated_at = EXCLUDED.updated_at
+        """
+        params = (
+            job.command_id,
+            job.dataset_id,
+            job.command,
+            job.status,
+            job.submitted_at,
+            job.started_at,
+            job.finished_at,
+            job.error_message,
+            self.owner,
+            int(time.time() * 1000),
+        )
+        self._write(query, params, job)
+
+    def save_step(self, job: CommandJob, step: StepProgress):
+        if not self.available:
+            return
+        query = """
+            INSERT INTO command_journal_steps (command_id, action, status, started_at, finished_at,
+            error_message, result)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (command_id, action) DO UPDATE
+            SET status = EXCLUDED.status,
+            started_at = EXCLUDED.started_at,
+            finished_at = EXCLUDED.finished_at,
+            error_message = EXCLUDED.error_message,
+            result = EXCLUDED.result;
+            UPDATE command_journal SET updated_at = %s WHERE command_id = %s
+        """
+        params = (
+            job.command_id,
+            step.action,
+            step.status,
+            step.started_at,
+            step.finished_at,
+            step.error_message,
+            jsonb(step.result) if step.result is not None else None,
+            int(time.time() * 1000),
+            job.command_id,
+        )
+        self._write(query, params, job)
+
+    def _write(self, query, params, job: CommandJob):
+        try:
+            self.db_service.execute_upsert(sql=query, params=params)
+        except Exception as e:
+            print(f"Command journal | Unable to record command {job.command_id} - ", e)
+
+    def load(self, command_id: str) -> CommandJob | None:
+        if not self.ensure_tables():
+            return None
+        record = self.db_service.execute_select_one(
+            sql="SELECT * FROM command_journal WHERE command_id = %s", params=(command_id,)
+        )
+        if record is None:
+            return None
+        step_records = self.db_service.execute_select_all(
+            sql="SELECT * FROM command_journal_steps WHERE command_id = %s", params=(command_id,)
+        )
+        return CommandJob(
+            command_id=record["command_id"],
+            dataset_id=record["dataset_id"],
+            command=record["command"],
+            steps=[
+                StepProgress(
+                    action=step["action"],
+                    status=step["status"],
+                    started_at=step["started_at"],
+                    finished_at=step["finished_at"],
+                    error_message=step["error_message"],
+                    result=step["result"],
+                )
+                for step in step_records
+            ],
+            status=record["status"],
+            submitted_at=record["submitted_at"],
+            started_at=record["started_at"],
+            finished_at=record["finished_at"],
+            error_message=record["error_message"],
+        )
+
+    def claim_in_flight(self) -> List[str]:
+        # Takes over the queued and running commands left behind by this owner
+        # or by an owner whose heartbeat stopped
+        if not self.ensure_tables():
+            return []
+        now = int(time.time() * 1000)
+        query = """
+            UPDATE command_journal SET owner = %s, updated_at = %s
+            WHERE status IN (%s, %s) AND (owner = %s OR updated_at < %s)
+            RETURNING command_id
+        """
+        params = (
+            self.owner,
+            now,
+            CommandStatus.Queued.name,
+            CommandStatus.Running.name,
+            self.owner,
+            now - self.stale_after_seconds * 1000,
+        )
+        records = self.db_service.execute_select_all(sql=query, params=params)
+        return [record["command_id"] for record in records]
+
+    def claim(self, command_id: str) -> bool:
+        # A command can be taken over unless another owner is still running it,
+        # that is still records its heartbeat
+        if not self.ensure_tables():
+            return True
+        now = int(time.time() * 1000)
+        query = """
+            UPDATE command_journal SET owner = %s, updated_at = %s
+            WHERE command_id = %s AND (status NOT IN (%s, %s) OR owner = %s OR updated_at < %s)
+            RETURNING command_id
+        """
+        params = (
+            self.owner,
+            now,
+            command_id,
+            CommandStatus.Queued.name,
+            CommandStatus.Running.name,
+            self.owner,
+            now - self.stale_after_seconds * 1000,
+        )
+        return len(self.db_service.execute_select_all(sql=query, params=params)) != 0
+
+    def latest_finished(self, dataset_id: str, command: str, since: int) -> str | None:
+        # The command_id of the last run of command for the dataset that
+        # finished at or after since
+        if not self.ensure_tables():
+            return None
+        query = """
+            SELECT command_id FROM command_journal
+            WHERE dataset_id = %s AND command = %s AND status IN (%s, %s) AND finished_at >= %s
+            ORDER BY finished_at DESC LIMIT 1
+        """
+        params = (
+            dataset_id,
+            command,
+            CommandStatus.Completed.name,
+            CommandStatus.Failed.name,
+            since,
+        )
+        record = self.db_service.execute_select_one(sql=query, params=params)
+        return record["command_id"] if record is not None else None
@@ -1,7 +1,9 @@
+from contextlib import contextmanager
 from dacite import from_dict
 import json
 import logging
 import subprocess
+import threading
 
 from command.icommand import ICommand
 from config import Config
@@ -16,6 +18,10 @@ class ConnectorCommand(ICommand):
         self.db_service = db_service
         self.logger = logging.getLogger()
         self.connector_job_config = self.config.find("connector_jobs")
+        # helm ls output per namespace, shared while a bulk command runs
+        self.release_listings = None
+        self.release_listing_users = 0
+        self.release_listing_lock = threading.Lock()
 
     def execute(self, command_payload: CommandPayload, action: Action):
         result = None
@@ -36,6 +42,46 @@ class ConnectorCommand(ICommand):
 
         return result
 
+    @contextmanager
+    def shared_release_listing(self):
+        # Within this block helm releases are listed once per namespace, the
+        # listing is kept up to date with the releases installed meanwhile
+        with self.release_listing_lock:
+            if self.release_listing_users == 0:
+                self.release_listings = {}
+            self.release_listing_users += 1
+        try:
+            yield
+        finally:
+            with self.release_listing_lock:
+                self.release_listing_users -= 1
+                if self.release_listing_users == 0:
+                    self.release_listings = None
+
+    def _list_releases(self, namespace):
+        helm_ls_cmd = ["helm", "ls", "--namespace", namespace]
+        with self.release_listing_lock:
+            listings = self.release_listings
+            if listings is not None:
+                if namespace not in listings:
+                    helm_ls_result = subprocess.run(
+                        helm_ls_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+                    )
+                    if helm_ls_result.returncode != 0:
+                        return helm_ls_result
+                    listings[namespace] = helm_ls_result
+                return listings[namespace]
+        return subprocess.run(
+            helm_ls_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+
+    def _add_release(self, namespace, release_name):
+        with self.release_listing_lock:
+            listings = self.release_listings
+            if listings is not None and namespace in listings:
+                listing = listings[namespace]
+                listing.stdout += f"{release_name}\t{namespace}\n".encode()
+
     def _deploy_connectors(self, dataset_id, active_connectors, is_masterdata):
         result = None
         self._stop_connector_jobs(is_masterdata, self.connector_job_config["spark"]["namespace"], active_connectors, dataset_id)
@@ -57,10 +103,7 @@ class ConnectorCommand(ICommand):
         #     for release in masterdata_jar_config:
         #         managed_releases.append(release["release_name"])
 
-        helm_ls_cmd = ["helm", "ls", "--namespace", namespace]
-        helm_ls_result = subprocess.run(
-            helm_ls_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-        )
+        helm_ls_result = self._list_releases(namespace)
         if helm_ls_result.returncode == 0:
             jobs = helm_ls_result.stdout.decode().splitlines()[1:]
             job_names = {job.split()[0] for job in jobs if base_helm_chart in job}
@@ -114,11 +157,7 @@ class ConnectorCommand(ICommand):
         runtime = connector_instance.connector_runtime
         namespace = self.connector_job_config["flink"]["namespace"]
         job_name = release_name.replace(".", "-")
-        helm_ls_cmd = ["helm", "ls", "--namespace", namespace]
-
-        helm_ls_result = subprocess.run(
-            helm_ls_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-        )
+        helm_ls_result = self._list_releases(namespace)
 
         if helm_ls_result.returncode == 0:
             jobs = helm_ls_result.stdout.decode()
@@ -186,6 +225,7 @@ class ConnectorCommand(ICommand):
 
                     if helm_install_result.returncode == 0:
                         print(f"Job '{job_name}' deployment succeeded...")
+                        self._add_release(namespace, job_name)
                     else:
                         err = True
                         result = ActionResponse(
@@ -28,16 +28,19 @@ class DatasetCommand(ICommand):
         self.config_service_port = self.config.find("config_service.port")
         self.base_url = f"http://{self.config_service_host}:{self.config_service_port}/v2/datasets/export"
 
-    def _get_draft_dataset_record(self, dataset_id):
+    # The reads below run on db when given, e.g. a unit of work of
+    # DatabaseService, and on db_service otherwise
+
+    def _get_draft_dataset_record(self, dataset_id, db=None):
         query = f"""
             SELECT "type", MAX(version) AS max_version FROM datasets_draft WHERE dataset_id = %s GROUP BY 1
         """
-        dataset_record = self.db_service.execute_select_one(sql=query, params=(dataset_id,))
+        dataset_record = (db or self.db_service).execute_select_one(sql=query, params=(dataset_id,))
         if dataset_record is not None:
             return dataset_record
         return None
     
-    def _get_draft_dataset(self, dataset_id):
+    def _get_draft_dataset(self, dataset_id, db=None):
         query = f"""
             SELECT * FROM datasets_draft
             WHERE dataset_id = %s AND (status = %s OR status = %s ) AND version = (SELECT MAX(version)
@@ -45,17 +48,20 @@ class DatasetCommand(ICommand):
             """
         params = (dataset_id, DatasetStatusType.Publish.name, DatasetStatusType.ReadyToPublish.name, 
             dataset_id, DatasetStatusType.Publish.name, DatasetStatusType.ReadyToPublish.name,)
-        dataset_record = self.db_service.execute_select_one(sql=query, params=params)
+        dataset_record = (db or self.db_service).execute_select_one(sql=query, params=params)
         if dataset_record is not None:
             return dataset_record
         return None
 
-    def _check_for_live_record(self, dataset_id):
+    def _check_for_live_record(self, dataset_id, db=None, for_update=False):
+        # for_update locks the live row until the transaction of db ends
         query = f"""
             SELECT * FROM datasets WHERE dataset_id = %s AND status = %s
         """
+        if for_update:
+            query += " FOR UPDATE"
         params = (dataset_id, DatasetStatusType.Live.name, )
-        result = self.db_service.execute_select_one(sql=query, params=params)
+        result = (db or self.db_service).execute_select_one(sql=query, params=params)
         live_dataset = dict()
         if result is not None:
             live_dataset = from_dict(data_class=DatasetsLive, data=result)
@@ -63,19 +69,30 @@ class DatasetCommand(ICommand):
             return live_dataset, data_version
         return None, None
 
-    def audit_live_dataset(self, command_payload: CommandPayload, ts: int):
-        dataset_id = command_payload.dataset_id
-        dataset_record, data_version = self._check_for_live_record(dataset_id)
+    def export_live_dataset(self, dataset_id):
+        # Configurations of the live dataset from the export API, None when
+        # they cannot be read or the dataset is not live
         url=self.base_url + '/{}'.format(dataset_id)
         export_dataset = self.http_service.get(
             url=url
         )
         if export_dataset.status == 200:
-            result = json.loads(export_dataset.body)
+            return json.loads(export_dataset.body)["result"]
+        return None
+
+    def audit_live_dataset(self, command_payload: CommandPayload, ts: int, dataset_record=None, export=None):
+        # dataset_record is the live dataset and export its configurations,
+        # when already read by the caller
+        dataset_id = command_payload.dataset_id
+        if dataset_record is None:
+            dataset_record, data_version = self._check_for_live_record(dataset_id)
+        if export is None:
+            export = self.export_live_dataset(dataset_id)
+        if export is not None:
             object_ = Object(
                 dataset_id, dataset_record.type, dataset_record.data_version
             )
-            live_dataset_property = Property("dataset:export", result["result"], "")
+            live_dataset_property = Property("dataset:export", export, "")
             draft_property = Property(
                 "draft-dataset:status",
                 DatasetStatusType.ReadyToPublish.name,
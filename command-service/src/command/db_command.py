@@ -1,4 +1,3 @@
-import json
 import time
 from datetime import datetime as dt
 from dacite import from_dict
@@ -6,7 +5,7 @@ from command.dataset_command import DatasetCommand
 from command.icommand import ICommand
 from model.data_models import Action, ActionResponse, CommandPayload, DatasetStatusType
 from model.db_models import DatasetsDraft, DatasetConnectorConfigDraft, DatasourcesDraft, DatasetTransformationsDraft
-from service.db_service import DatabaseService
+from service.db_service import DatabaseService, UnitOfWork, jsonb
 
 class DBCommand(ICommand):
 
@@ -31,30 +30,43 @@ class DBCommand(ICommand):
     def _change_dataset_to_active(self, command_payload: CommandPayload):
 
         dataset_id = command_payload.dataset_id
-        live_dataset, data_version = self.dataset_command._check_for_live_record(
-            dataset_id
-        )
-        if live_dataset is not None:
-            self.dataset_command.audit_live_dataset(
-                command_payload, int(time.time() * 1000)
+        ts = int(time.time() * 1000)
+        # The configurations of the previous live dataset are exported before
+        # the transaction, so that no HTTP call runs while the live row is locked
+        export = self.dataset_command.export_live_dataset(dataset_id)
+        # The live records are read and written in one transaction, a failure
+        # leaves the previous live dataset as it was. The live row is locked
+        # from the read until the commit.
+        with self.db_service.unit_of_work() as uow:
+            live_dataset, data_version = self.dataset_command._check_for_live_record(
+                dataset_id, db=uow, for_update=True
             )
-        
-        draft_dataset_record = self.dataset_command._get_draft_dataset(dataset_id)
+            draft_dataset_record = self.dataset_command._get_draft_dataset(dataset_id, db=uow)
 
-        draft_dataset_id = self._insert_dataset_record(
-            dataset_id, data_version, live_dataset, draft_dataset_record
-        )
-        if draft_dataset_id:
-            self._insert_datasource_record(dataset_id, draft_dataset_id)
-            self._insert_connector_instances(dataset_id, draft_dataset_record)
-            self._insert_dataset_transformations(dataset_id, draft_dataset_record)
-            return ActionResponse(status="OK", status_code=200)
-        else:
+            draft_dataset_id = self._insert_dataset_record(
+                uow, dataset_id, data_version, live_dataset, draft_dataset_record
+            )
+            if draft_dataset_id:
+                self._insert_datasource_record(uow, dataset_id, draft_dataset_id)
+                self._insert_connector_instances(uow, dataset_id, draft_dataset_record)
+                self._insert_dataset_transformations(uow, dataset_id, draft_dataset_record)
+        if not draft_dataset_id:
             return ActionResponse(
                 status="ERROR", status_code=404, error_message="DATASET_ID_NOT_FOUND"
             )
+        # the previous live dataset is audited once the publish is committed
+        if live_dataset is not None and export is not None:
+            self.dataset_command.audit_live_dataset(
+                command_payload, ts, dataset_record=live_dataset, export=export
+            )
+        elif live_dataset is not None:
+            print(
+                "Failed to get dataset configurations from export API, dataset_id: ",
+                dataset_id,
+            )
+        return ActionResponse(status="OK", status_code=200)
 
-    def _insert_dataset_record(self, dataset_id, data_version, live_dataset, draft_dataset_record):
+    def _insert_dataset_record(self, uow: UnitOfWork, dataset_id, data_version, live_dataset, draft_dataset_record):
 
         if draft_dataset_record is None:
             return None
@@ -67,43 +79,26 @@ class DBCommand(ICommand):
             dataset_id,
             draft_dataset.type,
             draft_dataset.name,
-            json.dumps(draft_dataset.extraction_config).replace("'", "''"),
-            json.dumps(draft_dataset.validation_config).replace("'", "''"),
-            json.dumps(draft_dataset.dedup_config).replace("'", "''"),
-            json.dumps(draft_dataset.denorm_config).replace("'", "''"),
-            json.dumps(draft_dataset.data_schema).replace("'", "''"),
-            json.dumps(draft_dataset.router_config).replace("'", "''"),
-            json.dumps(draft_dataset.dataset_config).replace("'", "''"),
+            jsonb(draft_dataset.extraction_config),
+            jsonb(draft_dataset.validation_config),
+            jsonb(draft_dataset.dedup_config),
+            jsonb(draft_dataset.denorm_config),
+            jsonb(draft_dataset.data_schema),
+            jsonb(draft_dataset.router_config),
+            jsonb(draft_dataset.dataset_config),
             DatasetStatusType.Live.name,
-            json.dumps(draft_dataset.tags).replace("'", "''").replace("[", "{").replace("]", "}") if draft_dataset.tags is not None else json.dumps({}),
+            draft_dataset.tags if draft_dataset.tags is not None else [],
             draft_dataset.api_version,
             draft_dataset.version,
-            json.dumps(draft_dataset.sample_data).replace("'", "''"),
+            jsonb(draft_dataset.sample_data),
             draft_dataset.entry_topic,
             draft_dataset.created_by,
             draft_dataset.updated_by,
             current_timestamp,
             current_timestamp,
             current_timestamp,
-            
-            draft_dataset.name,
-            json.dumps(draft_dataset.extraction_config).replace("'", "''"),
-            json.dumps(draft_dataset.validation_config).replace("'", "''"),
-            json.dumps(draft_dataset.dedup_config).replace("'", "''"),
-            json.dumps(draft_dataset.denorm_config).replace("'", "''"),
-            json.dumps(draft_dataset.data_schema).replace("'", "''"),
-            json.dumps(draft_dataset.router_config).replace("'", "''"),
-            json.dumps(draft_dataset.dataset_config).replace("'", "''"),
-            json.dumps(draft_dataset.tags).replace("'", "''").replace("[", "{").replace("]", "}") if draft_dataset.tags is not None else json.dumps({}),
+
             data_version if live_dataset is not None else 1,
-            draft_dataset.api_version,
-            draft_dataset.version,
-            json.dumps(draft_dataset.sample_data).replace("'", "''"),
-            draft_dataset.entry_topic,
-            draft_dataset.updated_by,
-            current_timestamp,
-            current_timestamp,
-            DatasetStatusType.Live.name,
         )
         insert_query = f"""
             INSERT INTO datasets(id, dataset_id, "type", name, extraction_config, validation_config, dedup_config,
@@ -135,251 +130,193 @@ class DBCommand(ICommand):
                 %s
             )
             ON CONFLICT (id) DO UPDATE
-            SET name = %s,
-            extraction_config = %s,
-            validation_config = %s,
-            dedup_config = %s,
-            denorm_config = %s,
-            data_schema = %s,
-            router_config = %s,
-            dataset_config = %s,
-            tags = %s,
+            SET name = EXCLUDED.name,
+            extraction_config = EXCLUDED.extraction_config,
+            validation_config = EXCLUDED.validation_config,
+            dedup_config = EXCLUDED.dedup_config,
+            denorm_config = EXCLUDED.denorm_config,
+            data_schema = EXCLUDED.data_schema,
+            router_config = EXCLUDED.router_config,
+            dataset_config = EXCLUDED.dataset_config,
+            tags = EXCLUDED.tags,
             data_version = %s,
-            api_version = %s,
-            version = %s,
-            sample_data = %s,
-            entry_topic = %s,
-            updated_by = %s,
-            updated_date = %s,
-            published_date = %s,
-            status = %s;
+            api_version = EXCLUDED.api_version,
+            version = EXCLUDED.version,
+            sample_data = EXCLUDED.sample_data,
+            entry_topic = EXCLUDED.entry_topic,
+            updated_by = EXCLUDED.updated_by,
+            updated_date = EXCLUDED.updated_date,
+            published_date = EXCLUDED.published_date,
+            status = EXCLUDED.status;
             """
-        self.db_service.execute_upsert(insert_query, params)
+        uow.execute_upsert(insert_query, params)
         print(f"Dataset {dataset_id} record inserted successfully...")
         return draft_dataset_id
 
-    def _insert_datasource_record(self, dataset_id, draft_dataset_id):
+    def _insert_datasource_record(self, uow: UnitOfWork, dataset_id, draft_dataset_id):
 
         result = {}
-        draft_datasource_record = self.db_service.execute_select_all(
+        draft_datasource_record = uow.execute_select_all(
             sql=f"SELECT * FROM datasources_draft WHERE dataset_id = %s",
             params=(draft_dataset_id,)
         )
         if draft_datasource_record is None:
             return result
+        rows = []
+        current_timestamp = dt.now()
         for record in draft_datasource_record:
             draft_datasource = from_dict(data_class=DatasourcesDraft, data=record)
-            current_timestamp = dt.now()
-            params = (
+            rows.append((
                 draft_datasource.id,
                 draft_datasource.datasource,
                 dataset_id,
                 draft_datasource.datasource_ref, 
-                json.dumps(draft_datasource.ingestion_spec),
+                jsonb(draft_datasource.ingestion_spec),
                 draft_datasource.type,
-                json.dumps(draft_datasource.retention_period).replace("'", "''"),
-                json.dumps(draft_datasource.archival_policy).replace("'", "''"),
-                json.dumps(draft_datasource.purge_policy).replace("'", "''"),
-                json.dumps(draft_datasource.backup_config).replace("'", "''"),
+                jsonb(draft_datasource.retention_period),
+                jsonb(draft_datasource.archival_policy),
+                jsonb(draft_datasource.purge_policy),
+                jsonb(draft_datasource.backup_config),
                 DatasetStatusType.Live.name,
                 draft_datasource.created_by,
                 draft_datasource.updated_by,
                 current_timestamp,
                 current_timestamp,
                 current_timestamp,
-                json.dumps(draft_datasource.metadata).replace("'", "''"),
-
-                draft_datasource.datasource,
-                json.dumps(draft_datasource.ingestion_spec),
-                draft_datasource.type,
-                json.dumps(draft_datasource.retention_period).replace("'", "''"),
-                json.dumps(draft_datasource.archival_policy).replace("'", "''"),
-                json.dumps(draft_datasource.purge_policy).replace("'", "''"),
-                json.dumps(draft_datasource.backup_config).replace("'", "''"),
-                draft_datasource.updated_by,
-                current_timestamp,
-                current_timestamp,
-                json.dumps(draft_datasource.metadata).replace("'", "''"), 
-                DatasetStatusType.Live.name,
-            )
-            insert_query = f"""
-                INSERT INTO datasources(id, datasource, dataset_id, datasource_ref, ingestion_spec, type, retention_period,
-                archival_policy, purge_policy, backup_config, status, created_by, updated_by, created_date,
-                updated_date, published_date, metadata)
-                VALUES (
-                    %s,
-                    %s,
-                    %s,
-                    %s,
-                    %s,
-                    %s,
-                    %s,
-                    %s,
-                    %s,
-                    %s,
-                    %s,
-                    %s,
-                    %s,
-                    %s,
-                    %s,
-                    %s,
-                    %s
-                )
-                ON CONFLICT (id) DO UPDATE
-                SET datasource_ref = %s,
-                ingestion_spec = %s,
-                type = %s,
-                retention_period = %s,
-                archival_policy = %s,
-                purge_policy = %s,
-                backup_config = %s,
-                updated_by = %s,
-                updated_date = %s,
-                published_date = %s,
-                metadata = %s,
-                status = %s;
-            """
-            result = self.db_service.execute_upsert(sql=insert_query, params=params)
+                jsonb(draft_datasource.metadata),
+            ))
+        # an existing datasource takes the datasource name as datasource_ref
+        insert_query = f"""
+            INSERT INTO datasources(id, datasource, dataset_id, datasource_ref, ingestion_spec, type, retention_period,
+            archival_policy, purge_policy, backup_config, status, created_by, updated_by, created_date,
+            updated_date, published_date, metadata)
+            VALUES %s
+            ON CONFLICT (id) DO UPDATE
+            SET datasource_ref = EXCLUDED.datasource,
+            ingestion_spec = EXCLUDED.ingestion_spec,
+            type = EXCLUDED.type,
+            retention_period = EXCLUDED.retention_period,
+            archival_policy = EXCLUDED.archival_policy,
+            purge_policy = EXCLUDED.purge_policy,
+            backup_config = EXCLUDED.backup_config,
+            updated_by = EXCLUDED.updated_by,
+            updated_date = EXCLUDED.updated_date,
+            published_date = EXCLUDED.published_date,
+            metadata = EXCLUDED.metadata,
+            status = EXCLUDED.status;
+        """
+        if len(rows) != 0:
+            result = uow.execute_batch_upsert(sql=insert_query, rows=rows)
             print(
-                f"Datasource {draft_datasource.id} record inserted successfully..."
+                f"Datasources {[row[0] for row in rows]} records inserted successfully..."
             )
         return result
 
-    def _insert_connector_instances(self, dataset_id, draft_dataset_record):
+    def _insert_connector_instances(self, uow: UnitOfWork, dataset_id, draft_dataset_record):
         emptyJson = {}
         result = {}
         draft_connectors_config_record = draft_dataset_record.get('connectors_config')
         if draft_connectors_config_record is None:
             return result
-        
+
+        # rows by id, one statement cannot write a row twice
+        v2_rows = {}
+        v1_rows = {}
+        current_timestamp = dt.now()
         for record in draft_connectors_config_record:
             connector_config = from_dict(
                 data_class = DatasetConnectorConfigDraft, data = record
             )
-            current_timestamp = dt.now()
             operations_config =  connector_config.operations_config if connector_config.operations_config is not None else {}
             if connector_config.version == 'v2':
-                params = (
+                v2_rows[connector_config.id] = (
                     connector_config.id,
                     dataset_id,
                     connector_config.connector_id,
                     connector_config.connector_config,
-                    json.dumps(operations_config).replace("'", "''"),
+                    jsonb(operations_config),
                     DatasetStatusType.Live.name,
-                    json.dumps(emptyJson),
-                    json.dumps(emptyJson),
+                    jsonb(emptyJson),
+                    jsonb(emptyJson),
                     draft_dataset_record.get('created_by'),
                     draft_dataset_record.get('updated_by'),
                     current_timestamp,
                     current_timestamp,
                     current_timestamp,
-                    connector_config.connector_config,
-                    json.dumps(connector_config.operations_config).replace("'", "''"),
-                    draft_dataset_record.get('updated_by'),
-                    current_timestamp,
-                    current_timestamp,
-                    DatasetStatusType.Live.name,
-                )
-                insert_query = f"""
-                    INSERT INTO connector_instances(id, dataset_id, connector_id, connector_config, operations_config,
-                    status, connector_state, connector_stats, created_by, updated_by, created_date, 
-                    updated_date, published_date)
-                    VALUES (
-                        %s,
-                        %s,
-                        %s,
-                        %s,
-                        %s,
-                        %s,
-                        %s,
-                        %s,
-                        %s,
-                        %s,
-                        %s,
-                        %s,
-                        %s
-                    )
-                    ON CONFLICT (id) DO UPDATE
-                    SET connector_config = %s,
-                    operations_config = %s,
-                    updated_by = %s,
-                    updated_date = %s,
-                    published_date = %s,
-                    status = %s;
-                """
-                result = self.db_service.execute_upsert(sql=insert_query, params=params)
-                print(
-                    f"Connector[v2] Instance record for [dataset={dataset_id},connector={connector_config.connector_id},id={connector_config.id}] inserted successfully..."
                 )
             else:
-                params = (
+                v1_rows[connector_config.id] = (
                     connector_config.id,
                     dataset_id,
                     connector_config.connector_id,
-                    json.dumps(connector_config.connector_config).replace("'", "''"),
+                    jsonb(connector_config.connector_config),
                     DatasetStatusType.Live.name,
                     draft_dataset_record.get('created_by'),
                     draft_dataset_record.get('updated_by'),
                     current_timestamp,
                     current_timestamp,
                     current_timestamp,
-
-                    json.dumps(connector_config.connector_config).replace("'", "''"),
-                    draft_dataset_record.get('updated_by'),
-                    current_timestamp,
-                    current_timestamp,
-                    DatasetStatusType.Live.name,
                 )
-                insert_query = f"""
-                    INSERT INTO dataset_source_config(id, dataset_id, connector_type, connector_config,
-                    status, created_by, updated_by, created_date, updated_date, published_date)
-                    VALUES (
-                        %s,
-                        %s,
-                        %s,
-                        %s,
-                        %s,
-                        %s,
-                        %s,
-                        %s,
-                        %s,
-                        %s
-                    )
-                    ON CONFLICT (id) DO UPDATE
-                    SET connector_config = %s,
-                    updated_by = %s,
-                    updated_date = %s,
-                    published_date = %s,
-                    status = %s;
-                """
-                result = self.db_service.execute_upsert(sql=insert_query, params=params)
-                print(
-                    f"Connector[v1] record for [dataset={dataset_id},connector={connector_config.connector_id},id={connector_config.id}] inserted successfully..."
-                )
-            
+
+        if len(v2_rows) != 0:
+            insert_query = f"""
+                INSERT INTO connector_instances(id, dataset_id, connector_id, connector_config, operations_config,
+                status, connector_state, connector_stats, created_by, updated_by, created_date, 
+                updated_date, published_date)
+                VALUES %s
+                ON CONFLICT (id) DO UPDATE
+                SET connector_config = EXCLUDED.connector_config,
+                operations_config = EXCLUDED.operations_config,
+                updated_by = EXCLUDED.updated_by,
+                updated_date = EXCLUDED.updated_date,
+                published_date = EXCLUDED.published_date,
+                status = EXCLUDED.status;
+            """
+            result = uow.execute_batch_upsert(sql=insert_query, rows=list(v2_rows.values()))
+            print(
+                f"Connector[v2] Instance records for [dataset={dataset_id},ids={list(v2_rows)}] inserted successfully..."
+            )
+        if len(v1_rows) != 0:
+            insert_query = f"""
+                INSERT INTO dataset_source_config(id, dataset_id, connector_type, connector_config,
+                status, created_by, updated_by, created_date, updated_date, published_date)
+                VALUES %s
+                ON CONFLICT (id) DO UPDATE
+                SET connector_config = EXCLUDED.connector_config,
+                updated_by = EXCLUDED.updated_by,
+                updated_date = EXCLUDED.updated_date,
+                published_date = EXCLUDED.published_date,
+                status = EXCLUDED.status;
+            """
+            result = uow.execute_batch_upsert(sql=insert_query, rows=list(v1_rows.values()))
+            print(
+                f"Connector[v1] records for [dataset={dataset_id},ids={list(v1_rows)}] inserted successfully..."
+            )
+
         return result
 
-    def _insert_dataset_transformations(self, dataset_id, draft_dataset_record):
+    def _insert_dataset_transformations(self, uow: UnitOfWork, dataset_id, draft_dataset_record):
 
         draft_dataset_transformations_record = draft_dataset_record.get('transformations_config')
         result = {}
         current_timestamp = dt.now()
         # Delete existing transformations
-        self.db_service.execute_delete(sql=f"""DELETE from dataset_transformations where dataset_id = %s""", params=(dataset_id,))
+        uow.execute_delete(sql=f"""DELETE from dataset_transformations where dataset_id = %s""", params=(dataset_id,))
         print(f"Dataset Transformation for {dataset_id} are deleted successfully...")
 
         if draft_dataset_transformations_record is None:
             return result
 
+        rows = []
         for record in draft_dataset_transformations_record:
             transformation = from_dict(
                 data_class=DatasetTransformationsDraft, data=record
             )
-            params = (
+            rows.append((
                 dataset_id + '_' + transformation.field_key,
                 dataset_id,
                 transformation.field_key,
-                json.dumps(transformation.transformation_function).replace("'", "''"),
+                jsonb(transformation.transformation_function),
                 DatasetStatusType.Live.name,
                 transformation.mode,
                 draft_dataset_record.get('created_by'),
@@ -387,24 +324,14 @@ class DBCommand(ICommand):
                 current_timestamp,
                 current_timestamp,
                 current_timestamp,
-            )
-            insert_query = f"""
-                INSERT INTO dataset_transformations(id, dataset_id, field_key, transformation_function,
-                status, mode, created_by, updated_by, created_date, updated_date, published_date)
-                VALUES (
-                    %s,
-                    %s,
-                    %s,
-                    %s,
-                    %s,
-                    %s,
-                    %s,
-                    %s,
-                    %s,
-                    %s,
-                    %s
-                )
-            """
-            result = self.db_service.execute_upsert(sql=insert_query, params=params)
-            print(f"Dataset Transformation {dataset_id + '_' + transformation.field_key} record inserted successfully...")
-        return result
\ No newline at end of file
+            ))
+        if len(rows) == 0:
+            return result
+        insert_query = f"""
+            INSERT INTO dataset_transformations(id, dataset_id, field_key, transformation_function,
+            status, mode, created_by, updated_by, created_date, updated_date, published_date)
+            VALUES %s
+        """
+        result = uow.execute_batch_upsert(sql=insert_query, rows=rows)
+        print(f"Dataset Transformations {[row[0] for row in rows]} records inserted successfully...")
+        return result
@@ -3,7 +3,7 @@ import json
 from command.icommand import ICommand
 from config import Config
 from model.data_models import Action, ActionResponse, CommandPayload
-from service.db_service import DatabaseService
+from service.db_service import DatabaseService, UnitOfWork
 from service.http_service import HttpService
 
 
@@ -48,9 +48,10 @@ class DruidCommand(ICommand):
                         task_submitted = 0
                         break
             if task_submitted:
-                query=f"SELECT id FROM datasets_draft WHERE dataset_id= %s"
-                response = self.db_service.execute_select_one(sql=query, params=(dataset_id,))
-                self._delete_draft_dataset(dataset_id, response[0])
+                with self.db_service.unit_of_work() as uow:
+                    query=f"SELECT id FROM datasets_draft WHERE dataset_id= %s"
+                    response = uow.execute_select_one(sql=query, params=(dataset_id,))
+                    self._delete_draft_dataset(uow, dataset_id, response[0])
             return ActionResponse(status="OK", status_code=200)
         else:
             print(
@@ -60,16 +61,16 @@ class DruidCommand(ICommand):
                 status="ERROR", status_code=404, error_message="DATASET_ID_NOT_FOUND"
             )
 
-    def _delete_draft_dataset(self, dataset_id, draft_dataset_id):
-
-        self.db_service.execute_delete(sql=f"""DELETE from datasources_draft where dataset_id = %s""", params=(draft_dataset_id,))
+    def _delete_draft_dataset(self, uow: UnitOfWork, dataset_id, draft_dataset_id):
+        # The draft tables are deleted together, or not at all
+        uow.execute_delete(sql=f"""DELETE from datasources_draft where dataset_id = %s""", params=(draft_dataset_id,))
         print(f"Draft datasources/tables for {dataset_id} are deleted successfully...")
 
-        self.db_service.execute_delete(sql=f"""DELETE from dataset_transformations_draft where dataset_id = %s""", params=(draft_dataset_id,))
+        uow.execute_delete(sql=f"""DELETE from dataset_transformations_draft where dataset_id = %s""", params=(draft_dataset_id,))
         print(f"Draft transformations/tables for {dataset_id} are deleted successfully...")
 
-        self.db_service.execute_delete(sql=f"""DELETE from dataset_source_config_draft where dataset_id = %s""", params=(draft_dataset_id,))
+        uow.execute_delete(sql=f"""DELETE from dataset_source_config_draft where dataset_id = %s""", params=(draft_dataset_id,))
         print(f"Draft source config/tables for {dataset_id} are deleted successfully...")
 
-        self.db_service.execute_delete(sql=f"""DELETE from datasets_draft where id = %s""", params=(draft_dataset_id,))
+        uow.execute_delete(sql=f"""DELETE from datasets_draft where id = %s""", params=(draft_dataset_id,))
         print(f"Draft Dataset for {dataset_id} is deleted successfully...")
@@ -2,6 +2,7 @@ import logging
 import subprocess
 
 from command.icommand import ICommand
+from command.restart_coordinator import RestartCoordinator
 from config import Config
 from model.data_models import Action, ActionResponse, CommandPayload
 from service.http_service import HttpService
@@ -13,6 +14,11 @@ class FlinkCommand(ICommand):
         self.config = config
         self.http_service = http_service
         self.logger = logging.getLogger()
+        # restarts requested by publishes in a burst restart every job only once
+        self.restart_coordinator = RestartCoordinator(
+            name=Action.START_PIPELINE_JOBS.name,
+            enabled=self.config.find("flink.restart_coalescing.enabled"),
+        )
 
     def execute(self, command_payload: CommandPayload, action: Action):
         result = None
@@ -20,11 +26,11 @@ class FlinkCommand(ICommand):
             print(
                 f"Invoking START_PIPELINE_JOBS command for dataset_id {command_payload.dataset_id}..."
             )
-            result = self._restart_jobs()
+            result = self._restart_jobs(command_payload.dataset_id)
         return result
 
-    def _restart_jobs(self):
-        return self._install_flink_jobs()
+    def _restart_jobs(self, dataset_id):
+        return self.restart_coordinator.run(self._install_flink_jobs, requested_by=dataset_id)
 
     def _restart_pods(self, release_name, namespace, job_name):
         restart_cmd = f"kubectl delete pods --selector app=flink,component={release_name}-jobmanager --namespace {namespace} && kubectl delete pods --selector app=flink,component={release_name}-taskmanager --namespace {namespace}".format(
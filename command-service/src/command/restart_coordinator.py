@@ -0,0 +1,63 @@
+import threading
+from typing import Callable, List
+
+from model.data_models import ActionResponse
+
+
+class RestartBatch:
+    def __init__(self):
+        self.requested_by: List[str] = []
+        self.done = threading.Event()
+        self.result: ActionResponse | None = None
+        self.error: BaseException | None = None
+
+
+class RestartCoordinator:
+    """
+    Coalesces restart requests that arrive while a restart is running into one
+    restart.
+
+    A request to an idle coordinator restarts right away. Requests arriving
+    while a restart runs join the next batch, which restarts once as soon as
+    the running restart finished, so each request is followed by a complete
+    restart and every request of a batch gets the same outcome. When disabled
+    every request runs its own restart.
+    """
+
+    def __init__(self, name: str, enabled: bool = True):
+        self.name = name
+        self.enabled = enabled
+        self.lock = threading.Lock()
+        self.restart_lock = threading.Lock()
+        # the batch collecting requests until its restart starts
+        self.batch: RestartBatch | None = None
+
+    def run(self, restart: Callable[[], ActionResponse], requested_by: str) -> ActionResponse:
+        if not self.enabled:
+            with self.restart_lock:
+                return restart()
+        with self.lock:
+            batch = self.batch
+            leader = batch is None
+            if leader:
+                batch = self.batch = RestartBatch()
+            batch.requested_by.append(requested_by)
+        if leader:
+            self._restart(batch, restart)
+        batch.done.wait()
+        if batch.error is not None:
+            raise batch.error
+        return batch.result
+
+    def _restart(self, batch: RestartBatch, restart: Callable[[], ActionResponse]):
+        # waits for the running restart, later requests open the next batch
+        with self.restart_lock:
+            with self.lock:
+                self.batch = None
+            print(f"{self.name} | Restarting once for {len(batch.requested_by)} requests {batch.requested_by}")
+            try:
+                batch.result = restart()
+            except BaseException as e:
+                batch.error = e
+            finally:
+                batch.done.set()
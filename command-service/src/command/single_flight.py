@@ -0,0 +1,114 @@
+import threading
+import time
+from typing import Callable, Dict, Set, Tuple
+
+import psycopg2
+
+from exception.exception import CommandInProgressException
+from model.data_models import ActionResponse, CommandJob
+from service.db_service import DatabaseService
+
+# (dataset_id, command)
+FlightKey = Tuple[str, str]
+
+
+class Flight:
+    def __init__(self, key: FlightKey, job: CommandJob):
+        self.key = key
+        self.job = job
+        self.done = threading.Event()
+        self.result: ActionResponse | None = None
+        self.error: BaseException | None = None
+
+    def wait(self, timeout_seconds: float | None = None) -> ActionResponse | None:
+        if not self.done.wait(timeout_seconds):
+            raise CommandInProgressException(
+                f"Command {self.job.command_id} {self.key[1]} for dataset {self.key[0]} "
+                f"did not finish within {timeout_seconds} seconds"
+            )
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class SingleFlight:
+    """
+    Keeps at most one execution of a command per dataset in flight in this
+    process. A request for a (dataset_id, command) that is already in flight
+    attaches to the running execution and gets its job and outcome, instead of
+    running the command a second time.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights: Dict[FlightKey, Flight] = {}
+
+    def join(self, key: FlightKey, new_job: Callable[[], CommandJob]) -> Tuple[Flight, bool]:
+        # Returns the flight of key and whether the caller leads it, that is
+        # runs the command and lands the flight
+        with self.lock:
+            flight = self.flights.get(key)
+            if flight is not None:
+                return flight, False
+            flight = self.flights[key] = Flight(key, new_job())
+            return flight, True
+
+    def land(self, flight: Flight, result: ActionResponse | None = None, error: BaseException | None = None):
+        with self.lock:
+            if self.flights.get(flight.key) is flight:
+                del self.flights[flight.key]
+        flight.result = result
+        flight.error = error
+        flight.done.set()
+
+
+class ReplicaLock:
+    """
+    Postgres advisory locks on (dataset_id, command), so that a command runs
+    for a dataset on one replica of the service at a time. The locks are held
+    on a connection of their own until release, Postgres also drops them when
+    the replica goes away. When the database cannot be reached every lock is
+    taken as acquired, commands then only single-flight within the process.
+    """
+
+    def __init__(self, db_service: DatabaseService, enabled: bool = True):
+        self.db_service = db_service
+        self.enabled = enabled
+        self.connection = None
+        self.held: Set[FlightKey] = set()
+
+    def try_acquire(self, key: FlightKey) -> bool:
+        if not self.enabled or key in self.held:
+            return True
+        try:
+            if self.connection is None:
+                self.connection = self.db_service.connect()
+            cursor = self.connection.cursor()
+            cursor.execute("SELECT pg_try_advisory_lock(hashtext(%s))", ("command:{0}:{1}".format(*key),))
+            acquired = cursor.fetchone()[0]
+        except psycopg2.Error as e:
+            print(f"Replica lock | Unable to lock command {key[1]} for dataset {key[0]}, running without it - ", e)
+            self.release()
+            self.enabled = False
+            return True
+        if acquired:
+            self.held.add(key)
+        return acquired
+
+    def wait(self, key: FlightKey, timeout_seconds: float, poll_seconds: float) -> bool:
+        deadline = time.monotonic() + timeout_seconds
+        while not self.try_acquire(key):
+            if time.monotonic() >= deadline:
+                return False
+            time.sleep(poll_seconds)
+        return True
+
+    def release(self):
+        # Closing the session releases every lock it holds
+        connection, self.connection = self.connection, None
+        self.held.clear()
+        if connection is not None:
+            try:
+                connection.close()
+            except psycopg2.Error as e:
+                print("Replica lock | Unable to close the lock connection - ", e)
@@ -16,3 +16,23 @@ class HttpConnectionException(BaseException):
 class HelmInstallException(BaseException):
     def __init__(self, message):
         self.message = message
+
+
+class CommandQueueFullException(BaseException):
+    def __init__(self, message):
+        self.message = message
+
+
+class CommandInProgressException(BaseException):
+    def __init__(self, message):
+        self.message = message
+
+
+class NDJSONDecodeException(BaseException):
+    def __init__(self, message):
+        self.message = message
+
+
+class UnknownLocaleException(BaseException):
+    def __init__(self, message):
+        self.message = message
@@ -8,6 +8,8 @@ class Helper:
     def __init__(self, registry):
         self.start_time = time.time()
         self.metrics = Metrics(registry)
+        # (field, type) pairs with a published PII rate, per dataset
+        self.pii_monitor_fields = {}
 
     def get_duration(self, start_time):
         duration = int(time.time() * 1000) - start_time if start_time else None
@@ -36,3 +38,40 @@ class Helper:
         self.metrics.successApiCallsMetric().labels(
             entity=entity, id=id, endpoint=endpoint, datasetId=dataset_id, status=200
         ).inc()
+
+    def onPIICacheStats(self, cache_info):
+        for cache, info in cache_info.items():
+            self.metrics.piiCacheHitsMetric().labels(cache=cache).set(info.hits)
+            self.metrics.piiCacheMissesMetric().labels(cache=cache).set(info.misses)
+            self.metrics.piiCacheSizeMetric().labels(cache=cache).set(info.currsize)
+
+    def onPIIPrefilterStats(self, prefilter_info):
+        self.metrics.piiRegexExecutionsMetric().set(prefilter_info["executions"])
+        self.metrics.piiPrefilterSkipsMetric().set(prefilter_info["skipped"])
+
+    def onDBPoolStats(self, pool_stats):
+        if pool_stats is None:
+            return
+        self.metrics.dbPoolConnectionsMetric().labels(state="idle").set(pool_stats["idle"])
+        self.metrics.dbPoolConnectionsMetric().labels(state="in_use").set(pool_stats["in_use"])
+        self.metrics.dbPoolWaitingMetric().set(pool_stats["waiting"])
+        self.metrics.dbPoolWaitSecondsMetric().set(pool_stats["wait_seconds"])
+        for event in ("acquired", "created", "closed", "timeouts", "failed_health_checks"):
+            self.metrics.dbPoolEventsMetric().labels(event=event).set(pool_stats[event])
+
+    def onPIIMonitorSample(self, sample):
+        self.metrics.piiMonitorSampledEventsMetric().labels(datasetId=sample.dataset_id).inc(sample.read)
+        self.metrics.piiMonitorSkippedEventsMetric().labels(datasetId=sample.dataset_id).inc(
+            sample.produced - sample.read
+        )
+        fields = set()
+        for result in sample.results:
+            fields.add((result["field"], result["type"]))
+            self.metrics.piiMonitorFieldRateMetric().labels(
+                datasetId=sample.dataset_id, field=result["field"], type=result["type"]
+            ).set(result["match_rate"])
+        if sample.events != 0:
+            # rates of fields without PII in the latest sample are not reported anymore
+            for field, type_ in self.pii_monitor_fields.get(sample.dataset_id, set()) - fields:
+                self.metrics.piiMonitorFieldRateMetric().remove(sample.dataset_id, field, type_)
+            self.pii_monitor_fields[sample.dataset_id] = fields
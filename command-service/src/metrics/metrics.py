@@ -27,6 +27,76 @@ class Metrics:
             labelnames=["entity", "id", "endpoint", "datasetId", "status"],
             registry=registry,
         )
+        self.pii_cache_hits = Gauge(
+            name="pii_cache_hits",
+            documentation="The number of PII detections served from the cache",
+            labelnames=["cache"],
+            registry=registry,
+        )
+        self.pii_cache_misses = Gauge(
+            name="pii_cache_misses",
+            documentation="The number of PII detections computed on a cache miss",
+            labelnames=["cache"],
+            registry=registry,
+        )
+        self.pii_cache_size = Gauge(
+            name="pii_cache_size",
+            documentation="The number of entries in the PII detection cache",
+            labelnames=["cache"],
+            registry=registry,
+        )
+        self.pii_regex_executions = Gauge(
+            name="pii_regex_executions",
+            documentation="The number of PII value regex scans executed",
+            registry=registry,
+        )
+        self.pii_prefilter_skips = Gauge(
+            name="pii_prefilter_skips",
+            documentation="The number of PII value regex scans skipped by the prefilter",
+            registry=registry,
+        )
+
+        self.pii_monitor_field_rate = Gauge(
+            name="pii_monitor_field_rate",
+            documentation="The fraction of sampled live events whose field value matched a PII type",
+            labelnames=["datasetId", "field", "type"],
+            registry=registry,
+        )
+        self.pii_monitor_sampled_events = Counter(
+            name="pii_monitor_sampled_events",
+            documentation="The number of live events sampled by the PII monitor",
+            labelnames=["datasetId"],
+            registry=registry,
+        )
+        self.pii_monitor_skipped_events = Counter(
+            name="pii_monitor_skipped_events",
+            documentation="The number of live events the PII monitor did not sample",
+            labelnames=["datasetId"],
+            registry=registry,
+        )
+
+        self.db_pool_connections = Gauge(
+            name="db_pool_connections",
+            documentation="The number of open database connections of the pool, idle or in use",
+            labelnames=["state"],
+            registry=registry,
+        )
+        self.db_pool_waiting = Gauge(
+            name="db_pool_waiting",
+            documentation="The number of threads waiting for a database connection",
+            registry=registry,
+        )
+        self.db_pool_events = Gauge(
+            name="db_pool_events",
+            documentation="The number of connections acquired, created and closed, acquire timeouts and failed health checks of the database connection pool",
+            labelnames=["event"],
+            registry=registry,
+        )
+        self.db_pool_wait_seconds = Gauge(
+            name="db_pool_wait_seconds",
+            documentation="The total time spent acquiring database connections from the pool",
+            registry=registry,
+        )
 
     def queryResponseTimeMetric(self):
         return self.node_query_response_time
@@ -39,3 +109,39 @@ class Metrics:
 
     def successApiCallsMetric(self):
         return self.success_api_calls
+
+    def piiCacheHitsMetric(self):
+        return self.pii_cache_hits
+
+    def piiCacheMissesMetric(self):
+        return self.pii_cache_misses
+
+    def piiCacheSizeMetric(self):
+        return self.pii_cache_size
+
+    def piiRegexExecutionsMetric(self):
+        return self.pii_regex_executions
+
+    def piiPrefilterSkipsMetric(self):
+        return self.pii_prefilter_skips
+
+    def piiMonitorFieldRateMetric(self):
+        return self.pii_monitor_field_rate
+
+    def piiMonitorSampledEventsMetric(self):
+        return self.pii_monitor_sampled_events
+
+    def piiMonitorSkippedEventsMetric(self):
+        return self.pii_monitor_skipped_events
+
+    def dbPoolConnectionsMetric(self):
+        return self.db_pool_connections
+
+    def dbPoolWaitingMetric(self):
+        return self.db_pool_waiting
+
+    def dbPoolEventsMetric(self):
+        return self.db_pool_events
+
+    def dbPoolWaitSecondsMetric(self):
+        return self.db_pool_wait_seconds
@@ -31,6 +31,20 @@ class DatasetStatusType(Enum):
     Purged = "Purged"
 
 
+class CommandStatus(Enum):
+    Queued = "Queued"
+    Running = "Running"
+    Completed = "Completed"
+    Failed = "Failed"
+
+
+class StepStatus(Enum):
+    Pending = "Pending"
+    Running = "Running"
+    Completed = "Completed"
+    Failed = "Failed"
+
+
 @dataclass_json
 @dataclass
 class CommandPayload:
@@ -43,6 +57,22 @@ class CommandPayload:
 class Request:
     data: CommandPayload
     id: str
+    # queue the command and answer with its command_id instead of waiting for it
+    asynchronous: bool = False
+
+
+@dataclass_json
+@dataclass
+class BulkCommandPayload:
+    dataset_ids: List[str]
+    command: Command
+
+
+@dataclass_json
+@dataclass
+class BulkRequest:
+    data: BulkCommandPayload
+    id: str
 
 
 @dataclass_json
@@ -57,6 +87,7 @@ class ResponseParams:
 class Result:
     dataset_id: str
     message: str
+    command_id: str | None = None
 
 
 @dataclass_json
@@ -84,11 +115,41 @@ class ActionResponse:
     error_message: str = None
 
 
+@dataclass_json
+@dataclass
+class StepProgress:
+    action: str
+    status: str = StepStatus.Pending.name
+    started_at: int | None = None
+    finished_at: int | None = None
+    error_message: str | None = None
+    # response of the step, completed steps are not run again on resume
+    result: dict | None = None
+
+
+@dataclass_json
+@dataclass
+class CommandJob:
+    command_id: str
+    dataset_id: str
+    command: str
+    steps: List[StepProgress]
+    status: str = CommandStatus.Queued.name
+    submitted_at: int = 0
+    started_at: int | None = None
+    finished_at: int | None = None
+    error_message: str | None = None
+
+
 @dataclass
 class DatasetRequest:
     id: str
     dataset_id: str
     data: List[dict]
+    batch: bool = False
+    incremental: bool = False
+    data_schema: dict | None = None
+    locales: List[str] | None = None
 
 
 @dataclass
@@ -114,17 +175,33 @@ class PIIResult:
     reason: List[PIIReason]
 
 
+@dataclass
+class PIIFieldProfile:
+    field: str
+    type: str
+    score: float
+    reason: List[PIIReason]
+    match_rate: float
+    matched_events: int
+    total_events: int
+
+
 @dataclass
 class DatasetResponse:
     id: str
     response_code: str
     status_code: int
-    result: List[PIIResult] | PIIError
+    result: List[PIIResult] | List[PIIFieldProfile] | PIIError
     ts: str | None = None
     params: ResponseParams | None = None
+    incomplete: bool = False
 
 
 class PIIModel:
+    # entities the model detects, detectors plugged into the regex model are
+    # evaluated for these entities in addition to the value rules
+    entities: List[str] = []
+
     def __init__(self):
         pass
 
@@ -134,6 +211,9 @@ class PIIModel:
     def detect_entity(self, entity, value) -> List[PIIReason]:
         return [PIIReason()]
 
+    def detect_many(self, entity, values: List[str]) -> List[List[PIIReason]]:
+        return [self.detect_entity(entity, value) for value in values]
+
     def detect_entity_in_fieldname(self, entity, value) -> List[PIIReason]:
         return [PIIReason()]
 
@@ -62,13 +62,32 @@ class Audit:
     action: str = "dataset:publish"
 
 
+@dataclass_json
+@dataclass
+class FieldPIIRate:
+    field: str
+    type: str
+    rate: float
+    score: float
+
+
+@dataclass_json
+@dataclass
+class PIIRates:
+    sampled_events: int
+    produced_events: int
+    fields: list[FieldPIIRate]
+    incomplete: bool = False
+    action: str = "dataset:pii-monitor"
+
+
 @dataclass_json
 @dataclass
 class Telemetry:
     actor: Actor
     context: Context
     object: Object | None
-    edata: Audit | None
+    edata: Audit | PIIRates | None
     eid: str = "AUDIT"
     ets: int = time.time() * 1000
     ver: str = "1.0.0"
@@ -5,37 +5,73 @@ from typing import List
 
 from fastapi import FastAPI
 from fastapi import Request as FastAPIRequest
-from fastapi import Response, status
+from fastapi import Query, Response, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse, PlainTextResponse
 from prometheus_client import CollectorRegistry, generate_latest
 
+from command.bulk_command import BulkCommandRunner
 from command.command_executor import CommandExecutor
+from command.command_jobs import CommandJobQueue
 from command.connector_registry import ConnectorRegistry
+from exception.exception import (
+    CommandInProgressException,
+    CommandQueueFullException,
+    NDJSONDecodeException,
+    UnknownLocaleException,
+)
 from metrics import Helper
 from model.data_models import (
-    ActionResponse,
+    BulkRequest,
+    CommandStatus,
     ConnectorResponseModel,
     DatasetRequest,
     DatasetResponse,
     PIIError,
+    PIIFieldProfile,
     PIIResult,
     Request,
     Response,
     Result,
+    StepStatus,
 )
+from model.telemetry_models import FieldPIIRate, Object, PIIRates
 from service.detect_pii_service import DetectPIIService
+from service.ndjson_decoder import NDJSONDecoder
+from service.pii_monitor import KafkaSampleConsumer, PIIMonitor, TopicSample, live_datasets
+from service.pii_profile import PIIProfile
+from service.scan_budget import ScanBudget
 
 app = FastAPI()
 command_executor = CommandExecutor()
+command_jobs = CommandJobQueue(
+    command_executor,
+    workers=command_executor.config_obj.find("command_jobs.workers"),
+    max_pending=command_executor.config_obj.find("command_jobs.max_pending"),
+    max_finished=command_executor.config_obj.find("command_jobs.max_finished"),
+    replica_lock=command_executor.config_obj.find("command_jobs.replica_lock"),
+    replica_wait_seconds=command_executor.config_obj.find("command_jobs.replica_wait_seconds"),
+    replica_poll_seconds=command_executor.config_obj.find("command_jobs.replica_poll_seconds"),
+    flight_wait_seconds=command_executor.config_obj.find("command_jobs.flight_wait_seconds"),
+)
 pii_service = DetectPIIService()
 registry = CollectorRegistry()
 helper = Helper(registry)
+bulk_commands = BulkCommandRunner(
+    command_executor,
+    command_jobs,
+    max_concurrency=command_executor.config_obj.find("bulk_commands.max_concurrency"),
+    shared_steps=command_executor.config_obj.find("bulk_commands.shared_steps"),
+)
 
 system_dataset_endpoint = "/system/v1/dataset/command"
 
 
 @app.post(system_dataset_endpoint)
 async def publish_dataset(request: Request):
+    # The workflow blocks on helm, database and http calls, so it runs on a
+    # worker thread. Asynchronous requests are answered with 202 and a
+    # command_id as soon as the command is queued.
     start_time = int(time.time() * 1000)
     data = request.data
     helper.onRequest(
@@ -44,8 +80,10 @@ async def publish_dataset(request: Request):
         endpoint=system_dataset_endpoint,
         dataset_id=data.dataset_id,
     )
-    result: ActionResponse = command_executor.execute_command(
-        payload=data, ts=start_time
+    if request.asynchronous:
+        return submit_command(request, start_time)
+    job, result = await run_in_threadpool(
+        command_jobs.execute, payload=data, ts=start_time
     )
     if result.status_code == status.HTTP_404_NOT_FOUND:
         helper.onFailedRequest(
@@ -61,6 +99,7 @@ async def publish_dataset(request: Request):
             response_code="ERROR",
             status_code=status.HTTP_404_NOT_FOUND,
             message=result.error_message,
+            command_id=job.command_id,
         )
     elif result.status_code == status.HTTP_500_INTERNAL_SERVER_ERROR:
         helper.onFailedRequest(
@@ -76,6 +115,7 @@ async def publish_dataset(request: Request):
             response_code="ERROR",
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             message=result.error_message,
+            command_id=job.command_id,
         )
     else:
         helper.onSuccessRequest(
@@ -90,19 +130,178 @@ async def publish_dataset(request: Request):
             response_code="OK",
             status_code=status.HTTP_200_OK,
             message="PUBLISH_DATASET_SUCCESSFUL",
+            command_id=job.command_id,
         )
     return response
 
 
+def submit_command(request: Request, start_time: int) -> JSONResponse:
+    data = request.data
+    try:
+        job = command_jobs.submit(payload=data, ts=start_time)
+    except CommandQueueFullException as e:
+        print(f"Command {data.command.name} for dataset {data.dataset_id} refused - ", e.message)
+        helper.onFailedRequest(
+            entity="dataset",
+            id=request.id,
+            endpoint=system_dataset_endpoint,
+            dataset_id=data.dataset_id,
+            status=status.HTTP_503_SERVICE_UNAVAILABLE,
+        )
+        response = get_response_object(
+            dataset_id=data.dataset_id,
+            request_id=request.id,
+            response_code="ERROR",
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            message="COMMAND_QUEUE_FULL",
+        )
+        return JSONResponse(
+            content=response.to_dict(), status_code=status.HTTP_503_SERVICE_UNAVAILABLE
+        )
+    helper.onSuccessRequest(
+        entity="dataset",
+        id=request.id,
+        endpoint=system_dataset_endpoint,
+        dataset_id=data.dataset_id,
+    )
+    response = get_response_object(
+        dataset_id=data.dataset_id,
+        request_id=request.id,
+        response_code="OK",
+        status_code=status.HTTP_202_ACCEPTED,
+        message="COMMAND_ACCEPTED",
+        command_id=job.command_id,
+    )
+    return JSONResponse(content=response.to_dict(), status_code=status.HTTP_202_ACCEPTED)
+
+
+bulk_dataset_endpoint = "/system/v1/dataset/command/bulk"
+
+
+@app.post(bulk_dataset_endpoint)
+async def bulk_command(request: BulkRequest):
+    # Runs the command for every dataset and answers with the outcome of each
+    # dataset and step once all of them are done
+    start_time = int(time.time() * 1000)
+    data = request.data
+    dataset_ids = list(dict.fromkeys(data.dataset_ids))
+    helper.onRequest(
+        entity="dataset", id=request.id, endpoint=bulk_dataset_endpoint, dataset_id=None
+    )
+    max_datasets = command_executor.config_obj.find("bulk_commands.max_datasets")
+    if len(dataset_ids) == 0 or len(dataset_ids) > max_datasets:
+        helper.onFailedRequest(
+            entity="dataset",
+            id=request.id,
+            endpoint=bulk_dataset_endpoint,
+            dataset_id=None,
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+        return command_error(
+            request.id, None, status.HTTP_400_BAD_REQUEST, f"EXPECTED_1_TO_{max_datasets}_DATASETS"
+        )
+    jobs = await run_in_threadpool(
+        bulk_commands.run, command=data.command, dataset_ids=dataset_ids, ts=start_time
+    )
+    helper.onSuccessRequest(
+        entity="dataset", id=request.id, endpoint=bulk_dataset_endpoint, dataset_id=None
+    )
+    datasets = [
+        {
+            "dataset_id": job.dataset_id,
+            "command_id": job.command_id,
+            "status": job.status,
+            "error_message": job.error_message,
+            "steps": {step.action: step.status for step in job.steps},
+        }
+        for job in jobs
+    ]
+    return JSONResponse(
+        content={
+            "id": request.id,
+            "response_code": "OK",
+            "status_code": status.HTTP_200_OK,
+            "ts": dt.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "result": {
+                "command": data.command.name,
+                "completed": sum(1 for job in jobs if job.status == CommandStatus.Completed.name),
+                "failed": sum(1 for job in jobs if job.status != CommandStatus.Completed.name),
+                "datasets": datasets,
+            },
+        }
+    )
+
+
+@app.get(system_dataset_endpoint + "/{command_id}")
+def get_command_status(command_id: str):
+    job = command_jobs.get(command_id)
+    if job is None:
+        return command_error(command_id, None, status.HTTP_404_NOT_FOUND, "COMMAND_NOT_FOUND")
+    return JSONResponse(
+        content={
+            "id": command_id,
+            "response_code": "OK",
+            "status_code": status.HTTP_200_OK,
+            "ts": dt.now().strftime("%Y-%m-%d %H:%M:%S"),
+            "result": job.to_dict(),
+        }
+    )
+
+
+@app.post(system_dataset_endpoint + "/{command_id}/resume")
+def resume_command(command_id: str):
+    # Runs the steps of a failed or interrupted command that did not complete
+    job = command_jobs.get(command_id)
+    if job is None:
+        return command_error(command_id, None, status.HTTP_404_NOT_FOUND, "COMMAND_NOT_FOUND")
+    if all(step.status == StepStatus.Completed.name for step in job.steps):
+        return command_error(
+            command_id, job.dataset_id, status.HTTP_409_CONFLICT, "COMMAND_ALREADY_COMPLETED"
+        )
+    try:
+        if not command_executor.journal.claim(command_id):
+            raise CommandInProgressException(f"Command {command_id} is {job.status}")
+        command_jobs.resume(job)
+    except CommandInProgressException as e:
+        print(e.message)
+        return command_error(command_id, job.dataset_id, status.HTTP_409_CONFLICT, "COMMAND_IN_PROGRESS")
+    except CommandQueueFullException as e:
+        print(e.message)
+        return command_error(
+            command_id, job.dataset_id, status.HTTP_503_SERVICE_UNAVAILABLE, "COMMAND_QUEUE_FULL"
+        )
+    response = get_response_object(
+        dataset_id=job.dataset_id,
+        request_id=command_id,
+        response_code="OK",
+        status_code=status.HTTP_202_ACCEPTED,
+        message="COMMAND_RESUMED",
+        command_id=command_id,
+    )
+    return JSONResponse(content=response.to_dict(), status_code=status.HTTP_202_ACCEPTED)
+
+
+def command_error(command_id, dataset_id, status_code, message) -> JSONResponse:
+    response = get_response_object(
+        dataset_id=dataset_id,
+        request_id=command_id,
+        response_code="ERROR",
+        status_code=status_code,
+        message=message,
+        command_id=command_id,
+    )
+    return JSONResponse(content=response.to_dict(), status_code=status_code)
+
+
 def get_response_object(
-    dataset_id, request_id, response_code, status_code, message=None
+    dataset_id, request_id, response_code, status_code, message=None, command_id=None
 ):
     response = Response(
         id=request_id,
         response_code=response_code,
         status_code=status_code,
         ts=dt.now().strftime("%Y-%m-%d %H:%M:%S"),
-        result=Result(dataset_id=dataset_id, message=message),
+        result=Result(dataset_id=dataset_id, message=message, command_id=command_id),
     )
     return response
 
@@ -115,46 +314,245 @@ def analyze_pii(request: DatasetRequest) -> DatasetResponse:
     helper.onRequest(
         entity="dataset", id=request.id, endpoint=pii_endpoint, dataset_id=None
     )
+    budget = ScanBudget(pii_service.request_budget_ms)
     try:
-        event_data = request.data[0]
+        event_data = request.data if request.batch else request.data[0]
     except Exception as err:
         result: PIIError = {
             "errorCode": 500,
-            "errorMsg": type(err),
-            "errorTrace": err.args,
+            "errorMsg": type(err).__name__,
+            "errorTrace": str(err),
         }
     else:
-        result: List[PIIResult] | PIIError = pii_service.detect_pii_fields(event_data)
+        dataset_id = request.dataset_id if request.incremental else None
+        try:
+            if request.batch:
+                result: List[PIIFieldProfile] | PIIError = pii_service.detect_pii_batch(
+                    event_data, budget, dataset_id, request.data_schema, request.locales
+                )
+            else:
+                result: List[PIIResult] | PIIError = pii_service.detect_pii_fields(
+                    event_data, budget, dataset_id, request.data_schema, request.locales
+                )
+        except UnknownLocaleException as err:
+            result: PIIError = {
+                "errorCode": 400,
+                "errorMsg": type(err).__name__,
+                "errorTrace": err.message,
+            }
     finally:
-        if type(result) == list:
-            helper.onSuccessRequest(
-                entity="dataset", id=request.id, endpoint=pii_endpoint, dataset_id=None
-            )
-            response_code = "OK"
-            status_code = 200
+        return get_pii_response(
+            request_id=request.id, result=result, incomplete=budget.exhausted
+        )
+
+
+pii_stream_endpoint = "/system/data/v1/analyze/pii/stream"
+
+
+@app.post(pii_stream_endpoint)
+async def analyze_pii_stream(
+    req: FastAPIRequest,
+    id: str,
+    dataset_id: str | None = None,
+    locales: List[str] | None = Query(None),
+) -> DatasetResponse:
+    # Accepts a plain or gzip compressed NDJSON body and profiles the events in
+    # batches while the upload is read, only the running profile is kept. The
+    # rest of the upload is not read once the budget is spent.
+    helper.onRequest(
+        entity="dataset", id=id, endpoint=pii_stream_endpoint, dataset_id=dataset_id
+    )
+    decoder = NDJSONDecoder(
+        compressed=True if req.headers.get("content-encoding") == "gzip" else None,
+        max_line_bytes=pii_service.stream_max_line_bytes,
+        max_inflated_bytes=pii_service.stream_max_inflated_bytes,
+    )
+    profile = PIIProfile()
+    budget = ScanBudget(pii_service.stream_budget_ms)
+    events = []
+    try:
+        async for chunk in req.stream():
+            events += decoder.feed(chunk)
+            if len(events) >= pii_service.stream_batch_size:
+                await run_in_threadpool(
+                    pii_service.profile_events, events, profile, budget, locales=locales
+                )
+                events = []
+            if budget.exhausted:
+                break
         else:
-            helper.onFailedRequest(
-                entity="dataset",
-                id=request.id,
-                endpoint=pii_endpoint,
-                dataset_id=None,
-                status=500,
-            )
-            response_code = "INTERNAL_SERVER_ERROR"
-            status_code = 500
-        response: DatasetResponse = {
-            "id": str(uuid.uuid4()),
-            "response_code": response_code,
-            "status_code": status_code,
-            "result": result,
-            "ts": str(time.time() * 1000),
-            "params": {"status": "ACTIVE"},
+            events += decoder.close()
+            if len(events) != 0:
+                await run_in_threadpool(
+                    pii_service.profile_events, events, profile, budget, locales=locales
+                )
+        result: List[PIIFieldProfile] = profile.results()
+    except (NDJSONDecodeException, UnknownLocaleException) as err:
+        result: PIIError = {
+            "errorCode": 400,
+            "errorMsg": type(err).__name__,
+            "errorTrace": err.message,
         }
-        return response
+    except Exception as err:
+        result: PIIError = {
+            "errorCode": 500,
+            "errorMsg": type(err).__name__,
+            "errorTrace": str(err),
+        }
+    return get_pii_response(
+        request_id=id,
+        result=result,
+        endpoint=pii_stream_endpoint,
+        dataset_id=dataset_id,
+        incomplete=budget.exhausted,
+    )
+
+
+def get_pii_response(
+    request_id, result, endpoint=pii_endpoint, dataset_id=None, incomplete=False
+) -> DatasetResponse:
+    if type(result) == list:
+        helper.onSuccessRequest(
+            entity="dataset", id=request_id, endpoint=endpoint, dataset_id=dataset_id
+        )
+        response_code = "OK"
+        status_code = 200
+    else:
+        status_code = result.get("errorCode", 500)
+        helper.onFailedRequest(
+            entity="dataset",
+            id=request_id,
+            endpoint=endpoint,
+            dataset_id=dataset_id,
+            status=status_code,
+        )
+        response_code = "BAD_REQUEST" if status_code == 400 else "INTERNAL_SERVER_ERROR"
+    response: DatasetResponse = {
+        "id": str(uuid.uuid4()),
+        "response_code": response_code,
+        "status_code": status_code,
+        "result": result,
+        "ts": str(time.time() * 1000),
+        "params": {"status": "ACTIVE"},
+        "incomplete": incomplete,
+    }
+    return response
+
+
+pii_cache_endpoint = "/system/data/v1/analyze/pii/cache"
+
+
+@app.delete(pii_cache_endpoint)
+def invalidate_pii_cache(dataset_id: str | None = None):
+    # Drops the cached field verdicts of one dataset, or of all datasets
+    invalidated = pii_service.result_cache.invalidate(dataset_id)
+    print(f"Invalidated {invalidated} PII result cache entries for dataset {dataset_id}")
+    return get_response_object(
+        dataset_id=dataset_id,
+        request_id=str(uuid.uuid4()),
+        response_code="OK",
+        status_code=status.HTTP_200_OK,
+        message="PII_CACHE_INVALIDATED",
+    )
+
+
+pii_monitor: PIIMonitor | None = None
+
+
+def publish_pii_rates(sample: TopicSample):
+    helper.onPIIMonitorSample(sample)
+    if sample.events == 0:
+        return
+    edata = PIIRates(
+        sampled_events=sample.events,
+        produced_events=sample.produced,
+        fields=[
+            FieldPIIRate(result["field"], result["type"], result["match_rate"], result["score"])
+            for result in sample.results
+        ],
+        incomplete=sample.incomplete,
+    )
+    command_executor.telemetry_service.metric(
+        object_=Object(sample.dataset_id, "dataset", None), edata=edata
+    )
+
+
+@app.on_event("startup")
+def start_journal_heartbeat():
+    command_executor.journal.start_heartbeat()
+
+
+@app.on_event("startup")
+def resume_in_flight_commands():
+    # Commands left queued or running by a stopped process are run again from
+    # their first incomplete step
+    if not command_executor.config_obj.find("command_journal.resume_on_startup"):
+        return
+    try:
+        command_ids = command_executor.journal.claim_in_flight()
+    except Exception as e:
+        print("Error while claiming in-flight commands - ", e)
+        return
+    # a command that cannot be resumed does not keep the others from resuming
+    for command_id in command_ids:
+        try:
+            job = command_executor.load_job(command_id)
+            if job is None:
+                print(f"Not resuming command {command_id} - it is not in the command journal")
+                continue
+            print(f"Resuming in-flight command {command_id} {job.command} for dataset {job.dataset_id}")
+            command_jobs.resume(job)
+        except (CommandInProgressException, CommandQueueFullException) as e:
+            print(f"Not resuming command {command_id} - ", e.message)
+        except Exception as e:
+            print(f"Error while resuming command {command_id} - ", e)
+
+
+@app.on_event("startup")
+def start_pii_monitor():
+    global pii_monitor
+    config = pii_service.config
+    if not config.find("pii.monitor.enabled"):
+        return
+    # the monitor is optional, the service starts without it when kafka cannot
+    # be reached
+    try:
+        monitor = PIIMonitor(
+            pii_service,
+            consumer=KafkaSampleConsumer(config.find("kafka.brokers")),
+            datasets=lambda: live_datasets(command_executor.db_service),
+            on_sample=publish_pii_rates,
+            sample_fraction=config.find("pii.monitor.sample_fraction"),
+            max_events=config.find("pii.monitor.max_events"),
+            batch_size=config.find("pii.monitor.batch_size"),
+            interval_seconds=config.find("pii.monitor.interval_seconds"),
+            budget_ms=config.find("pii.monitor.budget_ms"),
+            poll_timeout_ms=config.find("pii.monitor.poll_timeout_ms"),
+        )
+        monitor.start()
+    except Exception as e:
+        print("PII monitor | Unable to start, live datasets are not sampled - ", e)
+        return
+    pii_monitor = monitor
+
+
+@app.on_event("shutdown")
+def shutdown_services():
+    if pii_monitor is not None:
+        pii_monitor.stop()
+    command_jobs.shutdown()
+    command_executor.journal.stop_heartbeat()
+    pii_service.shutdown()
+    command_executor.db_service.close()
 
 
 @app.get("/metrics", response_class=PlainTextResponse)
 def metrics():
+    helper.onPIICacheStats(
+        {**pii_service.cache_info(), "result": pii_service.result_cache.cache_info()}
+    )
+    helper.onPIIPrefilterStats(pii_service.prefilter_info())
+    helper.onDBPoolStats(command_executor.db_service.pool_stats())
     data = generate_latest(registry=registry)
     return data
 
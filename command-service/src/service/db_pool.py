@@ -0,0 +1,264 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Deque, Dict, List
+
+import psycopg2
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+
+class ConnectionPoolTimeout(psycopg2.OperationalError):
+    # An operational error, so that callers treat an exhausted pool like an
+    # unreachable database
+    pass
+
+
+class PooledConnection:
+    def __init__(self, connection):
+        self.connection = connection
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+
+class Waiter:
+    def __init__(self):
+        self.ready = threading.Event()
+        # a connection handed over, or None when a slot to open one was
+        self.pooled: PooledConnection | None = None
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of database connections.
+
+    At most max_size connections are open at a time. Callers that find none
+    available wait in turn for up to acquire_timeout_seconds, a returned
+    connection is handed to the longest waiting one, before
+    ConnectionPoolTimeout is raised. Idle connections are reused most recently
+    used first, those idle for more than health_check_seconds are checked with
+    a query before they are handed out. Connections are closed once they are
+    older than max_lifetime_seconds, when they broke, or when they were idle
+    for max_idle_seconds while more than min_size are open.
+
+    Once the pool is closed its idle connections are closed at once, those in
+    use when they are released, and acquire raises InterfaceError.
+    """
+
+    def __init__(
+        self,
+        connect: Callable,
+        min_size: int = 1,
+        max_size: int = 10,
+        max_lifetime_seconds: float = 1800,
+        max_idle_seconds: float = 300,
+        health_check_seconds: float = 30,
+        acquire_timeout_seconds: float = 30,
+    ):
+        self.connect = connect
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size, 1)
+        self.max_lifetime_seconds = max_lifetime_seconds
+        self.max_idle_seconds = max_idle_seconds
+        self.health_check_seconds = health_check_seconds
+        self.acquire_timeout_seconds = acquire_timeout_seconds
+        self.lock = threading.Lock()
+        self.idle: Deque[PooledConnection] = deque()
+        self.in_use: Dict[int, PooledConnection] = {}
+        self.waiters: Deque[Waiter] = deque()
+        # connections being opened, they count towards max_size
+        self.opening = 0
+        self.closed = False
+        self.counts = {"acquired": 0, "created": 0, "closed": 0, "timeouts": 0, "failed_health_checks": 0}
+        self.wait_seconds = 0.0
+
+    def fill(self):
+        # Opens connections up to min_size
+        while True:
+            with self.lock:
+                if self._size() >= self.min_size:
+                    return
+                self.opening += 1
+            self._put_back(self._open())
+
+    @contextmanager
+    def connection(self):
+        pooled = self.acquire()
+        try:
+            yield pooled.connection
+        except (psycopg2.OperationalError, psycopg2.InterfaceError):
+            self.release(pooled, discard=True)
+            raise
+        except BaseException:
+            self.release(pooled)
+            raise
+        self.release(pooled)
+
+    def acquire(self) -> PooledConnection:
+        start = time.monotonic()
+        deadline = start + self.acquire_timeout_seconds
+        while True:
+            pooled = self._take(deadline)
+            if pooled is None:
+                pooled = self._open()
+            elif not self._usable(pooled):
+                self.release(pooled, discard=True)
+                continue
+            with self.lock:
+                self.counts["acquired"] += 1
+                self.wait_seconds += time.monotonic() - start
+            return pooled
+
+    def release(self, pooled: PooledConnection, discard: bool = False):
+        connection = pooled.connection
+        if not discard and not connection.closed:
+            try:
+                if connection.get_transaction_status() != TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+            except psycopg2.Error:
+                discard = True
+        expired = time.monotonic() - pooled.created_at > self.max_lifetime_seconds
+        if discard or expired or connection.closed or self.closed:
+            with self.lock:
+                self.in_use.pop(id(pooled), None)
+                self._hand_over_slot()
+            self._close(pooled)
+        else:
+            self._put_back(pooled)
+
+    def stats(self) -> Dict[str, float]:
+        with self.lock:
+            return {
+                "idle": len(self.idle),
+                "in_use": len(self.in_use),
+                "max_size": self.max_size,
+                "waiting": len(self.waiters),
+                "wait_seconds": self.wait_seconds,
+                **self.counts,
+            }
+
+    def close(self):
+        # Connections in use are closed when they are released, waiting callers
+        # are woken up to fail
+        with self.lock:
+            self.closed = True
+            idle = list(self.idle)
+            self.idle.clear()
+            while len(self.waiters) != 0:
+                self._hand_over_slot()
+        for pooled in idle:
+            self._close(pooled)
+
+    def _take(self, deadline: float) -> PooledConnection | None:
+        # An idle connection, or None when a slot to open one was reserved
+        with self.lock:
+            if self.closed:
+                raise psycopg2.InterfaceError("Connection pool is closed")
+            if len(self.waiters) == 0:
+                if len(self.idle) != 0:
+                    pooled = self.idle.pop()
+                    self.in_use[id(pooled)] = pooled
+                    return pooled
+                if self._size() < self.max_size:
+                    self.opening += 1
+                    return None
+            waiter = Waiter()
+            self.waiters.append(waiter)
+        waiter.ready.wait(max(deadline - time.monotonic(), 0))
+        with self.lock:
+            # a connection may have been handed over since the wait timed out
+            if not waiter.ready.is_set():
+                self.waiters.remove(waiter)
+                self.counts["timeouts"] += 1
+                raise ConnectionPoolTimeout(
+                    f"No database connection available within {self.acquire_timeout_seconds} seconds"
+                )
+            if self.closed and waiter.pooled is None:
+                # the slot handed over by close
+                self.opening -= 1
+                raise psycopg2.InterfaceError("Connection pool is closed")
+        return waiter.pooled
+
+    def _put_back(self, pooled: PooledConnection):
+        # Hands pooled to the longest waiting caller, or makes it idle. It is
+        # closed once the pool is.
+        now = time.monotonic()
+        pooled.last_used = now
+        with self.lock:
+            self.in_use.pop(id(pooled), None)
+            if self.closed:
+                expired = [pooled]
+            elif len(self.waiters) != 0:
+                waiter = self.waiters.popleft()
+                self.in_use[id(pooled)] = pooled
+                waiter.pooled = pooled
+                waiter.ready.set()
+                return
+            else:
+                self.idle.append(pooled)
+                expired = self._expire_idle(now)
+        for idle in expired:
+            self._close(idle)
+
+    def _hand_over_slot(self):
+        # A connection went away, the longest waiting caller may open one.
+        # Called with the lock held.
+        if len(self.waiters) != 0:
+            self.opening += 1
+            self.waiters.popleft().ready.set()
+
+    def _size(self) -> int:
+        return len(self.idle) + len(self.in_use) + self.opening
+
+    def _open(self) -> PooledConnection:
+        # The caller reserved a slot in opening. The connection is in use from
+        # the moment the slot is given back, so that it counts towards max_size
+        # all along.
+        try:
+            pooled = PooledConnection(self.connect())
+        except BaseException:
+            with self.lock:
+                self.opening -= 1
+                self._hand_over_slot()
+            raise
+        with self.lock:
+            self.opening -= 1
+            self.counts["created"] += 1
+            self.in_use[id(pooled)] = pooled
+        return pooled
+
+    def _usable(self, pooled: PooledConnection) -> bool:
+        now = time.monotonic()
+        if pooled.connection.closed or now - pooled.created_at > self.max_lifetime_seconds:
+            return False
+        if now - pooled.last_used > self.health_check_seconds:
+            try:
+                cursor = pooled.connection.cursor()
+                cursor.execute("SELECT 1")
+                cursor.close()
+            except psycopg2.Error as e:
+                print("Connection pool | Health check of an idle connection failed - ", e)
+                with self.lock:
+                    self.counts["failed_health_checks"] += 1
+                return False
+        return True
+
+    def _expire_idle(self, now: float) -> List[PooledConnection]:
+        # Takes the connections idle for too long out of the pool, the oldest
+        # are at the left of the deque. Called with the lock held.
+        expired = []
+        while (
+            len(self.idle) != 0
+            and self._size() > self.min_size
+            and now - self.idle[0].last_used > self.max_idle_seconds
+        ):
+            expired.append(self.idle.popleft())
+        return expired
+
+    def _close(self, pooled: PooledConnection):
+        try:
+            pooled.connection.close()
+        except psycopg2.Error as e:
+            print("Connection pool | Unable to close a connection - ", e)
+        with self.lock:
+            self.counts["closed"] += 1
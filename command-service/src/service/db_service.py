@@ -1,9 +1,13 @@
+import threading
+
+import orjson
 import psycopg2
 import psycopg2.extras
-
+from contextlib import contextmanager
 from typing import Callable
 from tenacity import retry, stop_after_attempt, wait_exponential
 from config import Config
+from service.db_pool import ConnectionPool
 
 def reconnect(func: Callable):
 
@@ -15,7 +19,66 @@ def reconnect(func: Callable):
     return wrapper
 
 
+def dumps_json(value) -> str:
+    # Non-string keys are written as strings, as json.dumps does. Datetimes
+    # and UUIDs are written as ISO 8601 and canonical strings, NaN and
+    # infinities as null, which Postgres accepts.
+    return orjson.dumps(value, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+
+
+def jsonb(value) -> psycopg2.extras.Json:
+    # A JSON or JSONB query parameter. It is serialized once with orjson, and
+    # quoted by psycopg2 when the query is sent.
+    return psycopg2.extras.Json(value, dumps=dumps_json)
+
+
+def execute_pages(cursor, sql, rows, page_size):
+    # Runs sql, whose VALUES list is a single %s, with page_size rows in a
+    # statement and returns the number of rows affected
+    record_count = 0
+    for start in range(0, len(rows), page_size):
+        page = rows[start:start + page_size]
+        psycopg2.extras.execute_values(cursor, sql, page, page_size=len(page))
+        record_count += cursor.rowcount
+    return record_count
+
+
+class UnitOfWork:
+    # Statements of a unit of work, they run on one connection within one
+    # transaction. The methods are those of DatabaseService.
+
+    def __init__(self, db_connection, page_size=100):
+        self.db_connection = db_connection
+        self.page_size = page_size
+
+    def execute_select_one(self, sql, params):
+        with self.db_connection.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchone()
+
+    def execute_select_all(self, sql, params):
+        with self.db_connection.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+            cursor.execute(sql, params)
+            return cursor.fetchall()
+
+    def execute_upsert(self, sql, params):
+        with self.db_connection.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+            cursor.execute(sql, params)
+            return cursor.rowcount
+
+    def execute_batch_upsert(self, sql, rows, page_size=None):
+        with self.db_connection.cursor() as cursor:
+            return execute_pages(cursor, sql, rows, page_size or self.page_size)
+
+    def execute_delete(self, sql, params):
+        with self.db_connection.cursor(cursor_factory=psycopg2.extras.DictCursor) as cursor:
+            cursor.execute(sql, params)
+
+
 class DatabaseService:
+    # one pool for every DatabaseService of the process, created on first use
+    pool: ConnectionPool | None = None
+    pool_lock = threading.Lock()
 
     def __init__(self):
         self.config = Config()
@@ -37,37 +100,89 @@ class DatabaseService:
         db_connection.autocommit = True
         return db_connection
 
+    def get_pool(self) -> ConnectionPool:
+        with DatabaseService.pool_lock:
+            if DatabaseService.pool is None:
+                DatabaseService.pool = ConnectionPool(
+                    self.connect,
+                    min_size=self.config.find("postgres.pool.min_size"),
+                    max_size=self.config.find("postgres.pool.max_size"),
+                    max_lifetime_seconds=self.config.find("postgres.pool.max_lifetime_seconds"),
+                    max_idle_seconds=self.config.find("postgres.pool.max_idle_seconds"),
+                    health_check_seconds=self.config.find("postgres.pool.health_check_seconds"),
+                    acquire_timeout_seconds=self.config.find("postgres.pool.acquire_timeout_seconds"),
+                )
+                try:
+                    DatabaseService.pool.fill()
+                except psycopg2.Error as e:
+                    print("Connection pool | Unable to open the minimum connections - ", e)
+            return DatabaseService.pool
+
+    def pool_stats(self):
+        # None until the first query opened the pool
+        pool = DatabaseService.pool
+        return pool.stats() if pool is not None else None
+
+    def close(self):
+        pool = DatabaseService.pool
+        if pool is not None:
+            pool.close()
+
+    @contextmanager
+    def unit_of_work(self):
+        # Yields a UnitOfWork whose statements are committed together when the
+        # block exits, or rolled back when it raises
+        with self.get_pool().connection() as db_connection:
+            db_connection.autocommit = False
+            try:
+                yield UnitOfWork(db_connection, page_size=self.config.find("postgres.batch_page_size"))
+                db_connection.commit()
+            except BaseException:
+                if not db_connection.closed:
+                    db_connection.rollback()
+                raise
+            finally:
+                if not db_connection.closed:
+                    db_connection.autocommit = True
+
     # @reconnect
     def execute_select_one(self, sql, params):
-        db_connection = self.connect()
-        cursor = db_connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cursor.execute(sql, params)
-        result = cursor.fetchone()
-        db_connection.close()
+        with self.get_pool().connection() as db_connection:
+            cursor = db_connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
+            cursor.execute(sql, params)
+            result = cursor.fetchone()
+            cursor.close()
         return result
 
     # @reconnect
     def execute_select_all(self, sql, params):
-        db_connection = self.connect()
-        cursor = db_connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cursor.execute(sql, params)
-        result = cursor.fetchall()
-        db_connection.close()
+        with self.get_pool().connection() as db_connection:
+            cursor = db_connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
+            cursor.execute(sql, params)
+            result = cursor.fetchall()
+            cursor.close()
         return result
 
     # @reconnect
     def execute_upsert(self, sql, params):
-        db_connection = self.connect()
-        cursor = db_connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cursor.execute(sql, params)
-        db_connection.commit()
-        record_count = cursor.rowcount
-        db_connection.close()
+        with self.get_pool().connection() as db_connection:
+            cursor = db_connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
+            cursor.execute(sql, params)
+            db_connection.commit()
+            record_count = cursor.rowcount
+            cursor.close()
         return record_count
 
+    def execute_batch_upsert(self, sql, rows, page_size=None):
+        # Writes many rows with one statement per page of rows, e.g.
+        # INSERT INTO t (a, b) VALUES %s ON CONFLICT (a) DO UPDATE SET b = EXCLUDED.b.
+        # Every page is committed together.
+        with self.unit_of_work() as uow:
+            return uow.execute_batch_upsert(sql, rows, page_size)
+
 # @reconnect
     def execute_delete(self, sql, params):
-        db_connection = self.connect()
-        cursor = db_connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cursor.execute(sql, params)
-        db_connection.close()
+        with self.get_pool().connection() as db_connection:
+            cursor = db_connection.cursor(cursor_factory=psycopg2.extras.DictCursor)
+            cursor.execute(sql, params)
+            cursor.close()
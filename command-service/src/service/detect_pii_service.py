@@ -1,33 +1,450 @@
-from typing import List
+import multiprocessing
+import os
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from threading import Lock
+from typing import Dict, List, Set, Tuple
 
-from model.data_models import PIIError, PIIResult
-from service.re_pii_model import REPIIModel
+from config import Config
+from exception.exception import UnknownLocaleException
+from model.data_models import PIIError, PIIFieldProfile, PIIModel, PIIResult
+from service.json_paths import format_path, iter_leaves
+from service.pii_profile import PIIProfile
+from service.pii_result_cache import (
+    CacheInfo,
+    PIIResultCache,
+    field_fingerprint,
+    schema_field_types,
+)
+from service.name_dictionary_model import NameDictionaryModel
+from service.re_pii_model import REPIIModel, rule_locales
+from service.scan_budget import ScanBudget
 
 
 class DetectPIIService:
-    def __init__(self) -> None:
-        self.model = REPIIModel()
+    def __init__(self, enable_process_pool: bool = True) -> None:
+        self.config = Config()
+        self.model_options = dict(
+            fieldname_cache_size=self.config.find("pii.cache.fieldname_size"),
+            value_cache_size=self.config.find("pii.cache.value_size"),
+            max_cached_value_length=self.config.find("pii.cache.max_value_length"),
+            risky_max_length=self.config.find("pii.limits.risky_max_length"),
+            reject_risky_patterns=self.config.find("pii.limits.risky_patterns") == "reject",
+        )
+        self.model = REPIIModel(**self.model_options)
+        self.detectors = self._load_detectors()
+        for detector in self.detectors:
+            self.model.add_detector(detector)
+        # Models restricted to a set of locales, each with its own caches, are
+        # built on first use and the least recently used one is dropped beyond
+        # max_rulesets
+        self.default_locales = self.config.find("pii.locales.default")
+        self.max_locale_models = self.config.find("pii.locales.max_rulesets")
+        self.locale_models: OrderedDict = OrderedDict()
+        self.locale_lock = Lock()
+        self.known_locales = sorted({locale.casefold() for locale in rule_locales(self.model.pii_rules)})
+        self.request_budget_ms = self.config.find("pii.limits.request_budget_ms")
+        self.stream_budget_ms = self.config.find("pii.limits.stream_budget_ms")
+        self.result_cache = PIIResultCache(
+            max_datasets=self.config.find("pii.result_cache.max_datasets"),
+            ttl_seconds=self.config.find("pii.result_cache.ttl_seconds"),
+        )
+        self.columnar_threshold = self.config.find("pii.columnar_threshold")
+        self.stream_batch_size = self.config.find("pii.stream.batch_size")
+        self.stream_max_line_bytes = self.config.find("pii.stream.max_line_bytes")
+        self.stream_max_inflated_bytes = self.config.find("pii.stream.max_inflated_bytes")
+        self.pool = None
+        # counters of the work done by pool workers, reported with our own
+        self.worker_counters: Dict[str, int] = {}
+        self.worker_lock = Lock()
+        self.pool_min_events = self.config.find("pii.process_pool.min_events")
+        self.pool_chunk_size = self.config.find("pii.process_pool.chunk_size")
+        if (
+            enable_process_pool
+            and self.config.find("pii.process_pool.enabled")
+            and multiprocessing.parent_process() is None
+        ):
+            self._start_pool(self.config.find("pii.process_pool.workers") or os.cpu_count())
 
-    def detect_pii_fields(self, event_data: dict) -> List[PIIResult] | PIIError:
-        try:
-            results = []
-            for field in list(event_data.keys()):
-                results += self.model.detect_pii(
-                    "address", field, str(event_data[field])
-                )
-                results += self.model.detect_pii(
-                    "financial", field, str(event_data[field])
+    def _load_detectors(self) -> List[PIIModel]:
+        detectors = []
+        if self.config.find("pii.names.enabled"):
+            detectors.append(
+                NameDictionaryModel(
+                    first_names_path=self.config.find("pii.names.first_names"),
+                    last_names_path=self.config.find("pii.names.last_names"),
+                    trie_path=self.config.find("pii.names.trie_path"),
+                    # a reason of its own, apart from that of the name field keyword
+                    reason={
+                        "code": "en",
+                        "resourceKey": self.config.find("pii.names.resource_key"),
+                        "region": "",
+                    },
+                    max_words=self.config.find("pii.names.max_words"),
                 )
-                results += self.model.detect_pii("id", field, str(event_data[field]))
-                results += self.model.detect_pii(
-                    "internet", field, str(event_data[field])
+            )
+        return detectors
+
+    def _start_pool(self, workers: int):
+        # Workers are spawned rather than forked since the parent already runs
+        # kafka client threads. Every worker loads the compiled rules once in its
+        # initializer; the warm up tasks make sure all of them are started before
+        # the first request.
+        print(f"Starting PII process pool with {workers} workers...")
+        self.pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+        )
+        list(self.pool.map(_warm_up_worker, range(workers)))
+
+    def model_for(self, locales: List[str] | None = None) -> REPIIModel:
+        # Unknown locales are a client error and raise UnknownLocaleException,
+        # which is not caught by the detect methods
+        locales = locales or self.default_locales
+        if not locales:
+            return self.model
+        key = frozenset(locale.casefold() for locale in locales)
+        unknown = key.difference(self.known_locales)
+        if len(unknown) != 0:
+            raise UnknownLocaleException(
+                f"unknown PII locales {sorted(unknown)}, valid locales are {self.known_locales}"
+            )
+        with self.locale_lock:
+            if key in self.locale_models:
+                self.locale_models.move_to_end(key)
+                return self.locale_models[key]
+        model = REPIIModel(
+            **self.model_options,
+            locales=key,
+            pii_rules=self.model.pii_rules,
+            detectors=self.detectors,
+        )
+        with self.locale_lock:
+            self.locale_models[key] = model
+            while len(self.locale_models) > self.max_locale_models:
+                self.locale_models.popitem(last=False)
+        return model
+
+    def models(self) -> List[REPIIModel]:
+        with self.locale_lock:
+            return [self.model, *self.locale_models.values()]
+
+    def cache_info(self) -> Dict[str, CacheInfo]:
+        # Cache statistics summed over the models of every locale set
+        totals = {}
+        for model in self.models():
+            for cache, info in model.cache_info().items():
+                total = totals.get(cache, CacheInfo(0, 0, 0, 0))
+                totals[cache] = CacheInfo(*(a + b for a, b in zip(total, info)))
+        # hits and misses of the worker caches, their sizes stay with the workers
+        with self.worker_lock:
+            for cache, info in totals.items():
+                totals[cache] = info._replace(
+                    hits=info.hits + self.worker_counters.get(f"{cache}_hits", 0),
+                    misses=info.misses + self.worker_counters.get(f"{cache}_misses", 0),
                 )
-                results += self.model.detect_pii("phone", field, str(event_data[field]))
-            return results
+        return totals
+
+    def prefilter_info(self) -> Dict[str, int]:
+        totals = {}
+        for model in self.models():
+            for counter, value in model.prefilter_info().items():
+                totals[counter] = totals.get(counter, 0) + value
+        with self.worker_lock:
+            for counter in totals:
+                totals[counter] += self.worker_counters.get(counter, 0)
+        return totals
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+
+    def detect_pii_fields(
+        self,
+        event_data: dict,
+        budget: ScanBudget = None,
+        dataset_id: str = None,
+        data_schema: dict = None,
+        locales: List[str] = None,
+    ) -> List[PIIResult] | PIIError:
+        """
+        Detects PII in every leaf of a single event, with the value rules of the
+        given locales only when locales are named. With a dataset_id the
+        verdicts are cached per field fingerprint and only fields that are new
+        to the dataset or changed type are analyzed, results are then grouped
+        by field.
+        """
+        budget = budget if budget is not None else ScanBudget()
+        try:
+            model = self.model_for(locales)
+            if dataset_id is None:
+                return self._detect_leaves(model, iter_leaves(event_data), budget)
+            schema_types = schema_field_types(data_schema)
+            fields = {}
+            for path, leaf_value in iter_leaves(event_data):
+                fingerprint = field_fingerprint(schema_types, path, leaf_value)
+                if fingerprint not in fields:
+                    fields[fingerprint] = []
+                fields[fingerprint].append((path, leaf_value))
+            mode = ("event", model.ruleset.locales)
+            cached = self.result_cache.get(dataset_id, mode)
+            verdicts = {}
+            for fingerprint, leaves in fields.items():
+                if fingerprint in cached:
+                    verdicts[fingerprint] = cached[fingerprint]
+                else:
+                    verdicts[fingerprint] = self._detect_leaves(model, leaves, budget)
+            self._update_result_cache(dataset_id, mode, cached, verdicts, budget)
+            return [result for verdict in verdicts.values() for result in verdict]
         except Exception as err:
-            pii_error: PIIError = {
-                "errorCode": 500,
-                "errorMsg": type(err),
-                "errorTrace": err.args,
+            return self._pii_error(err)
+
+    def _detect_leaves(self, model: REPIIModel, leaves, budget: ScanBudget) -> List[PIIResult]:
+        results = []
+        entities = model.entities
+        for path, leaf_value in leaves:
+            if budget.expired():
+                break
+            field = format_path(path)
+            value = str(leaf_value)
+            for entity in entities:
+                results += model.detect_pii(entity, field, value, path)
+        return results
+
+    def detect_pii_batch(
+        self,
+        events: List[dict],
+        budget: ScanBudget = None,
+        dataset_id: str = None,
+        data_schema: dict = None,
+        locales: List[str] = None,
+    ) -> List[PIIFieldProfile] | PIIError:
+        try:
+            if dataset_id is None:
+                return self.profile_events(events, budget=budget, locales=locales).results()
+            schema_types = schema_field_types(data_schema)
+            fingerprints = {}
+            for event_data in events:
+                for path, leaf_value in iter_leaves(event_data):
+                    field = format_path(path)
+                    if field not in fingerprints:
+                        fingerprints[field] = field_fingerprint(schema_types, path, leaf_value)
+            mode = ("batch", self.model_for(locales).ruleset.locales)
+            cached = self.result_cache.get(dataset_id, mode)
+            skip_fields = {
+                field for field, fingerprint in fingerprints.items() if fingerprint in cached
             }
-            return pii_error
+            profiled = {}
+            profile = self.profile_events(
+                events, budget=budget, skip_fields=skip_fields, locales=locales
+            )
+            for result in profile.results():
+                profiled.setdefault(result["field"], []).append(result)
+            verdicts = {
+                fingerprint: cached[fingerprint] if field in skip_fields else profiled.get(field, [])
+                for field, fingerprint in fingerprints.items()
+            }
+            self._update_result_cache(dataset_id, mode, cached, verdicts, budget)
+            return [result for verdict in verdicts.values() for result in verdict]
+        except Exception as err:
+            return self._pii_error(err)
+
+    def _update_result_cache(self, dataset_id, mode, cached, verdicts, budget: ScanBudget):
+        # Verdicts of fields not present any more are dropped, those of a scan cut
+        # short by the budget are never cached
+        hits = sum(1 for fingerprint in verdicts if fingerprint in cached)
+        self.result_cache.record(hits, len(verdicts) - hits)
+        if not budget.exhausted:
+            self.result_cache.put(dataset_id, mode, verdicts)
+
+    def profile_events(
+        self,
+        events: List[dict],
+        profile: PIIProfile = None,
+        budget: ScanBudget = None,
+        skip_fields: Set[str] = frozenset(),
+        locales: List[str] = None,
+    ) -> PIIProfile:
+        profile = profile if profile is not None else PIIProfile()
+        budget = budget if budget is not None else ScanBudget()
+        if self.pool is not None and len(events) >= self.pool_min_events:
+            return self._profile_in_pool(events, profile, budget, skip_fields, locales)
+        model = self.model_for(locales)
+        if len(events) >= self.columnar_threshold:
+            return self._profile_columns(model, events, profile, budget, skip_fields)
+        return self._profile_rows(model, events, profile, budget, skip_fields)
+
+    def _profile_in_pool(
+        self,
+        events: List[dict],
+        profile: PIIProfile,
+        budget: ScanBudget,
+        skip_fields: Set[str],
+        locales: List[str],
+    ) -> PIIProfile:
+        # Chunks are profiled by the workers and merged in order, so fields keep
+        # the order of their first appearance in the sample. Workers scan within
+        # what is left of the budget, as a wall clock deadline since they run in
+        # other processes. Once the budget is spent the chunks still queued are
+        # cancelled, running ones stop at the deadline.
+        remaining = budget.remaining()
+        deadline = None if remaining is None else time.time() + remaining
+        futures = []
+        for start in range(0, len(events), self.pool_chunk_size):
+            future = self.pool.submit(
+                _profile_chunk,
+                events[start : start + self.pool_chunk_size],
+                skip_fields,
+                locales,
+                deadline,
+            )
+            # counted also when the chunk finishes after the request gave up on it
+            future.add_done_callback(self._record_worker_counters)
+            futures.append(future)
+        try:
+            for future in futures:
+                try:
+                    chunk_profile, exhausted, _ = future.result(timeout=budget.remaining())
+                except FutureTimeoutError:
+                    budget.exhausted = True
+                    break
+                profile.merge(chunk_profile)
+                if exhausted:
+                    budget.exhausted = True
+                if budget.expired():
+                    break
+        finally:
+            for future in futures:
+                future.cancel()
+        return profile
+
+    def _record_worker_counters(self, future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        _, _, counters = future.result()
+        with self.worker_lock:
+            for counter, value in counters.items():
+                self.worker_counters[counter] = self.worker_counters.get(counter, 0) + value
+
+    def _profile_rows(
+        self,
+        model: REPIIModel,
+        events: List[dict],
+        profile: PIIProfile,
+        budget: ScanBudget,
+        skip_fields: Set[str],
+    ) -> PIIProfile:
+        # Field names are resolved once per batch, only values are scanned per event
+        entities = model.entities
+        field_reasons = {}
+        for event_data in events:
+            if budget.expired():
+                break
+            profile.events += 1
+            for path, leaf_value in iter_leaves(event_data):
+                if path not in field_reasons:
+                    field = format_path(path)
+                    field_reasons[path] = (
+                        field,
+                        None
+                        if field in skip_fields
+                        else {
+                            entity: model.detect_entity_in_path(entity, path)
+                            for entity in entities
+                        },
+                    )
+                field, reasons = field_reasons[path]
+                if reasons is None:
+                    continue
+                value = str(leaf_value)
+                field_stats = profile.observe(field)
+                for entity in entities:
+                    field_stats.entity(entity).add(
+                        model.detect_entity(entity, value), reasons[entity]
+                    )
+        return profile
+
+    def _profile_columns(
+        self,
+        model: REPIIModel,
+        events: List[dict],
+        profile: PIIProfile,
+        budget: ScanBudget,
+        skip_fields: Set[str],
+    ) -> PIIProfile:
+        # Pivots the events into one column per field so that each entity is
+        # scanned once over the joined column instead of once per event. Fields
+        # left when the budget is spent are not reported.
+        entities = model.entities
+        columns = {}
+        for event_data in events:
+            profile.events += 1
+            for path, leaf_value in iter_leaves(event_data):
+                if path not in columns:
+                    columns[path] = []
+                columns[path].append(str(leaf_value))
+        for path, values in columns.items():
+            if budget.expired():
+                break
+            field = format_path(path)
+            if field in skip_fields:
+                continue
+            field_stats = profile.observe(field, count=len(values))
+            for entity in entities:
+                field_reasons = model.detect_entity_in_path(entity, path)
+                value_matches = model.detect_entity_column(entity, values)
+                entity_stats = field_stats.entity(entity)
+                if len(field_reasons) == 0:
+                    for row in sorted(value_matches):
+                        entity_stats.add(value_matches[row], field_reasons)
+                else:
+                    for row in range(len(values)):
+                        entity_stats.add(value_matches.get(row, []), field_reasons)
+        return profile
+
+    def _pii_error(self, err: Exception) -> PIIError:
+        pii_error: PIIError = {
+            "errorCode": 500,
+            "errorMsg": type(err).__name__,
+            "errorTrace": str(err),
+        }
+        return pii_error
+
+
+_worker_service: DetectPIIService = None
+
+
+def _init_worker():
+    global _worker_service
+    _worker_service = DetectPIIService(enable_process_pool=False)
+
+
+def _warm_up_worker(_) -> int:
+    return os.getpid()
+
+
+def _worker_counters() -> Dict[str, int]:
+    counters = dict(_worker_service.prefilter_info())
+    for cache, info in _worker_service.cache_info().items():
+        counters[f"{cache}_hits"] = info.hits
+        counters[f"{cache}_misses"] = info.misses
+    return counters
+
+
+def _profile_chunk(
+    events: List[dict], skip_fields: Set[str], locales: List[str], deadline: float | None
+) -> Tuple[PIIProfile, bool, Dict[str, int]]:
+    # Profiles the chunk until deadline (epoch seconds) and returns the profile,
+    # whether the budget ran out and the counters of the work done for it
+    budget = ScanBudget(None if deadline is None else max(deadline - time.time(), 0) * 1000)
+    before = _worker_counters()
+    profile = _worker_service.profile_events(
+        events, budget=budget, skip_fields=skip_fields, locales=locales
+    )
+    after = _worker_counters()
+    counters = {counter: value - before.get(counter, 0) for counter, value in after.items()}
+    return profile, budget.exhausted, counters
@@ -0,0 +1,29 @@
+from typing import Any, Iterator, Tuple
+
+JsonPath = Tuple[str, ...]
+
+
+def iter_leaves(event: dict) -> Iterator[Tuple[JsonPath, Any]]:
+    """
+    Walks a JSON event depth first, in document order, and yields (path, leaf_value)
+    pairs without building any intermediate representation of the subtrees. The
+    path is the tuple of keys leading to the leaf; elements of an array share the
+    `key[*]` segment, following the flattened schema paths of the dataset API.
+    Empty objects and arrays are yielded as leaves.
+    """
+    stack = [((key,), value) for key, value in reversed(list(event.items()))]
+    while stack:
+        path, value = stack.pop()
+        if isinstance(value, dict) and len(value) != 0:
+            stack.extend(
+                ((*path, key), child) for key, child in reversed(list(value.items()))
+            )
+        elif isinstance(value, list) and len(value) != 0:
+            array_path = (*path[:-1], f"{path[-1]}[*]")
+            stack.extend((array_path, child) for child in reversed(value))
+        else:
+            yield path, value
+
+
+def format_path(path: JsonPath) -> str:
+    return ".".join(path)
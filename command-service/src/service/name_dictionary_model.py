@@ -0,0 +1,123 @@
+import hashlib
+import os
+import re
+import struct
+from typing import Dict, List
+
+from model.data_models import PIIModel, PIIReason, PIIResult
+from service.name_trie import NameTrie
+
+FIRST_NAME = 1
+LAST_NAME = 2
+NAME_WORDS = re.compile(r"[^\W\d_]+")
+
+
+class NameDictionaryModel(PIIModel):
+    """
+    Detects person names in values by looking their words up in dictionaries of
+    first and last names. A value is a name when it is a capitalized first name
+    on its own, or when it has a first name and a different last name with at
+    most one unknown word longer than two letters and no more than max_words
+    words. The name lists are compiled into a memory-mapped trie. The trie
+    records a digest of the paths and contents of the lists, and is rebuilt
+    when they do not match.
+    """
+
+    entities = ["name"]
+
+    def __init__(
+        self,
+        first_names_path: str,
+        last_names_path: str,
+        trie_path: str,
+        reason: PIIReason,
+        max_words: int = 4,
+    ):
+        self.reason = reason
+        self.max_words = max_words
+        sources = {first_names_path: FIRST_NAME, last_names_path: LAST_NAME}
+        digest = self._source_digest(sources)
+        self.trie = self._open_trie(trie_path, digest)
+        if self.trie is None:
+            words = {}
+            for path, flag in sources.items():
+                for word in self._read_names(path):
+                    words[word] = words.get(word, 0) | flag
+            print(f"Building name trie {trie_path} from {len(words)} names...")
+            NameTrie.build(trie_path, words, digest)
+            self.trie = NameTrie(trie_path)
+
+    def _source_digest(self, sources: Dict[str, int]) -> bytes:
+        digest = hashlib.sha256()
+        for path, flag in sources.items():
+            digest.update(f"{os.path.abspath(path)}\0{flag}\0".encode())
+            with open(path, "rb") as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+        return digest.digest()
+
+    def _open_trie(self, trie_path: str, digest: bytes) -> NameTrie | None:
+        # The trie at trie_path when it was built from the same lists
+        try:
+            trie = NameTrie(trie_path)
+        except (OSError, ValueError, struct.error):
+            return None
+        if trie.source_digest != digest:
+            trie.close()
+            return None
+        return trie
+
+    def _read_names(self, path: str) -> List[str]:
+        with open(path, "r", encoding="utf-8") as f:
+            return [
+                line.strip().lower()
+                for line in f
+                if line.strip() != "" and not line.startswith("#")
+            ]
+
+    def detect_pii(self, entity, field, value) -> List[PIIResult]:
+        reasons = self.detect_entity(entity, value)
+        if len(reasons) == 0:
+            return []
+        result: PIIResult = {
+            "field": field,
+            "type": entity,
+            "score": 1 / len(reasons),
+            "reason": reasons,
+        }
+        return [result]
+
+    def detect_entity(self, entity, value) -> List[PIIReason]:
+        words = NAME_WORDS.findall(value)
+        if len(words) == 0 or len(words) > self.max_words:
+            return []
+        first, last = [], []
+        for index, word in enumerate(words):
+            flags = self.trie.lookup(word.lower())
+            if flags & FIRST_NAME:
+                first.append(index)
+            if flags & LAST_NAME:
+                last.append(index)
+        if len(words) == 1:
+            is_name = len(first) != 0 and words[0][0].isupper()
+        else:
+            matched = set(first) | set(last)
+            # initials and titles such as Dr or Mr are not held against a name
+            unknown = [
+                word for index, word in enumerate(words) if index not in matched and len(word) > 2
+            ]
+            is_name = len(unknown) <= 1 and any(i != j for i in first for j in last)
+        if not is_name:
+            return []
+        reason: PIIReason = {**self.reason, "score": 1.0}
+        return [reason]
+
+    def detect_many(self, entity, values: List[str]) -> List[List[PIIReason]]:
+        verdicts = {}
+        for value in values:
+            if value not in verdicts:
+                verdicts[value] = self.detect_entity(entity, value)
+        return [verdicts[value] for value in values]
+
+    def detect_entity_in_fieldname(self, entity, value) -> List[PIIReason]:
+        # field names are matched by the keyword rules of the regex model
+        return []
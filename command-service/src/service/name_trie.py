@@ -0,0 +1,97 @@
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from typing import Dict
+
+MAGIC = b"PIITRIE2"
+# magic, byte order, node count, edge count, digest of the sources the trie was
+# built from, padded to keep the arrays aligned
+HEADER = struct.Struct("<8s1s3xII4x32s")
+
+
+class NameTrie:
+    """
+    Read-only byte trie over lowercased words, stored in a file that is memory
+    mapped instead of loaded. Nodes and edges live in flat arrays: a node points
+    at a contiguous run of edges sorted by label byte, an edge points at its
+    child node, and every node carries the flags of the word ending there.
+    Opening the file costs no parsing and the pages stay shared with the page
+    cache, so every worker process maps the same memory.
+
+    Sections are laid out so each array is aligned to its item size:
+    node first edge (u32), edge child (u32), node edge count (u16), edge label
+    (u8), node flags (u8).
+    """
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, byteorder, nodes, edges, self.source_digest = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC or byteorder != sys.byteorder[0].encode():
+            self.buffer.close()
+            raise ValueError(f"{path} is not a name trie of this platform")
+        view = memoryview(self.buffer)
+        offset = HEADER.size
+        self.first_edge = view[offset : offset + 4 * nodes].cast("I")
+        offset += 4 * nodes
+        self.edge_child = view[offset : offset + 4 * edges].cast("I")
+        offset += 4 * edges
+        self.edge_count = view[offset : offset + 2 * nodes].cast("H")
+        offset += 2 * nodes
+        self.edge_label = view[offset : offset + edges]
+        offset += edges
+        self.flags = view[offset : offset + nodes]
+
+    def lookup(self, word: str) -> int:
+        # Flags of the word, 0 when it is not in the trie
+        node = 0
+        for byte in word.encode():
+            start = self.first_edge[node]
+            end = start + self.edge_count[node]
+            index = bisect_left(self.edge_label, byte, start, end)
+            if index == end or self.edge_label[index] != byte:
+                return 0
+            node = self.edge_child[index]
+        return self.flags[node]
+
+    def close(self):
+        for section in (self.first_edge, self.edge_child, self.edge_count, self.edge_label, self.flags):
+            section.release()
+        self.buffer.close()
+
+    @staticmethod
+    def build(path: str, words: Dict[str, int], source_digest: bytes = b""):
+        """
+        Writes the trie of words -> flags to path, with the digest of the
+        sources it is built from (up to 32 bytes). The file is written next to
+        the target and renamed, so processes building concurrently never see a
+        partial file.
+        """
+        root = {}
+        for word, word_flags in words.items():
+            node = root
+            for byte in word.encode():
+                node = node.setdefault(byte, {})
+            node[None] = node.get(None, 0) | word_flags
+        # Breadth first numbering keeps the edges of a node contiguous
+        nodes = [root]
+        first_edge, edge_count, flags = array("I"), array("H"), array("B")
+        edge_child, edge_label = array("I"), array("B")
+        for node in nodes:
+            labels = sorted(label for label in node if label is not None)
+            first_edge.append(len(edge_label))
+            edge_count.append(len(labels))
+            flags.append(node.get(None, 0))
+            for label in labels:
+                edge_label.append(label)
+                edge_child.append(len(nodes))
+                nodes.append(node[label])
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, sys.byteorder[0].encode(), len(nodes), len(edge_label), source_digest))
+            for section in (first_edge, edge_child, edge_count, edge_label, flags):
+                section.tofile(f)
+        os.replace(tmp_path, path)
@@ -0,0 +1,110 @@
+import json
+import zlib
+from typing import List
+
+from exception.exception import NDJSONDecodeException
+
+GZIP_MAGIC = b"\x1f\x8b"
+# compressed input is inflated at most this many bytes at a time
+INFLATE_CHUNK_BYTES = 64 * 1024
+
+
+class NDJSONDecoder:
+    """
+    Incremental decoder for newline delimited JSON request bodies, optionally gzip
+    compressed. Chunks are fed as they arrive, compressed ones are inflated a
+    bounded piece at a time, and only the trailing incomplete line is buffered, so
+    memory does not grow with the size of the upload. Compression is detected from
+    the gzip magic bytes unless it is given explicitly.
+
+    Lines longer than max_line_bytes, inflated input beyond max_inflated_bytes,
+    malformed gzip and lines that are not JSON objects raise
+    NDJSONDecodeException.
+    """
+
+    def __init__(
+        self,
+        compressed: bool | None = None,
+        max_line_bytes: int | None = None,
+        max_inflated_bytes: int | None = None,
+    ):
+        self.compressed = compressed
+        self.max_line_bytes = max_line_bytes
+        self.max_inflated_bytes = max_inflated_bytes
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        # pieces of the trailing incomplete line
+        self.buffer: List[bytes] = []
+        self.buffered = 0
+        self.inflated = 0
+        self.lines = 0
+
+    def feed(self, data: bytes) -> List[dict]:
+        if len(data) == 0:
+            return []
+        if self.compressed is None:
+            self.compressed = data.startswith(GZIP_MAGIC)
+        if self.compressed:
+            return self._decompress(data)
+        return self._split(data)
+
+    def close(self) -> List[dict]:
+        if self.compressed and not self.decompressor.eof and self.inflated != 0:
+            raise NDJSONDecodeException("gzip body is truncated")
+        lines, self.buffer, self.buffered = [b"".join(self.buffer)], [], 0
+        return self._decode(lines)
+
+    def _decompress(self, data: bytes) -> List[dict]:
+        events = []
+        while True:
+            try:
+                output = self.decompressor.decompress(data, INFLATE_CHUNK_BYTES)
+            except zlib.error as e:
+                raise NDJSONDecodeException(f"gzip body is malformed - {e}")
+            events += self._split(output)
+            # Concatenated gzip members are valid gzip, continue with a new stream
+            if self.decompressor.eof and len(self.decompressor.unused_data) != 0:
+                data = self.decompressor.unused_data
+                self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                continue
+            data = self.decompressor.unconsumed_tail
+            if len(data) == 0 and len(output) < INFLATE_CHUNK_BYTES:
+                return events
+
+    def _split(self, data: bytes) -> List[dict]:
+        self.inflated += len(data)
+        if self.max_inflated_bytes is not None and self.inflated > self.max_inflated_bytes:
+            raise NDJSONDecodeException(f"body is larger than {self.max_inflated_bytes} bytes")
+        if b"\n" not in data:
+            self.buffer.append(data)
+            self.buffered += len(data)
+            self._check_line_length(self.buffered)
+            return []
+        first, *lines, last = data.split(b"\n")
+        self.buffer.append(first)
+        lines.insert(0, b"".join(self.buffer))
+        self.buffer, self.buffered = [last], len(last)
+        for line in lines:
+            self._check_line_length(len(line))
+        self._check_line_length(self.buffered)
+        return self._decode(lines)
+
+    def _check_line_length(self, length: int):
+        if self.max_line_bytes is not None and length > self.max_line_bytes:
+            raise NDJSONDecodeException(
+                f"line {self.lines + 1} is longer than {self.max_line_bytes} bytes"
+            )
+
+    def _decode(self, lines: List[bytes]) -> List[dict]:
+        events = []
+        for line in lines:
+            self.lines += 1
+            if len(line.strip()) == 0:
+                continue
+            try:
+                event = json.loads(line)
+            except ValueError as e:
+                raise NDJSONDecodeException(f"line {self.lines} is not valid JSON - {e}")
+            if not isinstance(event, dict):
+                raise NDJSONDecodeException(f"line {self.lines} is not a JSON object")
+            events.append(event)
+        return events
@@ -0,0 +1,247 @@
+import json
+import math
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Tuple
+
+from model.data_models import DatasetStatusType, PIIFieldProfile
+from service.db_service import DatabaseService
+from service.pii_profile import PIIProfile
+from service.scan_budget import ScanBudget
+
+
+@dataclass
+class MonitoredDataset:
+    dataset_id: str
+    topic: str
+
+
+@dataclass
+class TopicSample:
+    dataset_id: str
+    topic: str
+    # records produced since the previous sample, of which read were sampled
+    produced: int
+    read: int
+    events: int
+    results: List[PIIFieldProfile]
+    incomplete: bool = False
+
+
+class SampleConsumer:
+    """
+    Reads ranges of records from the partitions of a topic. Offsets are never
+    committed, the monitor keeps track of what it has seen itself.
+    """
+
+    def offsets(self, topic: str) -> Dict[int, Tuple[int, int]]:
+        # partition -> (first offset, end offset)
+        return {}
+
+    def read(self, topic: str, partition: int, start: int, end: int, timeout_ms: int) -> List[bytes]:
+        return []
+
+    def close(self):
+        pass
+
+
+class KafkaSampleConsumer(SampleConsumer):
+    def __init__(self, brokers: str):
+        from kafka import KafkaConsumer
+
+        self.consumer = KafkaConsumer(
+            bootstrap_servers=brokers,
+            group_id=None,
+            enable_auto_commit=False,
+            auto_offset_reset="latest",
+        )
+
+    def offsets(self, topic: str) -> Dict[int, Tuple[int, int]]:
+        from kafka import TopicPartition
+
+        partitions = self.consumer.partitions_for_topic(topic) or set()
+        tps = [TopicPartition(topic, partition) for partition in sorted(partitions)]
+        if len(tps) == 0:
+            return {}
+        first = self.consumer.beginning_offsets(tps)
+        end = self.consumer.end_offsets(tps)
+        return {tp.partition: (first[tp], end[tp]) for tp in tps}
+
+    def read(self, topic: str, partition: int, start: int, end: int, timeout_ms: int) -> List[bytes]:
+        from kafka import TopicPartition
+
+        tp = TopicPartition(topic, partition)
+        self.consumer.assign([tp])
+        self.consumer.seek(tp, start)
+        records = []
+        deadline = time.monotonic() + timeout_ms / 1000
+        while self.consumer.position(tp) < end:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            batch = self.consumer.poll(
+                timeout_ms=int(remaining * 1000), max_records=end - self.consumer.position(tp)
+            )
+            for record in batch.get(tp, []):
+                if record.offset < end:
+                    records.append(record.value)
+        return records
+
+    def close(self):
+        self.consumer.close()
+
+
+class InMemorySampleConsumer(SampleConsumer):
+    """
+    Consumer over topics kept in memory, to run the monitor without a broker.
+    """
+
+    def __init__(self):
+        self.topics: Dict[str, Dict[int, List[bytes]]] = {}
+
+    def produce(self, topic: str, value, partition: int = 0):
+        if not isinstance(value, bytes):
+            value = json.dumps(value).encode("utf-8")
+        self.topics.setdefault(topic, {}).setdefault(partition, []).append(value)
+
+    def offsets(self, topic: str) -> Dict[int, Tuple[int, int]]:
+        partitions = self.topics.get(topic, {})
+        return {partition: (0, len(records)) for partition, records in partitions.items()}
+
+    def read(self, topic: str, partition: int, start: int, end: int, timeout_ms: int) -> List[bytes]:
+        return self.topics[topic][partition][start:end]
+
+
+def live_datasets(db_service: DatabaseService) -> List[MonitoredDataset]:
+    query = "SELECT dataset_id, router_config FROM datasets WHERE status = %s"
+    records = db_service.execute_select_all(sql=query, params=(DatasetStatusType.Live.name,))
+    return [
+        MonitoredDataset(record["dataset_id"], record["router_config"]["topic"])
+        for record in records
+        if record["router_config"] and record["router_config"].get("topic")
+    ]
+
+
+def unwrap_events(message) -> List[dict]:
+    # Ingested messages carry a single event or a batch of events of a dataset
+    if not isinstance(message, dict):
+        return []
+    if isinstance(message.get("event"), dict):
+        return [message["event"]]
+    if isinstance(message.get("events"), list):
+        return [event for event in message["events"] if isinstance(event, dict)]
+    return [message]
+
+
+class PIIMonitor:
+    """
+    Samples the Kafka topics of live datasets in the background and profiles the
+    samples for PII, so fields that start carrying PII after a dataset was
+    published are noticed.
+
+    Every interval the monitor reads sample_fraction of the records produced to
+    each topic since its previous sample, taken from the end of each partition
+    and capped at max_events records per topic. Whatever was produced in between
+    is skipped, so the monitor never falls behind the pipeline however busy a
+    topic gets. A sample is profiled in batches of batch_size events within
+    budget_ms, and the per-field PII rates are handed to on_sample.
+    """
+
+    def __init__(
+        self,
+        pii_service,
+        consumer: SampleConsumer,
+        datasets: Callable[[], List[MonitoredDataset]],
+        on_sample: Callable[[TopicSample], None],
+        sample_fraction: float = 0.01,
+        max_events: int = 5000,
+        batch_size: int = 1000,
+        interval_seconds: float = 300,
+        budget_ms: int | None = None,
+        poll_timeout_ms: int = 5000,
+    ):
+        self.pii_service = pii_service
+        self.consumer = consumer
+        self.datasets = datasets
+        self.on_sample = on_sample
+        self.sample_fraction = sample_fraction
+        self.max_events = max_events
+        self.batch_size = batch_size
+        self.interval_seconds = interval_seconds
+        self.budget_ms = budget_ms
+        self.poll_timeout_ms = poll_timeout_ms
+        # (topic, partition) -> end offset seen by the previous sample
+        self.positions: Dict[Tuple[str, int], int] = {}
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.stop_event.clear()
+        self.thread = threading.Thread(target=self._run, name="pii-monitor", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        self.consumer.close()
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            try:
+                self.run_once()
+            except Exception as e:
+                print("PII monitor | Error while sampling live datasets - ", e)
+            self.stop_event.wait(self.interval_seconds)
+
+    def run_once(self) -> List[TopicSample]:
+        samples = []
+        for dataset in self.datasets():
+            if self.stop_event.is_set():
+                break
+            try:
+                sample = self.sample(dataset)
+            except Exception as e:
+                print(f"PII monitor | Error while sampling topic {dataset.topic} of dataset {dataset.dataset_id} - ", e)
+                continue
+            self.on_sample(sample)
+            samples.append(sample)
+        return samples
+
+    def sample(self, dataset: MonitoredDataset) -> TopicSample:
+        offsets = self.consumer.offsets(dataset.topic)
+        per_partition = max(1, self.max_events // max(1, len(offsets)))
+        produced, records = 0, []
+        for partition, (first, end) in offsets.items():
+            key = (dataset.topic, partition)
+            start = max(first, self.positions.get(key, first))
+            self.positions[key] = end
+            produced += max(0, end - start)
+            count = min(math.ceil((end - start) * self.sample_fraction), per_partition)
+            if count > 0:
+                records += self.consumer.read(
+                    dataset.topic, partition, end - count, end, self.poll_timeout_ms
+                )
+        events = []
+        for record in records:
+            try:
+                events += unwrap_events(json.loads(record))
+            except ValueError:
+                continue
+        profile = PIIProfile()
+        budget = ScanBudget(self.budget_ms)
+        for start in range(0, len(events), self.batch_size):
+            self.pii_service.profile_events(events[start : start + self.batch_size], profile, budget)
+            if budget.expired():
+                break
+        return TopicSample(
+            dataset_id=dataset.dataset_id,
+            topic=dataset.topic,
+            produced=produced,
+            read=len(records),
+            events=profile.events,
+            results=profile.results(),
+            incomplete=budget.exhausted,
+        )
@@ -0,0 +1,116 @@
+from typing import Dict, List
+
+from model.data_models import PIIFieldProfile, PIIReason
+
+
+class ReasonStats:
+    def __init__(self, reason: PIIReason):
+        self.reason = reason
+        self.score_sum = 0.0
+        self.count = 0
+
+    def add(self, score: float):
+        self.score_sum += score
+        self.count += 1
+
+    def merge(self, other: "ReasonStats"):
+        self.score_sum += other.score_sum
+        self.count += other.count
+
+
+class EntityStats:
+    def __init__(self):
+        self.score_sum = 0.0
+        self.matched_events = 0
+        self.reasons: Dict[tuple, ReasonStats] = {}
+
+    def add(self, value_reasons: List[PIIReason], field_reasons: List[PIIReason]):
+        reasons = value_reasons + field_reasons
+        if len(reasons) == 0:
+            return
+        self.score_sum += 1 / len(reasons)
+        if len(value_reasons) != 0:
+            self.matched_events += 1
+        for reason in reasons:
+            key = (reason["code"], reason["resourceKey"], reason["region"])
+            if key not in self.reasons:
+                self.reasons[key] = ReasonStats(reason)
+            self.reasons[key].add(reason["score"])
+
+    def merge(self, other: "EntityStats"):
+        self.score_sum += other.score_sum
+        self.matched_events += other.matched_events
+        for key, stats in other.reasons.items():
+            if key not in self.reasons:
+                self.reasons[key] = ReasonStats(stats.reason)
+            self.reasons[key].merge(stats)
+
+
+class FieldStats:
+    def __init__(self):
+        self.events = 0
+        self.entities: Dict[str, EntityStats] = {}
+
+    def entity(self, entity: str) -> EntityStats:
+        if entity not in self.entities:
+            self.entities[entity] = EntityStats()
+        return self.entities[entity]
+
+    def merge(self, other: "FieldStats"):
+        self.events += other.events
+        for entity, stats in other.entities.items():
+            self.entity(entity).merge(stats)
+
+
+class PIIProfile:
+    """
+    Running per-field aggregate of PII detections over a sample of events.
+
+    For every (field, entity) pair the profile keeps the number of events whose
+    value matched, the merged reasons and the sum of the per-event scores that
+    detect_pii would have reported. The confidence score of a field is the mean
+    per-event score, so a profile of a single event reports the same score as the
+    single event analysis. Profiles built over disjoint chunks of a sample can be
+    merged.
+    """
+
+    def __init__(self):
+        self.events = 0
+        self.fields: Dict[str, FieldStats] = {}
+
+    def observe(self, field: str, count: int = 1) -> FieldStats:
+        if field not in self.fields:
+            self.fields[field] = FieldStats()
+        field_stats = self.fields[field]
+        field_stats.events += count
+        return field_stats
+
+    def merge(self, other: "PIIProfile") -> "PIIProfile":
+        self.events += other.events
+        for field, stats in other.fields.items():
+            if field not in self.fields:
+                self.fields[field] = FieldStats()
+            self.fields[field].merge(stats)
+        return self
+
+    def results(self) -> List[PIIFieldProfile]:
+        results = []
+        for field, field_stats in self.fields.items():
+            for entity, stats in field_stats.entities.items():
+                if len(stats.reasons) == 0:
+                    continue
+                reasons: List[PIIReason] = [
+                    {**reason.reason, "score": reason.score_sum / reason.count}
+                    for reason in stats.reasons.values()
+                ]
+                result: PIIFieldProfile = {
+                    "field": field,
+                    "type": entity,
+                    "score": stats.score_sum / field_stats.events,
+                    "reason": reasons,
+                    "match_rate": stats.matched_events / field_stats.events,
+                    "matched_events": stats.matched_events,
+                    "total_events": field_stats.events,
+                }
+                results.append(result)
+        return results
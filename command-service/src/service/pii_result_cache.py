@@ -0,0 +1,111 @@
+import time
+from collections import OrderedDict, namedtuple
+from threading import Lock
+from typing import Dict, FrozenSet, List, Tuple
+
+from service.json_paths import JsonPath, format_path
+
+# (field, type) of a flattened field
+FieldFingerprint = Tuple[str, str]
+# (kind of request, locales of the ruleset or None for all) verdicts are cached for
+CacheMode = Tuple[str, FrozenSet[str] | None]
+
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "maxsize", "currsize"])
+
+JSON_TYPES = {
+    str: "string",
+    bool: "boolean",
+    int: "integer",
+    float: "number",
+    dict: "object",
+    list: "array",
+    type(None): "null",
+}
+
+
+def schema_field_types(data_schema: dict | None) -> Dict[str, str]:
+    """
+    Flattens the properties of a dataset's data_schema into field -> type, with
+    the same field names iter_leaves produces for events (key[*] for arrays).
+    """
+    types = {}
+    if not data_schema:
+        return types
+    stack = [((), data_schema)]
+    while stack:
+        path, schema = stack.pop()
+        if "properties" in schema:
+            for key, prop in schema["properties"].items():
+                stack.append((path + (key,), prop))
+        elif "items" in schema and isinstance(schema["items"], dict) and len(path) != 0:
+            stack.append((path[:-1] + (f"{path[-1]}[*]",), schema["items"]))
+        elif len(path) != 0:
+            types[format_path(path)] = str(schema.get("type"))
+    return types
+
+
+def field_fingerprint(
+    schema_types: Dict[str, str], path: JsonPath, leaf_value
+) -> FieldFingerprint:
+    # Fields missing from the schema fall back to the JSON type of the value
+    field = format_path(path)
+    return field, schema_types.get(field, JSON_TYPES.get(type(leaf_value), "string"))
+
+
+class PIIResultCache:
+    """
+    Verdicts of the fields analyzed for a dataset, keyed by field fingerprint,
+    so re-profiling a sample only analyzes the fields that were added or whose
+    type changed. Datasets are evicted least recently used first once
+    max_datasets is exceeded, and entries older than ttl_seconds are dropped.
+    The cached verdicts are shared between callers and must not be mutated.
+    """
+
+    def __init__(self, max_datasets: int = 1000, ttl_seconds: int | None = None):
+        self.max_datasets = max_datasets
+        self.ttl_seconds = ttl_seconds
+        self.entries: OrderedDict = OrderedDict()
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, dataset_id: str, mode: CacheMode) -> Dict[FieldFingerprint, List[dict]]:
+        key = (dataset_id, mode)
+        with self.lock:
+            if key not in self.entries:
+                return {}
+            created, verdicts = self.entries[key]
+            if self.ttl_seconds is not None and time.monotonic() - created > self.ttl_seconds:
+                del self.entries[key]
+                return {}
+            self.entries.move_to_end(key)
+            return verdicts
+
+    def put(self, dataset_id: str, mode: CacheMode, verdicts: Dict[FieldFingerprint, List[dict]]):
+        key = (dataset_id, mode)
+        with self.lock:
+            self.entries[key] = (time.monotonic(), verdicts)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_datasets:
+                self.entries.popitem(last=False)
+
+    def record(self, hits: int, misses: int):
+        with self.lock:
+            self.hits += hits
+            self.misses += misses
+
+    def cache_info(self) -> CacheInfo:
+        # hits and misses count fields, the size counts datasets
+        with self.lock:
+            return CacheInfo(self.hits, self.misses, self.max_datasets, len(self.entries))
+
+    def invalidate(self, dataset_id: str | None = None) -> int:
+        with self.lock:
+            if dataset_id is None:
+                count = len(self.entries)
+                self.entries.clear()
+                return count
+            keys = [key for key in self.entries if key[0] == dataset_id]
+            for key in keys:
+                del self.entries[key]
+            return len(keys)
@@ -1,26 +1,378 @@
 import re
-from typing import List
+from bisect import bisect_right
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, FrozenSet, List
 
 import yaml
 
+try:
+    from re import _constants as sre_constants
+    from re import _parser as sre_parse
+except ImportError:
+    import sre_constants
+    import sre_parse
+
 from model.data_models import PIIModel, PIIReason, PIIResult
+from service.json_paths import JsonPath
+
+INLINE_FLAGS = re.compile(r"^\(\?([imsx]+)\)")
+STRING_ANCHORS = re.compile(r"\\[AZ]")
+COLUMN_SEPARATOR = "\n"
+FIELD_NAME_SEPARATORS = re.compile(r"[\W_]+")
+CAMEL_CASE_TOKENS = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+ASCII_DIGITS = {ord(ch): None for ch in "0123456789"}
+ASCII_UPPERCASE = {ord(ch): None for ch in "ABCDEFGHIJKLMNOPQRSTUVWXYZ"}
+REPEATS = {
+    sre_constants.MAX_REPEAT,
+    sre_constants.MIN_REPEAT,
+    getattr(sre_constants, "POSSESSIVE_REPEAT", sre_constants.MAX_REPEAT),
+}
+
+
+class ValueFeatures:
+    """
+    Cheap signature of a value, derived once and checked against the declared
+    requirements of every rule before any regex runs. Digits are counted like the
+    regex digit class counts them, including non-ASCII decimals.
+    """
+
+    def __init__(self, value: str):
+        self.value = value
+        self.length = len(value)
+        if value.isascii():
+            self.digits = self.length - len(value.translate(ASCII_DIGITS))
+        else:
+            self.digits = sum(1 for ch in value if ch.isdecimal())
+        self.uppercase = self.length - len(value.translate(ASCII_UPPERCASE))
+
+
+@dataclass
+class RuleRequirements:
+    min_length: int = 0
+    min_digits: int = 0
+    min_uppercase: int = 0
+    chars: str = ""
+    any_chars: str = ""
+
+    def satisfied_by(self, features: ValueFeatures) -> bool:
+        return (
+            features.length >= self.min_length
+            and features.digits >= self.min_digits
+            and features.uppercase >= self.min_uppercase
+            and all(ch in features.value for ch in self.chars)
+            and (len(self.any_chars) == 0 or any(ch in features.value for ch in self.any_chars))
+        )
+
+
+@dataclass
+class CompiledRule:
+    name: str
+    pattern: re.Pattern
+    code: str
+    resourceKey: str
+    locale: str
+    requires: RuleRequirements | None = None
+    # only this many leading characters of a value are scanned
+    max_length: int | None = None
+
+
+@dataclass
+class KeywordRule:
+    entity: str
+    keywords: List[str]
+    code: str
+    resourceKey: str
+    locale: str
+
+
+@dataclass
+class EntityRules:
+    entity: str
+    rules: List[CompiledRule]
+    gate: re.Pattern | None = None
+    column_gate: re.Pattern | None = None
+    min_width: int = 0
+    # longer values bypass the gate, it cannot apply the limits of single rules
+    max_gate_length: int | None = None
+
+
+class PIIRuleSet:
+    """
+    Compiled form of pii_rules.yml. The keywords of the field-name rules are
+    indexed by token, so one lookup per token of a field name covers every
+    entity. Every value rule is compiled once at load time and the value rules
+    of an entity are additionally combined into a single named-group
+    alternation, so a value without any match for the entity is rejected in one
+    scan instead of one scan per rule.
+
+    Value rules are checked for constructs prone to catastrophic backtracking
+    at load time. A risky rule without a max_length of its own is either
+    bounded to risky_max_length characters or, with reject_risky_patterns,
+    refused.
+
+    A ruleset can be restricted to a set of locales (compared case
+    insensitively), value rules without a locale are always part of it.
+    """
+
+    def __init__(
+        self,
+        pii_rules: dict,
+        risky_max_length: int = 256,
+        reject_risky_patterns: bool = False,
+        locales: FrozenSet[str] | None = None,
+    ):
+        self.risky_max_length = risky_max_length
+        self.reject_risky_patterns = reject_risky_patterns
+        self.locales = locales
+        if locales is not None:
+            unknown = locales - {locale.casefold() for locale in rule_locales(pii_rules)}
+            if len(unknown) != 0:
+                raise ValueError(f"unknown PII locales {sorted(unknown)}")
+        self.keys: Dict[str, KeywordRule] = {
+            entity: self._compile_keyword_rule(entity, rule)
+            for entity, rule in pii_rules["keys"].items()
+        }
+        self.keyword_index: Dict[str, List[str]] = {}
+        for entity, rule in self.keys.items():
+            for keyword in rule.keywords:
+                self.keyword_index.setdefault(keyword, []).append(entity)
+        self.values: Dict[str, EntityRules] = {}
+        for entity, rules in pii_rules["values"].items():
+            if locales is not None:
+                rules = {
+                    name: rule
+                    for name, rule in rules.items()
+                    if rule["locale"] == "" or rule["locale"].casefold() in locales
+                }
+            compiled = [
+                self._bound_risky_rule(f"{entity}.{name}", self._compile_rule(name, rule))
+                for name, rule in rules.items()
+            ]
+            gate = self._compile_gate(rules) if len(rules) != 0 else None
+            max_lengths = [rule.max_length for rule in compiled if rule.max_length is not None]
+            self.values[entity] = EntityRules(
+                entity=entity,
+                rules=compiled,
+                gate=gate,
+                column_gate=self._compile_column_gate(gate),
+                min_width=self._min_width(gate),
+                max_gate_length=min(max_lengths) if len(max_lengths) != 0 else None,
+            )
+
+    @property
+    def entities(self) -> List[str]:
+        return list(self.values.keys())
+
+    def _compile_keyword_rule(self, entity, rule) -> KeywordRule:
+        keywords = [str(keyword).lower() for keyword in rule["keywords"]]
+        for keyword in keywords:
+            if tokenize_field_name(keyword) != [keyword]:
+                raise ValueError(f"PII keyword {keyword!r} of {entity} is not a single token")
+        return KeywordRule(
+            entity=entity,
+            keywords=keywords,
+            code=rule["code"],
+            resourceKey=rule["resourceKey"],
+            locale=rule["locale"],
+        )
+
+    def _compile_rule(self, name, rule) -> CompiledRule:
+        return CompiledRule(
+            name=name,
+            pattern=re.compile(rule["rule"]),
+            code=rule["code"],
+            resourceKey=rule["resourceKey"],
+            locale=rule["locale"],
+            requires=RuleRequirements(**rule["requires"]) if "requires" in rule else None,
+            max_length=rule.get("max_length"),
+        )
+
+    def _bound_risky_rule(self, name: str, rule: CompiledRule) -> CompiledRule:
+        risks = backtracking_risks(rule.pattern)
+        if len(risks) == 0 or rule.max_length is not None:
+            return rule
+        if self.reject_risky_patterns:
+            raise ValueError(
+                f"PII rule {name} is prone to catastrophic backtracking "
+                f"({', '.join(risks)}) and declares no max_length"
+            )
+        print(
+            f"PII rule {name} is prone to catastrophic backtracking ({', '.join(risks)}), "
+            f"scanning at most {self.risky_max_length} characters"
+        )
+        rule.max_length = self.risky_max_length
+        return rule
+
+    def _compile_gate(self, rules: dict) -> re.Pattern | None:
+        # Global inline flags such as (?i) are only legal at the start of a
+        # pattern, so they are turned into scoped groups before combining.
+        alternatives = []
+        for index, (name, rule) in enumerate(rules.items()):
+            group = name if name.isidentifier() else f"rule_{index}"
+            pattern = INLINE_FLAGS.sub(r"(?\1:", rule["rule"], count=1)
+            if pattern != rule["rule"]:
+                pattern += ")"
+            alternatives.append(f"(?P<{group}>{pattern})")
+        try:
+            return re.compile("|".join(alternatives))
+        except re.error as err:
+            print(f"PII rules cannot be combined, scanning rule by rule: {err}")
+            return None
+
+    def _compile_column_gate(self, gate: re.Pattern | None) -> re.Pattern | None:
+        # Variant of the gate for values joined by COLUMN_SEPARATOR. In multiline
+        # mode ^ and $ also match at row boundaries, so every row with a match of
+        # its own is touched by some match in the joined buffer. Absolute string
+        # anchors have no per-row equivalent and disable the columnar scan.
+        if gate is None or STRING_ANCHORS.search(gate.pattern):
+            return None
+        return re.compile(gate.pattern, re.MULTILINE)
+
+    def _min_width(self, gate: re.Pattern | None) -> int:
+        # Shortest value the gate can match, shorter values never need a scan
+        if gate is None:
+            return 0
+        return sre_parse.parse(gate.pattern, gate.flags).getwidth()[0]
+
+
+def rule_locales(pii_rules: dict) -> List[str]:
+    # Locales named by the value rules, rules for every region have none
+    return sorted(
+        {rule["locale"] for rules in pii_rules["values"].values() for rule in rules.values()}
+        - {""}
+    )
+
+
+def tokenize_field_name(name: str) -> List[str]:
+    """
+    Splits a field name into lowercase tokens on separators and, for ASCII
+    words, on case changes and digits: userEmail, user_email and USER-EMAIL all
+    give ["user", "email"], IPAddress gives ["ip", "address"].
+    """
+    if name.isascii():
+        # the token pattern never matches separators, one scan covers the name
+        tokens = CAMEL_CASE_TOKENS.findall(name)
+        return tokens if name.islower() else [token.lower() for token in tokens]
+    tokens = []
+    for word in FIELD_NAME_SEPARATORS.split(name):
+        if len(word) == 0:
+            continue
+        if word.isascii():
+            tokens += [token.lower() for token in CAMEL_CASE_TOKENS.findall(word)]
+        else:
+            tokens.append(word.lower())
+    return tokens
+
+
+def backtracking_risks(pattern: re.Pattern) -> List[str]:
+    """
+    Static check for the two shapes that make the backtracking engine blow up
+    on long inputs: a quantified group containing an unbounded quantifier,
+    which is exponential, and several unbounded quantifiers in one sequence,
+    which is polynomial in the value length. Lookarounds are checked as well
+    since they are evaluated at every position.
+    """
+    risks = []
+
+    def unbounded(items) -> bool:
+        for op, av in items:
+            if op in REPEATS and av[1] == sre_constants.MAXREPEAT:
+                return True
+            if any(unbounded(sub) for sub in _subpatterns(op, av)):
+                return True
+        return False
+
+    def walk(items):
+        sequence_repeats = 0
+        for op, av in items:
+            if op in REPEATS:
+                if av[1] == sre_constants.MAXREPEAT:
+                    sequence_repeats += 1
+                if av[1] > 1 and unbounded(av[2]):
+                    risks.append("nested quantifiers")
+            for sub in _subpatterns(op, av):
+                walk(sub)
+        if sequence_repeats > 1:
+            risks.append("consecutive unbounded quantifiers")
+
+    walk(sre_parse.parse(pattern.pattern, pattern.flags))
+    return list(dict.fromkeys(risks))
+
+
+def _subpatterns(op, av) -> list:
+    if op in REPEATS:
+        return [av[2]]
+    if op == sre_constants.SUBPATTERN:
+        return [av[3]]
+    if op == sre_constants.BRANCH:
+        return av[1]
+    if op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+        return [av[1]]
+    if op == getattr(sre_constants, "ATOMIC_GROUP", None):
+        return [av]
+    if op == sre_constants.GROUPREF_EXISTS:
+        return [sub for sub in av[1:] if sub is not None]
+    return []
 
 
 class REPIIModel(PIIModel):
-    def __init__(self):
+    def __init__(
+        self,
+        fieldname_cache_size: int = 4096,
+        value_cache_size: int = 65536,
+        max_cached_value_length: int = 64,
+        risky_max_length: int = 256,
+        reject_risky_patterns: bool = False,
+        locales: FrozenSet[str] | None = None,
+        pii_rules: dict | None = None,
+        detectors: List[PIIModel] | None = None,
+    ):
         def join(loader, node):
             seq = loader.construct_sequence(node)
             return "".join([str(i) for i in seq])
 
-        yaml.add_constructor("!join", join)
-        with open("config/pii_rules.yml", "r") as f:
-            self.pii_rules = yaml.load(f, Loader=yaml.FullLoader)
+        if pii_rules is None:
+            yaml.add_constructor("!join", join)
+            with open("config/pii_rules.yml", "r") as f:
+                pii_rules = yaml.load(f, Loader=yaml.FullLoader)
+        self.pii_rules = pii_rules
+        self.ruleset = PIIRuleSet(
+            self.pii_rules, risky_max_length, reject_risky_patterns, locales
+        )
+        # Entities of plugged in detectors are evaluated by the detector instead
+        # of value rules, field names still go through the keyword rules
+        self.detectors: Dict[str, PIIModel] = {}
+        for detector in detectors or []:
+            self.add_detector(detector)
+        # Field names repeat in every event and short values are often enum-like,
+        # so both detections are memoized in bounded LRU caches. The cached reason
+        # lists are shared between callers and must not be mutated.
+        self.max_cached_value_length = max_cached_value_length
+        self._fieldname_cache = lru_cache(maxsize=fieldname_cache_size)(
+            self._detect_entities_in_path
+        )
+        self._value_cache = lru_cache(maxsize=value_cache_size)(self._detect_entity)
+        # Every entity is checked against the same value, derive its features once
+        self._value_features = lru_cache(maxsize=256)(ValueFeatures)
+        self.regex_executions = 0
+        self.prefilter_skips = 0
 
-    def detect_pii(self, entity, field, value) -> List[PIIResult]:
+    def add_detector(self, detector: PIIModel):
+        for entity in detector.entities:
+            self.detectors[entity] = detector
+
+    @property
+    def entities(self) -> List[str]:
+        return self.ruleset.entities + [
+            entity for entity in self.detectors if entity not in self.ruleset.values
+        ]
+
+    def detect_pii(self, entity, field, value, path: JsonPath = None) -> List[PIIResult]:
         results = []
         reasons = []
         reasons += self.detect_entity(entity, value)
-        reasons += self.detect_entity_in_fieldname(entity, field)
+        reasons += self.detect_entity_in_path(entity, path if path is not None else (field,))
         if len(reasons) != 0:
             score = 1 / len(reasons)
             result: PIIResult = {
@@ -32,33 +384,142 @@ class REPIIModel(PIIModel):
             results.append(result)
         return results
 
+    def cache_info(self) -> Dict[str, tuple]:
+        return {
+            "fieldname": self._fieldname_cache.cache_info(),
+            "value": self._value_cache.cache_info(),
+        }
+
+    def prefilter_info(self) -> Dict[str, int]:
+        return {
+            "executions": self.regex_executions,
+            "skipped": self.prefilter_skips,
+        }
+
     def detect_entity(self, entity, value) -> List[PIIReason]:
+        if len(value) <= self.max_cached_value_length:
+            return self._value_cache(entity, value)
+        return self._detect_entity(entity, value)
+
+    def _detect_entity(self, entity, value) -> List[PIIReason]:
+        if entity in self.detectors:
+            return self.detectors[entity].detect_entity(entity, value)
+        entity_rules = self.ruleset.values[entity]
+        rules = self._prefilter(entity_rules, value)
+        if len(rules) == 0:
+            # the combined gate is skipped as well
+            self.prefilter_skips += 1
+            return []
+        if entity_rules.gate is not None and self._fits_gate(entity_rules, value):
+            self.regex_executions += 1
+            if entity_rules.gate.search(value) is None:
+                return []
+        return self._match_rules(rules, value)
+
+    def _fits_gate(self, entity_rules: EntityRules, value) -> bool:
+        return entity_rules.max_gate_length is None or len(value) <= entity_rules.max_gate_length
+
+    def _prefilter(self, entity_rules: EntityRules, value) -> List[CompiledRule]:
+        features = self._value_features(value)
+        rules = [
+            rule
+            for rule in entity_rules.rules
+            if rule.requires is None or rule.requires.satisfied_by(features)
+        ]
+        self.prefilter_skips += len(entity_rules.rules) - len(rules)
+        return rules
+
+    def _match_rules(self, rules: List[CompiledRule], value) -> List[PIIReason]:
         matches = []
-        for rule in list(self.pii_rules["values"][entity].keys()):
-            rule_matches = list(
-                re.findall(self.pii_rules["values"][entity][rule]["rule"], value)
-            )
+        self.regex_executions += len(rules)
+        for rule in rules:
+            rule_matches = rule.pattern.findall(value[: rule.max_length])
             if len(rule_matches) != 0:
                 reason: PIIReason = {
-                    "code": self.pii_rules["values"][entity][rule]["code"],
-                    "resourceKey": self.pii_rules["values"][entity][rule][
-                        "resourceKey"
-                    ],
-                    "region": self.pii_rules["values"][entity][rule]["locale"],
+                    "code": rule.code,
+                    "resourceKey": rule.resourceKey,
+                    "region": rule.locale,
                     "score": 1 / len(rule_matches),
                 }
                 matches.append(reason)
         return matches
 
-    def detect_entity_in_fieldname(self, entity, value) -> List[PIIReason]:
-        matches = []
-        rule_matches = list(re.findall(self.pii_rules["keys"][entity]["rule"], value))
-        if len(rule_matches) != 0:
+    def detect_entity_column(self, entity, values: List[str]) -> Dict[int, List[PIIReason]]:
+        """
+        Detects the entity over a column of values. Repeated values are scanned
+        once and the distinct values long enough to match are joined and scanned
+        by the combined gate in one pass. Values touched by a gate match are
+        verified rule by rule, so the reasons are identical to scanning row by
+        row. Returns the reasons of the matching rows keyed by row index.
+        """
+        if entity in self.detectors:
+            distinct = list(dict.fromkeys(values))
+            verdicts = dict(zip(distinct, self.detectors[entity].detect_many(entity, distinct)))
+            return {
+                row: verdicts[value] for row, value in enumerate(values) if len(verdicts[value]) != 0
+            }
+        entity_rules = self.ruleset.values[entity]
+        if len(entity_rules.rules) == 0:
+            return {}
+        distinct = [
+            value for value in dict.fromkeys(values) if len(value) >= entity_rules.min_width
+        ]
+        if entity_rules.column_gate is None:
+            candidates = distinct
+        else:
+            gated = [value for value in distinct if self._fits_gate(entity_rules, value)]
+            starts = []
+            offset = 0
+            for value in gated:
+                starts.append(offset)
+                offset += len(value) + len(COLUMN_SEPARATOR)
+            buffer = COLUMN_SEPARATOR.join(gated)
+            touched = set()
+            for match in entity_rules.column_gate.finditer(buffer):
+                first = bisect_right(starts, match.start()) - 1
+                last = bisect_right(starts, max(match.end() - 1, match.start())) - 1
+                touched.update(range(first, last + 1))
+            self.regex_executions += 1
+            candidates = [gated[index] for index in touched]
+            if len(gated) != len(distinct):
+                candidates += [
+                    value for value in distinct if not self._fits_gate(entity_rules, value)
+                ]
+        value_reasons = {}
+        for value in candidates:
+            reasons = self._match_rules(self._prefilter(entity_rules, value), value)
+            if len(reasons) != 0:
+                value_reasons[value] = reasons
+        if len(value_reasons) == 0:
+            return {}
+        return {
+            row: value_reasons[value]
+            for row, value in enumerate(values)
+            if value in value_reasons
+        }
+
+    def detect_entity_in_path(self, entity, path: JsonPath) -> List[PIIReason]:
+        return self._fieldname_cache(path).get(entity, [])
+
+    def _detect_entities_in_path(self, path: JsonPath) -> Dict[str, List[PIIReason]]:
+        # Every key of a nested path is tokenized, each keyword token counts as
+        # one match of the entities it belongs to
+        match_counts = {}
+        for segment in path:
+            for token in tokenize_field_name(segment):
+                for entity in self.ruleset.keyword_index.get(token, ()):
+                    match_counts[entity] = match_counts.get(entity, 0) + 1
+        reasons = {}
+        for entity, match_count in match_counts.items():
+            rule = self.ruleset.keys[entity]
             reason: PIIReason = {
-                "code": self.pii_rules["keys"][entity]["code"],
-                "resourceKey": self.pii_rules["keys"][entity]["resourceKey"],
-                "region": self.pii_rules["keys"][entity]["locale"],
-                "score": 1 / len(rule_matches),
+                "code": rule.code,
+                "resourceKey": rule.resourceKey,
+                "region": rule.locale,
+                "score": 1 / match_count,
             }
-            matches.append(reason)
-        return matches
+            reasons[entity] = [reason]
+        return reasons
+
+    def detect_entity_in_fieldname(self, entity, value) -> List[PIIReason]:
+        return self.detect_entity_in_path(entity, (value,))
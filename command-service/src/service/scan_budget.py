@@ -0,0 +1,24 @@
+import time
+
+
+class ScanBudget:
+    """
+    Wall clock budget of a single PII analysis request. The scanning loops check
+    it between values and stop once it is spent, the budget then stays
+    exhausted so the caller can mark the partial result as incomplete. A single
+    regex scan cannot be interrupted, the per-rule max_length bounds those.
+    """
+
+    def __init__(self, millis: int | None = None):
+        self.deadline = None if millis is None else time.monotonic() + millis / 1000
+        self.exhausted = False
+
+    def expired(self) -> bool:
+        if not self.exhausted and self.deadline is not None:
+            self.exhausted = time.monotonic() >= self.deadline
+        return self.exhausted
+
+    def remaining(self) -> float | None:
+        if self.deadline is None:
+            return None
+        return max(self.deadline - time.monotonic(), 0)
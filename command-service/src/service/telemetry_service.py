@@ -4,7 +4,7 @@ import os
 from kafka import KafkaProducer
 
 from config import Config
-from model.telemetry_models import Actor, Audit, Context, Object, Pdata, Telemetry
+from model.telemetry_models import Actor, Audit, Context, Object, Pdata, PIIRates, Telemetry
 
 
 class TelemetryService:
@@ -36,3 +36,10 @@ class TelemetryService:
 
         if self.producer:
             self.producer.send(self.topic, data)
+
+    def metric(self, object_: Object, edata: PIIRates):
+        event = Telemetry(
+            actor=self.actor, context=self.context, object=object_, edata=edata, eid="METRIC"
+        )
+        if self.producer:
+            self.producer.send(self.topic, event.to_json())